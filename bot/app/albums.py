@@ -0,0 +1,72 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+from aiogram.types import Message
+
+from app.config import settings
+
+log = logging.getLogger(__name__)
+
+OnAlbum = Callable[[list[Message]], Awaitable[None]]
+
+
+class AlbumCollector:
+    """
+    Склейка альбомов: Telegram присылает каждое фото альбома отдельным апдейтом
+    с общим media_group_id. Сообщения копятся, пока альбом «затихнет» на delay сек,
+    после чего on_album вызывается один раз со всеми сообщениями по порядку.
+    Хендлер не ждёт таймера и сразу возвращается — обработка следующих апдейтов чата не блокируется.
+    Следующее сообщение чата может прийти раньше таймера — его хендлер сначала зовёт flush_chat.
+    """
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self._groups: dict[str, list[Message]] = {}
+        self._handlers: dict[str, OnAlbum] = {}
+        self._timers: dict[str, asyncio.TimerHandle] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def add(self, message: Message, on_album: OnAlbum):
+        group_id = message.media_group_id
+        self._groups.setdefault(group_id, []).append(message)
+        self._handlers[group_id] = on_album
+        timer = self._timers.pop(group_id, None)
+        if timer is not None:
+            timer.cancel()
+        loop = asyncio.get_running_loop()
+        self._timers[group_id] = loop.call_later(self.delay, self._complete, group_id)
+
+    def _take(self, group_id: str) -> tuple[OnAlbum, list[Message]]:
+        self._timers.pop(group_id).cancel()
+        messages = sorted(self._groups.pop(group_id), key=lambda m: m.message_id)
+        return self._handlers.pop(group_id), messages
+
+    def _complete(self, group_id: str):
+        on_album, messages = self._take(group_id)
+        task = asyncio.create_task(self._run(on_album, messages), name=f"album:{messages[0].chat.id}")
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush_chat(self, chat_id: int) -> bool:
+        # альбомы чата, которые ещё копятся или обрабатываются, — довести до конца сейчас.
+        # -> True, если такие были (состояние чата могло поменяться)
+        flushed = False
+        for group_id in [g for g, messages in self._groups.items() if messages[0].chat.id == chat_id]:
+            await self._run(*self._take(group_id))
+            flushed = True
+        running = [task for task in self._tasks if task.get_name() == f"album:{chat_id}"]
+        if running:
+            await asyncio.wait(running)
+            flushed = True
+        return flushed
+
+    @staticmethod
+    async def _run(on_album: OnAlbum, messages: list[Message]):
+        try:
+            await on_album(messages)
+        except Exception:
+            log.exception("album %s failed", messages[0].media_group_id)
+
+
+albums = AlbumCollector(settings.ALBUM_DEBOUNCE)
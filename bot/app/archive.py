@@ -0,0 +1,202 @@
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import Any
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramEntityTooLarge,
+    TelegramNetworkError,
+    TelegramNotFound,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+from sqlalchemy import select, update
+from sqlalchemy.dialects.postgresql import insert
+
+from app import metrics
+from app.config import settings
+from app.db import SessionLocal
+from app.models import Homework, HomeworkAttachment, StoredFile, StoredFileId
+from app.partitions import PARTITIONED, in_month, month_key
+
+log = logging.getLogger(__name__)
+
+# модели с колонками id / file_id / file_sha256, файлы которых архивируются
+ARCHIVED_MODELS: list[Any] = [Homework, HomeworkAttachment]
+
+RETRIES = 3
+
+# повтор не поможет: файл больше лимита getFile (20 МБ), file_id недействителен
+PERMANENT_ERRORS = (TelegramBadRequest, TelegramNotFound, TelegramEntityTooLarge)
+
+archived = metrics.Counter("bot_archive_files_total", "Archived homework files by result")
+archived_bytes = metrics.Counter("bot_archive_bytes_total", "Bytes downloaded into the archive")
+
+# (модель, id строки, file_id, месяц партиции строки — partitions.month_key; None у непартиционированных)
+Job = tuple[Any, int, str, int | None]
+
+
+class _HashingWriter:
+    # файл-приёмник для bot.download: пишет чанки на диск и сразу считает sha256 — файл целиком в памяти не держим
+    def __init__(self, raw):
+        self.raw = raw
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, chunk: bytes) -> int:
+        self.hash.update(chunk)
+        self.size += len(chunk)
+        return self.raw.write(chunk)
+
+    def flush(self):
+        # aiogram зовёт flush после каждого чанка; буфер сбрасываем при закрытии
+        pass
+
+
+class Archiver:
+    """
+    Фоновое архивирование файлов ДЗ в контентно-адресуемое хранилище:
+    <root>/ab/cd/<sha256>. Сначала getFile (без скачивания): file_unique_id уже известен —
+    строка ДЗ сразу получает его хеш, трафика нет. Иначе файл стримится чанками во временный файл
+    и по хешу либо переносится на место, либо (тот же контент под другим id) удаляется.
+    Скачиваний одновременно не больше concurrency.
+    """
+
+    def __init__(self, root: str, concurrency: int):
+        self.root = Path(root) if root else None
+        self.concurrency = concurrency
+        self.queue: asyncio.Queue[tuple[Job, int]] = asyncio.Queue()
+
+    def path_for(self, sha256: str) -> Path:
+        return self.root / sha256[:2] / sha256[2:4] / sha256
+
+    def submit(self, model: Any, row_id: int, file_id: str, month: int | None = None):
+        # вызывать после коммита строки
+        if self.root is not None:
+            self.queue.put_nowait(((model, row_id, file_id, month), 0))
+
+    async def _download(self, bot: Bot, file_path: str) -> tuple[str, int]:
+        tmp_dir = self.root / "tmp"
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as raw:
+                writer = _HashingWriter(raw)
+                await bot.download_file(file_path, destination=writer, seek=False)
+            sha256 = writer.hash.hexdigest()
+            target = self.path_for(sha256)
+            if target.exists():
+                archived.inc(result="duplicate")
+            else:
+                target.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(tmp_name, target)
+                archived.inc(result="new")
+                archived_bytes.inc(writer.size)
+            return sha256, writer.size
+        finally:
+            if os.path.exists(tmp_name):
+                os.unlink(tmp_name)
+
+    @staticmethod
+    async def _known(file_unique_id: str) -> str | None:
+        async with SessionLocal() as s:
+            return await s.scalar(select(StoredFileId.sha256).where(StoredFileId.file_unique_id == file_unique_id))
+
+    async def _store(self, job: Job, file_unique_id: str, sha256: str, size: int | None):
+        model, row_id, _, month = job
+        async with SessionLocal() as s:
+            if size is not None:
+                await s.execute(insert(StoredFile).values(sha256=sha256, size=size).on_conflict_do_nothing())
+                await s.execute(
+                    insert(StoredFileId).values(file_unique_id=file_unique_id, sha256=sha256).on_conflict_do_nothing()
+                )
+            await s.execute(update(model).where(model.id == row_id, *in_month(model, month)).values(file_sha256=sha256))
+            await s.commit()
+
+    async def _fail(self, job: Job, error: str):
+        model, row_id, _, month = job
+        async with SessionLocal() as s:
+            await s.execute(
+                update(model).where(model.id == row_id, *in_month(model, month)).values(archive_error=error[:500])
+            )
+            await s.commit()
+
+    async def _process(self, bot: Bot, job: Job, attempt: int):
+        model, row_id, file_id, _ = job
+        try:
+            file = await bot.get_file(file_id)
+            sha256 = await self._known(file.file_unique_id)
+            if sha256 is not None:
+                archived.inc(result="known")
+                size = None
+            else:
+                sha256, size = await self._download(bot, file.file_path)
+        except (TelegramNetworkError, TelegramServerError, TelegramRetryAfter) as e:
+            if attempt + 1 >= RETRIES:
+                archived.inc(result="failed")
+                log.warning("archive %s #%s: giving up: %s", model.__tablename__, row_id, e)
+                return
+            delay = e.retry_after if isinstance(e, TelegramRetryAfter) else 2 ** attempt
+            asyncio.get_running_loop().call_later(delay, self.queue.put_nowait, (job, attempt + 1))
+            return
+        except PERMANENT_ERRORS as e:
+            # отмечаем в строке — после рестарта backfill её не возьмёт
+            archived.inc(result="unavailable")
+            log.warning("archive %s #%s: file unavailable: %s", model.__tablename__, row_id, e)
+            await self._fail(job, str(e))
+            return
+        except Exception as e:
+            archived.inc(result="failed")
+            log.warning("archive %s #%s failed: %s", model.__tablename__, row_id, e)
+            return
+        await self._store(job, file.file_unique_id, sha256, size)
+
+    async def worker(self, bot: Bot):
+        while True:
+            job, attempt = await self.queue.get()
+            try:
+                await self._process(bot, job, attempt)
+            except Exception:
+                log.exception("archive job %s failed", job[:2])
+            finally:
+                self.queue.task_done()
+
+    async def backfill(self):
+        # всё, что не успели заархивировать до рестарта; keyset по id, частичный индекс *_unarchived
+        for model in ARCHIVED_MODELS:
+            last_id = 0
+            while True:
+                async with SessionLocal() as s:
+                    rows = (await s.execute(
+                        select(model.id, model.file_id, model.created_at)
+                        .where(
+                            model.file_id.is_not(None),
+                            model.file_sha256.is_(None),
+                            model.archive_error.is_(None),
+                            model.id > last_id,
+                        )
+                        .order_by(model.id)
+                        .limit(settings.ARCHIVE_BACKFILL_BATCH)
+                    )).all()
+                if not rows:
+                    break
+                for row in rows:
+                    self.submit(model, row.id, row.file_id, month_key(row.created_at) if model in PARTITIONED else None)
+                last_id = rows[-1].id
+
+    def start(self, bot: Bot, backfill: bool = True) -> list[asyncio.Task]:
+        # backfill — только в одном процессе (в режиме супервизора — воркер 0)
+        if self.root is None:
+            return []
+        tasks = [asyncio.create_task(self.worker(bot)) for _ in range(self.concurrency)]
+        if backfill:
+            tasks.append(asyncio.create_task(self.backfill()))
+        return tasks
+
+
+archiver = Archiver(settings.ARCHIVE_DIR, settings.ARCHIVE_CONCURRENCY)
@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from sqlalchemy import select, update
+
+from app import metrics
+from app.config import settings
+from app.db import SessionLocal
+from app.delivery import execute
+from app.models import Broadcast, User
+from app.outbox import from_json
+from app.repo import any_id, broadcast_recipients
+from app.sender import TokenBucket, sender
+from app.users import users
+
+log = logging.getLogger(__name__)
+
+PROGRESS_INTERVAL = 5.0
+# как часто воркер 0 проверяет рассылки, запущенные в других процессах
+WATCH_INTERVAL = 2.0
+
+broadcast_messages = metrics.Counter("bot_broadcast_messages_total", "Broadcast deliveries by result")
+
+
+class BroadcastEngine:
+    """
+    Рассылка по всем пользователям без загрузки списка в память.
+    Получатели читаются по возрастанию tg_id сегментами по BROADCAST_SEGMENT
+    (server-side cursor, порции yield_per = BROADCAST_CHUNK; транзакция не живёт всю рассылку).
+    После каждой порции — чекпоинт last_tg_id и счётчиков: после падения рассылка продолжается
+    с последней завершённой порции (её получатели могут получить сообщение повторно).
+    Темп — своя квота BROADCAST_RATE поверх общего sender (retry-after, лимит на чат).
+    В режиме супервизора рассылки идут только в воркере 0 (enabled); запущенную в другом воркере
+    он подхватывает из БД (watch).
+    """
+
+    def __init__(self, rate: float, segment: int, chunk: int):
+        self.bucket = TokenBucket(rate, rate)
+        self.segment = segment
+        self.chunk = chunk
+        self.enabled = True
+        self._tasks: dict[int, asyncio.Task] = {}
+
+    def start(self, bot: Bot, broadcast_id: int):
+        if not self.enabled or broadcast_id in self._tasks:
+            return
+        task = asyncio.create_task(self._run(bot, broadcast_id))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda t: self._done(broadcast_id, t))
+
+    def _done(self, broadcast_id: int, task: asyncio.Task):
+        self._tasks.pop(broadcast_id, None)
+        if not task.cancelled() and task.exception() is not None:
+            # статус остаётся running — рассылка продолжится с чекпоинта после рестарта
+            log.error("broadcast #%s crashed", broadcast_id, exc_info=task.exception())
+
+    async def resume(self, bot: Bot):
+        # рассылки, прерванные рестартом
+        async with SessionLocal() as s:
+            ids = (await s.scalars(select(Broadcast.id).where(Broadcast.status == "running"))).all()
+        for broadcast_id in ids:
+            if broadcast_id not in self._tasks:
+                log.info("broadcast #%s: resuming", broadcast_id)
+                self.start(bot, broadcast_id)
+
+    async def watch(self, bot: Bot, interval: float = WATCH_INTERVAL):
+        # рассылки, запущенные из других процессов
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.resume(bot)
+            except Exception:
+                log.exception("broadcast watch failed")
+
+    async def _deliver(self, bot: Bot, call, tg_id: int) -> str:
+        await self.bucket.acquire()
+        try:
+            await sender.call(tg_id, lambda: execute(bot, tg_id, call))
+        except TelegramForbiddenError:
+            return "blocked"
+        except TelegramBadRequest as e:
+            # chat not found / user is deactivated — писать туда бесполезно
+            return "blocked" if "chat not found" in e.message or "deactivated" in e.message else "failed"
+        except Exception as e:
+            log.warning("broadcast to %s failed: %s", tg_id, e)
+            return "failed"
+        return "sent"
+
+    async def _checkpoint(self, broadcast_id: int, last_tg_id: int, results: list[str], blocked: list[int]) -> str:
+        # -> текущий статус (его может поменять /broadcast_stop)
+        async with SessionLocal() as s:
+            status = await s.scalar(
+                update(Broadcast)
+                .where(Broadcast.id == broadcast_id)
+                .values(
+                    last_tg_id=last_tg_id,
+                    sent=Broadcast.sent + results.count("sent"),
+                    failed=Broadcast.failed + results.count("failed"),
+                    blocked=Broadcast.blocked + len(blocked),
+                )
+                .returning(Broadcast.status)
+            )
+            if blocked:
+                await s.execute(update(User).where(User.tg_id == any_id(blocked)).values(blocked_at=datetime.utcnow()))
+            await s.commit()
+        users.forget(blocked)
+        return status
+
+    async def _progress(self, bot: Bot, broadcast_id: int, final: bool = False):
+        async with SessionLocal() as s:
+            b = await s.get(Broadcast, broadcast_id)
+        if b is None or b.progress_chat_id is None:
+            return
+        icon = {"done": "✅", "cancelled": "⛔"}.get(b.status, "⏳") if final else "⏳"
+        text = (
+            f"{icon} Рассылка #{b.id}: {b.sent + b.failed + b.blocked} из ~{b.total}\n"
+            f"доставлено {b.sent}, заблокировали бота {b.blocked}, ошибок {b.failed}"
+        )
+        try:
+            await bot.edit_message_text(text, chat_id=b.progress_chat_id, message_id=b.progress_message_id)
+        except TelegramBadRequest:
+            pass
+
+    async def _run(self, bot: Bot, broadcast_id: int):
+        async with SessionLocal() as s:
+            b = await s.get(Broadcast, broadcast_id)
+        if b is None or b.status != "running":
+            return
+        call = (b.method, from_json(b.payload))
+        last_tg_id = b.last_tg_id
+        status = b.status
+        last_progress = time.monotonic()
+        started = time.monotonic()
+
+        while status == "running":
+            seen = 0
+            async with SessionLocal() as s:
+                result = await s.stream(
+                    broadcast_recipients(last_tg_id)
+                    .limit(self.segment)
+                    .execution_options(yield_per=self.chunk)
+                )
+                async for partition in result.partitions():
+                    tg_ids = [row.tg_id for row in partition]
+                    seen += len(tg_ids)
+                    results = await asyncio.gather(*(self._deliver(bot, call, tg_id) for tg_id in tg_ids))
+                    for r in results:
+                        broadcast_messages.inc(result=r)
+                    last_tg_id = tg_ids[-1]
+                    blocked = [tg_id for tg_id, r in zip(tg_ids, results) if r == "blocked"]
+                    status = await self._checkpoint(broadcast_id, last_tg_id, results, blocked)
+                    if status != "running":
+                        break
+                    if time.monotonic() - last_progress >= PROGRESS_INTERVAL:
+                        last_progress = time.monotonic()
+                        await self._progress(bot, broadcast_id)
+            if seen < self.segment:
+                break
+
+        if status == "running":
+            status = "done"
+        async with SessionLocal() as s:
+            await s.execute(
+                update(Broadcast)
+                .where(Broadcast.id == broadcast_id, Broadcast.status == "running")
+                .values(status=status, finished_at=datetime.utcnow())
+            )
+            await s.commit()
+        log.info("broadcast #%s %s in %.0fs", broadcast_id, status, time.monotonic() - started)
+        await self._progress(bot, broadcast_id, final=True)
+
+
+broadcaster = BroadcastEngine(
+    rate=settings.BROADCAST_RATE,
+    segment=settings.BROADCAST_SEGMENT,
+    chunk=settings.BROADCAST_CHUNK,
+)
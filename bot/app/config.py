@@ -12,17 +12,133 @@ class Settings(BaseSettings):
     POSTGRES_DB: str = "tutor"
     POSTGRES_USER: str = "tutor"
     POSTGRES_PASSWORD: str = "tutor"
+    # полный DSN вместо POSTGRES_* (отдельная база для нагрузочных тестов и т.п.)
+    DATABASE_URL: str = ""
+
+    # пул соединений. DB_PROFILE: "default" — прямое подключение к Postgres,
+    # "pgbouncer" — transaction mode: без кэша prepared statements asyncpg
+    DB_PROFILE: str = "default"
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_RECYCLE: int = 1800
+    DB_STATEMENT_CACHE_SIZE: int = 100
+    # вместо pre-ping на каждый checkout — фоновая проверка раз в N сек
+    DB_HEALTH_INTERVAL: float = 15.0
+
+    # исходящие сообщения: лимиты Telegram (глобальный и на один чат)
+    SEND_GLOBAL_RATE: float = 30.0
+    SEND_CHAT_RATE: float = 1.0
+    SEND_CHAT_BURST: int = 3
+    SEND_MAX_RETRIES: int = 3
+
+    # доставка ДЗ админам: "single" — одно сообщение с подписью и кнопками, "legacy" — 3–4 сообщения
+    HW_DELIVERY_MODE: str = "single"
+
+    # outbox: фоновые воркеры доставки уведомлений
+    OUTBOX_WORKERS: int = 2
+    OUTBOX_BATCH_SIZE: int = 50
+    OUTBOX_MAX_ATTEMPTS: int = 8
+    OUTBOX_POLL_INTERVAL: float = 1.0
+    # строки уходят воркеру в аренду на N сек: не отправил за это время (упал) — их возьмёт другой
+    OUTBOX_LEASE: float = 300.0
+
+    # приём апдейтов: "polling" или "webhook"
+    BOT_MODE: str = "polling"
+    WEBHOOK_BASE_URL: str = ""  # публичный https-адрес; пусто — webhook не регистрируется (локальные тесты)
+    WEBHOOK_PATH: str = "/webhook"
+    WEBHOOK_SECRET: str = ""
+    WEBHOOK_HOST: str = "0.0.0.0"
+    WEBHOOK_PORT: int = 8080
+
+    # обработка апдейтов (polling и webhook): один чат — по очереди, разные чаты — параллельно
+    SCHEDULER_MAX_IN_FLIGHT: int = 32  # апдейтов в обработке одновременно (на процесс)
+    SCHEDULER_CHAT_QUEUE: int = 20     # очередь одного чата (альбом — до 10 апдейтов); сверх — отбрасывается
+    SCHEDULER_MAX_PENDING: int = 1000  # всего ждущих: polling притормаживает, webhook отвечает 503
+
+    # несколько процессов по ядрам CPU: супервизор принимает апдейты (polling/webhook) и раздаёт их
+    # воркерам по consistent hash от chat id; 0/1 — всё в одном процессе
+    SUPERVISOR_WORKERS: int = 0
+    SUPERVISOR_QUEUE_SIZE: int = 1000  # буфер апдейтов на воркер (пока он занят или перезапускается)
+
+    # FSM в Postgres: локальный LRU-кэш и срок жизни брошенных сценариев (сек).
+    # FSM_CACHE_TTL — сколько кэш доверенный между апдейтами; не задан — 60 в режиме супервизора
+    # (чат всегда в одном процессе), иначе 0: реплики без привязки чатов видят изменения друг друга сразу
+    FSM_CACHE_SIZE: int = 10_000
+    FSM_CACHE_TTL: float | None = None
+    FSM_TTL: int = 7 * 24 * 3600
+
+    # пользователи: кэш известных tg_id и интервал пачечной записи (сек)
+    USER_CACHE_SIZE: int = 100_000
+    USER_FLUSH_INTERVAL: float = 0.3
+
+    # админ-очереди (/queue, /leads, /student): элементов на странице
+    QUEUE_PAGE_SIZE: int = 10
+
+    # массовая модерация: строк на один UPDATE, максимум id в одной команде
+    BULK_BATCH_SIZE: int = 100
+    BULK_MAX_IDS: int = 1000
+
+    # рассылки: своя доля общего лимита отправки (остальное — ответам и уведомлениям);
+    # получатели читаются сегментами (одна транзакция на сегмент), внутри — порциями yield_per
+    BROADCAST_RATE: float = 20.0
+    BROADCAST_SEGMENT: int = 5000
+    BROADCAST_CHUNK: int = 500
+
+    # помесячные партиции leads/homeworks: сколько месяцев создавать вперёд; партиции старше
+    # PARTITION_RETENTION_MONTHS без заявок/ДЗ в статусе new отключаются в таблицы archive_* (0 — не отключать)
+    PARTITION_MONTHS_AHEAD: int = 3
+    PARTITION_RETENTION_MONTHS: int = 12
+    PARTITION_CHECK_INTERVAL: float = 6 * 3600
+    # сколько DDL партиций ждёт блокировку таблицы (сек); не дождался — повтор на следующей проверке
+    PARTITION_LOCK_TIMEOUT: float = 2.0
+
+    # /stats: окно по умолчанию (дней), максимум и сколько секунд отчёт живёт в кэше
+    STATS_DAYS: int = 30
+    STATS_MAX_DAYS: int = 366
+    STATS_CACHE_TTL: float = 60.0
+
+    # сколько последних сообщений помнить, чтобы не делать edit_text того же экрана
+    # (только когда чаты привязаны к процессу — см. fsm_cache_ttl; иначе edit_text всегда)
+    RENDER_CACHE_SIZE: int = 50_000
+
+    # антифлуд: не больше N сообщений / нажатий от пользователя за окно (сек); админы не ограничены
+    THROTTLE_WINDOW: float = 10.0
+    THROTTLE_MESSAGE_LIMIT: int = 12
+    THROTTLE_CALLBACK_LIMIT: int = 25
+    THROTTLE_IDLE: float = 600.0
+
+    # альбом (media group) считается полученным, если N сек не приходило новых его сообщений
+    ALBUM_DEBOUNCE: float = 1.0
+
+    # локальный архив файлов ДЗ (sha256-раскладка); пусто — не архивировать
+    ARCHIVE_DIR: str = "/data/archive"
+    ARCHIVE_CONCURRENCY: int = 4
+    ARCHIVE_BACKFILL_BATCH: int = 500
+
+    # Prometheus-метрики (GET /metrics); 0 — не поднимать. По умолчанию только локально;
+    # для сбора из другого контейнера — METRICS_HOST=0.0.0.0 за закрытой сетью
+    METRICS_HOST: str = "127.0.0.1"
+    METRICS_PORT: int = 9100
 
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8", extra="ignore")
 
     @property
     def database_url(self) -> str:
+        if self.DATABASE_URL:
+            return self.DATABASE_URL
         # asyncpg driver
         return (
             f"postgresql+asyncpg://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}"
             f"@{self.POSTGRES_HOST}:{self.POSTGRES_PORT}/{self.POSTGRES_DB}"
         )
 
+    @property
+    def fsm_cache_ttl(self) -> float:
+        if self.FSM_CACHE_TTL is not None:
+            return self.FSM_CACHE_TTL
+        return 60.0 if self.SUPERVISOR_WORKERS > 1 else 0.0
+
     @property
     def admin_ids(self) -> set[int]:
         raw = [x.strip() for x in self.ADMIN_IDS.split(",") if x.strip()]
@@ -1,10 +1,47 @@
+import asyncio
+import logging
+from typing import Any
+from uuid import uuid4
+
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
 
+from app import metrics
 from app.config import settings
 
+log = logging.getLogger(__name__)
+
+
+def engine_options() -> dict[str, Any]:
+    # pre-ping выключен: SELECT 1 на каждый checkout заменён фоновой health_loop
+    options: dict[str, Any] = dict(
+        echo=False,
+        pool_pre_ping=False,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+    )
+    if make_url(settings.database_url).get_driver_name() != "asyncpg":
+        return options
+    if settings.DB_PROFILE == "pgbouncer":
+        # в transaction mode соседние транзакции идут через разные серверные соединения:
+        # именованные prepared statements ломаются, поэтому кэши выключены, имена уникальные
+        options["connect_args"] = {
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+        }
+    elif settings.DB_PROFILE == "default":
+        options["connect_args"] = {"prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE}
+    else:
+        raise ValueError(f"unknown DB_PROFILE: {settings.DB_PROFILE}")
+    return options
 
-engine = create_async_engine(settings.database_url, echo=False, pool_pre_ping=True)
+
+engine = create_async_engine(settings.database_url, **engine_options())
+metrics.install_db_hooks(engine.sync_engine)
 SessionLocal = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
 
 
@@ -13,9 +50,44 @@ class Base(DeclarativeBase):
 
 
 async def init_db():
-    # MVP: создаём таблицы автоматически.
-    # В проде лучше Alembic, но для MVP это ок.
-    from app.models import User, Lead, Homework  # noqa: F401
+    # схема сверяется по schema_version; DDL выполняется только если версия/отпечаток не совпали.
+    # Партиции leads/homeworks на ближайшие месяцы — тоже здесь: без них вставка упадёт.
+    # Старые партиции отключает только partition_loop — DETACH на старте мог бы ждать блокировку
+    from app.migrations import migrate
+    from app.partitions import maintain
+
+    if await migrate(engine):
+        log.info("schema updated")
+    await maintain(engine)
+
+
+async def warm_pool():
+    # соединения открываются заранее и возвращаются в пул: первые апдейты не платят за connect
+    async def _connect():
+        async with engine.connect():
+            pass
+
+    await asyncio.gather(*(_connect() for _ in range(engine.pool.size())))
+
+
+db_health_failures = metrics.Counter("bot_db_health_failures_total", "Failed background DB health checks")
+metrics.Gauge(
+    "bot_db_pool_connections", "DB pool connections",
+    lambda: {(("state", "checked_out"),): engine.pool.checkedout(), (("state", "idle"),): engine.pool.checkedin()},
+)
+
 
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+async def health_loop(interval: float):
+    # проверка живости базы вне горячего пути; при сбое пул сбрасывается целиком,
+    # чтобы хендлеры не получали мёртвые соединения после рестарта/failover Postgres
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with engine.connect() as conn:
+                await asyncio.wait_for(conn.exec_driver_sql("SELECT 1"), timeout=interval)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            db_health_failures.inc()
+            log.warning("db health check failed, resetting pool: %s", e)
+            await engine.dispose()
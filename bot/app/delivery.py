@@ -0,0 +1,111 @@
+from typing import Any
+
+from aiogram import Bot
+from aiogram.enums import ParseMode
+from aiogram.types import InlineKeyboardMarkup, InputMediaDocument, InputMediaPhoto, InputMediaVideo
+
+from app.config import settings
+from app.utils import md_escape
+
+# лимиты Telegram Bot API
+CAPTION_LIMIT = 1024
+TEXT_LIMIT = 4096
+
+# один запрос к Bot API: (имя метода Bot, kwargs без chat_id)
+Call = tuple[str, dict[str, Any]]
+
+
+def split_text(text: str, limit: int = TEXT_LIMIT) -> list[str]:
+    # режем по строкам, а слишком длинные строки — по лимиту
+    parts: list[str] = []
+    current = ""
+    for line in text.splitlines(keepends=True):
+        while len(line) > limit:
+            if current:
+                parts.append(current)
+                current = ""
+            parts.append(line[:limit])
+            line = line[limit:]
+        if len(current) + len(line) > limit:
+            parts.append(current)
+            current = ""
+        current += line
+    if current:
+        parts.append(current)
+    return parts or ["—"]
+
+
+def homework_calls(
+    header: str,
+    payload_type: str,
+    payload_text: str | None,
+    file_id: str | None,
+    caption: str | None,
+    actions: InlineKeyboardMarkup,
+) -> list[Call]:
+    if settings.HW_DELIVERY_MODE == "legacy":
+        return _homework_calls_legacy(header, payload_type, payload_text, file_id, caption, actions)
+
+    # single: заголовок в подписи/тексте + клавиатура действий => обычно 1 запрос на админа
+    if payload_type in ("photo", "document"):
+        media_kw = {payload_type: file_id}
+        full = header + (f"\n{md_escape(caption)}" if caption else "")
+        if len(full) <= CAPTION_LIMIT:
+            return [(f"send_{payload_type}", {**media_kw, "caption": full,
+                                              "parse_mode": ParseMode.MARKDOWN, "reply_markup": actions})]
+        # подпись ученика не влезает — отдаём её отдельным текстом
+        calls: list[Call] = [(f"send_{payload_type}", {**media_kw, "caption": header,
+                                                       "parse_mode": ParseMode.MARKDOWN, "reply_markup": actions})]
+        calls += [("send_message", {"text": part, "parse_mode": None}) for part in split_text(caption)]
+        return calls
+
+    full = header + f"\n{md_escape(payload_text or '—')}"
+    if len(full) <= TEXT_LIMIT:
+        return [("send_message", {"text": full, "parse_mode": ParseMode.MARKDOWN, "reply_markup": actions})]
+    calls = [("send_message", {"text": header, "parse_mode": ParseMode.MARKDOWN, "reply_markup": actions})]
+    calls += [("send_message", {"text": part, "parse_mode": None}) for part in split_text(payload_text or "")]
+    return calls
+
+
+_ALBUM_MEDIA = {"photo": InputMediaPhoto, "video": InputMediaVideo, "document": InputMediaDocument}
+
+
+def album_calls(
+    header: str,
+    items: list[tuple[str, str]],
+    caption: str | None,
+    actions: InlineKeyboardMarkup,
+) -> list[Call]:
+    # альбом одним send_media_group + одно сообщение с заголовком, подписью и кнопками
+    media = [_ALBUM_MEDIA[payload_type](media=file_id) for payload_type, file_id in items]
+    if settings.HW_DELIVERY_MODE == "legacy":
+        return [
+            ("send_message", {"text": header, "parse_mode": ParseMode.MARKDOWN}),
+            ("send_media_group", {"media": media}),
+            ("send_message", {"text": "Действия:", "reply_markup": actions}),
+        ]
+
+    calls: list[Call] = [("send_media_group", {"media": media})]
+    full = header + (f"\n{md_escape(caption)}" if caption else "")
+    if len(full) <= TEXT_LIMIT:
+        calls.append(("send_message", {"text": full, "parse_mode": ParseMode.MARKDOWN, "reply_markup": actions}))
+        return calls
+    calls.append(("send_message", {"text": header, "parse_mode": ParseMode.MARKDOWN, "reply_markup": actions}))
+    calls += [("send_message", {"text": part, "parse_mode": None}) for part in split_text(caption or "")]
+    return calls
+
+
+def _homework_calls_legacy(header, payload_type, payload_text, file_id, caption, actions) -> list[Call]:
+    # старый формат: заголовок, контент, отдельное сообщение с действиями
+    calls: list[Call] = [("send_message", {"text": header, "parse_mode": ParseMode.MARKDOWN})]
+    if payload_type in ("photo", "document"):
+        calls.append((f"send_{payload_type}", {payload_type: file_id, "caption": caption or "—"}))
+    else:
+        calls.append(("send_message", {"text": payload_text or "—"}))
+    calls.append(("send_message", {"text": "Действия:", "reply_markup": actions}))
+    return calls
+
+
+async def execute(bot: Bot, chat_id: int, call: Call) -> Any:
+    method, kwargs = call
+    return await getattr(bot, method)(chat_id=chat_id, **kwargs)
@@ -0,0 +1,169 @@
+import asyncio
+import csv
+import os
+import re
+import tempfile
+from datetime import date, datetime, timedelta
+from typing import Any
+
+from sqlalchemy import select
+
+from app.db import SessionLocal
+from app.models import Homework, Lead
+
+CHUNK = 1000
+
+# что выгружается: (модель, колонки); строки читаются кортежами, без ORM-объектов
+EXPORTS: dict[str, tuple[Any, list[str]]] = {
+    "leads": (Lead, ["id", "created_at", "tg_id", "student_class", "goal", "time_pref", "contact", "status"]),
+    "hw": (Homework, [
+        "id", "created_at", "updated_at", "tg_id", "student_class", "topic", "payload_type",
+        "status", "caption", "payload_text", "admin_comment", "file_sha256",
+    ]),
+}
+
+USAGE = (
+    "Использование: /export leads|hw [from=2024-09-01] [to=2024-09-30] [status=new] [class=9] [format=csv|xlsx]"
+)
+
+_DATE_RE = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+
+class ExportError(ValueError):
+    pass
+
+
+def parse_args(args: str | None) -> dict[str, Any]:
+    tokens = (args or "").split()
+    if not tokens or tokens[0] not in EXPORTS:
+        raise ExportError(USAGE)
+    params: dict[str, Any] = {"kind": tokens[0], "format": "csv"}
+    for token in tokens[1:]:
+        key, sep, value = token.partition("=")
+        if not sep or not value:
+            raise ExportError(USAGE)
+        if key in ("from", "to"):
+            try:
+                if not _DATE_RE.fullmatch(value):
+                    raise ValueError(value)
+                params[key] = date.fromisoformat(value)
+            except ValueError:
+                raise ExportError(f"Дата в формате ГГГГ-ММ-ДД: {token}")
+        elif key == "status":
+            params["status"] = value
+        elif key == "class":
+            params["student_class"] = value.replace("–", "-")
+        elif key == "format" and value in ("csv", "xlsx"):
+            params["format"] = value
+        else:
+            raise ExportError(USAGE)
+    return params
+
+
+def _query(params: dict[str, Any]):
+    model, columns = EXPORTS[params["kind"]]
+    stmt = select(*(getattr(model, c) for c in columns))
+    if "from" in params:
+        stmt = stmt.where(model.created_at >= datetime.combine(params["from"], datetime.min.time()))
+    if "to" in params:
+        # to — включительно, до конца дня
+        stmt = stmt.where(model.created_at < datetime.combine(params["to"] + timedelta(days=1), datetime.min.time()))
+    if "status" in params:
+        stmt = stmt.where(model.status == params["status"])
+    if "student_class" in params:
+        stmt = stmt.where(model.student_class == params["student_class"])
+    # тот же порядок, что у индексов (…, created_at, id)
+    return stmt.order_by(model.created_at, model.id).execution_options(yield_per=CHUNK), columns
+
+
+# ---------------- writers (работают в пуле потоков) ----------------
+
+# контакт, подпись и текст ДЗ пишет ученик: "=HYPERLINK(...)" в ячейке Excel стал бы формулой
+_FORMULA_START = ("=", "+", "-", "@", "\t", "\r")
+# управляющие символы, недопустимые в XML (openpyxl на них падает с IllegalCharacterError)
+_ILLEGAL_XML_RE = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def _safe(value: Any) -> Any:
+    if isinstance(value, str) and value.startswith(_FORMULA_START):
+        return "'" + value
+    return value
+
+
+def _safe_xlsx(value: Any) -> Any:
+    if isinstance(value, str):
+        value = _ILLEGAL_XML_RE.sub("", value)
+    return _safe(value)
+
+
+class _CsvWriter:
+    def __init__(self, path: str, columns: list[str]):
+        # BOM — чтобы Excel сразу открыл UTF-8 с кириллицей
+        self.file = open(path, "w", newline="", encoding="utf-8-sig")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(columns)
+
+    def write(self, rows: list[tuple]):
+        self.writer.writerows([_safe(v) for v in row] for row in rows)
+
+    def close(self):
+        self.file.close()
+
+
+class _XlsxWriter:
+    def __init__(self, path: str, columns: list[str]):
+        # openpyxl (requirements.txt) импортируется только для format=xlsx
+        from openpyxl import Workbook
+
+        self.path = path
+        # write_only: строки сразу уходят во временный XML, книга целиком в памяти не строится
+        self.book = Workbook(write_only=True)
+        self.sheet = self.book.create_sheet("export")
+        self.sheet.append(columns)
+
+    def write(self, rows: list[tuple]):
+        for row in rows:
+            self.sheet.append([_safe_xlsx(v) for v in row])
+
+    def close(self):
+        self.book.save(self.path)
+
+
+async def export_file(params: dict[str, Any]) -> tuple[str, int]:
+    # -> (путь к временному файлу, число строк); файл удаляет вызывающий
+    if params["format"] == "xlsx":
+        try:
+            import openpyxl  # noqa: F401
+        except ImportError:
+            raise ExportError("XLSX недоступен: не установлен openpyxl. Используйте format=csv")
+        writer_cls: Any = _XlsxWriter
+    else:
+        writer_cls = _CsvWriter
+
+    stmt, columns = _query(params)
+    fd, path = tempfile.mkstemp(suffix=f".{params['format']}")
+    os.close(fd)
+    count = 0
+    try:
+        writer = await asyncio.to_thread(writer_cls, path, columns)
+        try:
+            async with SessionLocal() as s:
+                result = await s.stream(stmt)
+                async for partition in result.partitions():
+                    rows = [tuple(row) for row in partition]
+                    await asyncio.to_thread(writer.write, rows)
+                    count += len(rows)
+        finally:
+            await asyncio.to_thread(writer.close)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path, count
+
+
+def export_filename(params: dict[str, Any]) -> str:
+    parts = [params["kind"]]
+    for key in ("from", "to", "status", "student_class"):
+        if key in params:
+            parts.append(str(params[key]))
+    return "_".join(parts) + f".{params['format']}"
@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from aiogram.types import TelegramObject
+from sqlalchemy import delete
+from sqlalchemy.dialects.postgresql import insert
+
+from app.config import settings
+from app.db import SessionLocal
+from app.metrics import fsm_transitions
+from app.models import FsmRecord
+
+log = logging.getLogger(__name__)
+
+
+class _Entry:
+    __slots__ = ("state", "data", "loaded_at")
+
+    def __init__(self, state: Optional[str], data: Dict[str, Any]):
+        self.state = state
+        self.data = data
+        self.loaded_at = time.monotonic()
+
+
+class PgStorage(BaseStorage):
+    """
+    FSM в Postgres с локальным LRU-кэшем и отложенной записью.
+    Все set_state/update_data за один апдейт копятся в кэше и сбрасываются одним upsert
+    в FsmFlushMiddleware. Записи старше ttl считаются брошенными и удаляются.
+    Между апдейтами кэш доверенный cache_ttl секунд (0 — каждый апдейт заново читает состояние из БД:
+    другая реплика могла его поменять); внутри одного апдейта прочитанное из БД повторно не читается.
+    """
+
+    def __init__(self, cache_size: int, cache_ttl: float, ttl: int):
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_business_connection_id=True, with_destiny=True)
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.ttl = timedelta(seconds=ttl)
+        self._cache: OrderedDict[str, _Entry] = OrderedDict()
+        self._dirty: set[str] = set()
+        # ключ -> начало текущего апдейта этого чата (апдейты одного чата идут по очереди)
+        self._updates: dict[str, float] = {}
+
+    # ---- cache ----
+
+    def begin_update(self, key: StorageKey) -> str:
+        k = self.key_builder.build(key)
+        self._updates[k] = time.monotonic()
+        return k
+
+    def end_update(self, k: str):
+        self._updates.pop(k, None)
+
+    def _fresh(self, k: str, entry: _Entry) -> bool:
+        if k in self._dirty or time.monotonic() - entry.loaded_at < self.cache_ttl:
+            return True
+        started = self._updates.get(k)
+        return started is not None and entry.loaded_at >= started
+
+    async def _entry(self, key: StorageKey) -> tuple[str, _Entry]:
+        k = self.key_builder.build(key)
+        entry = self._cache.get(k)
+        if entry is not None and self._fresh(k, entry):
+            self._cache.move_to_end(k)
+            return k, entry
+
+        async with SessionLocal() as s:
+            row = await s.get(FsmRecord, k)
+        if row is not None and row.updated_at >= datetime.utcnow() - self.ttl:
+            loaded = _Entry(row.state, dict(row.data or {}))
+        else:
+            loaded = _Entry(None, {})
+
+        # пока ждали БД, запись мог создать параллельный апдейт
+        entry = self._cache.get(k)
+        if entry is not None and k in self._dirty:
+            return k, entry
+        self._cache[k] = loaded
+        self._cache.move_to_end(k)
+        self._evict()
+        return k, loaded
+
+    def _evict(self):
+        while len(self._cache) > self.cache_size:
+            for k in self._cache:
+                if k not in self._dirty:
+                    del self._cache[k]
+                    break
+            else:
+                return
+
+    # ---- BaseStorage ----
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        k, entry = await self._entry(key)
+        new_state = state.state if isinstance(state, State) else state
+        if new_state != entry.state:
+            # шаги воронки: сколько раз входили в каждое состояние ("none" — выход из сценария)
+            fsm_transitions.inc(state=new_state or "none")
+        entry.state = new_state
+        self._dirty.add(k)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        _, entry = await self._entry(key)
+        return entry.state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        k, entry = await self._entry(key)
+        entry.data = data.copy()
+        self._dirty.add(k)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, entry = await self._entry(key)
+        return entry.data.copy()
+
+    async def update_data(self, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
+        k, entry = await self._entry(key)
+        entry.data.update(data)
+        self._dirty.add(k)
+        return entry.data.copy()
+
+    async def close(self) -> None:
+        await self.flush()
+
+    # ---- write-behind ----
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        keys, self._dirty = self._dirty, set()
+        now = datetime.utcnow()
+        upserts = []
+        deletes = []
+        for k in keys:
+            entry = self._cache[k]
+            if entry.state is None and not entry.data:
+                deletes.append(k)
+            else:
+                upserts.append({"key": k, "state": entry.state, "data": entry.data.copy(), "updated_at": now})
+
+        try:
+            async with SessionLocal() as s:
+                if upserts:
+                    stmt = insert(FsmRecord).values(upserts)
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=[FsmRecord.key],
+                        set_={
+                            "state": stmt.excluded.state,
+                            "data": stmt.excluded.data,
+                            "updated_at": stmt.excluded.updated_at,
+                        },
+                    )
+                    await s.execute(stmt)
+                if deletes:
+                    await s.execute(delete(FsmRecord).where(FsmRecord.key.in_(deletes)))
+                await s.commit()
+        except Exception:
+            # вернём ключи в грязные — попробуем со следующим апдейтом
+            self._dirty |= keys
+            raise
+
+    async def purge_expired(self) -> int:
+        async with SessionLocal() as s:
+            result = await s.execute(
+                delete(FsmRecord).where(FsmRecord.updated_at < datetime.utcnow() - self.ttl)
+            )
+            await s.commit()
+        return result.rowcount or 0
+
+
+class FsmFlushMiddleware(BaseMiddleware):
+    # сбрасывает накопленные изменения FSM одним запросом после обработки апдейта
+    def __init__(self, storage: PgStorage):
+        self.storage = storage
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        state = data.get("state")
+        k = self.storage.begin_update(state.key) if state is not None else None
+        try:
+            return await handler(event, data)
+        finally:
+            try:
+                await self.storage.flush()
+            except Exception:
+                log.exception("fsm flush failed")
+            if k is not None:
+                self.storage.end_update(k)
+
+
+async def purge_loop(storage: PgStorage, interval: float = 3600):
+    while True:
+        try:
+            n = await storage.purge_expired()
+            if n:
+                log.info("fsm: purged %s abandoned states", n)
+        except Exception:
+            log.exception("fsm purge failed")
+        await asyncio.sleep(interval)
+
+
+storage = PgStorage(
+    cache_size=settings.FSM_CACHE_SIZE,
+    cache_ttl=settings.fsm_cache_ttl,
+    ttl=settings.FSM_TTL,
+)
@@ -0,0 +1,58 @@
+import asyncio
+import json
+import logging
+from typing import Any, AsyncIterator
+
+import aiohttp
+from aiogram import Bot
+
+log = logging.getLogger(__name__)
+
+# событие апдейта -> где искать чат
+_CHAT_PATHS = (("chat",), ("message", "chat"), ("from",), ("user",))
+
+POLL_TIMEOUT = 30
+
+
+def update_chat_id(raw: dict[str, Any]) -> int:
+    # chat id сырого апдейта без разбора в pydantic; 0 — апдейт без чата (poll и т.п.)
+    for key, event in raw.items():
+        if key == "update_id" or not isinstance(event, dict):
+            continue
+        for path in _CHAT_PATHS:
+            obj = event
+            for part in path:
+                obj = obj.get(part) if isinstance(obj, dict) else None
+            if isinstance(obj, dict) and "id" in obj:
+                return obj["id"]
+    return 0
+
+
+async def poll_raw(bot: Bot, allowed_updates: list[str]) -> AsyncIterator[list[dict[str, Any]]]:
+    # getUpdates без разбора апдейтов в pydantic: для маршрутизации нужен только chat id,
+    # разбирает апдейт уже dp.feed_raw_update в том процессе / задаче, где он обрабатывается
+    url = bot.session.api.api_url(token=bot.token, method="getUpdates")
+    offset = 0
+    backoff = 1.0
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=POLL_TIMEOUT + 10)) as http:
+        while True:
+            params = {"timeout": POLL_TIMEOUT, "offset": offset, "allowed_updates": json.dumps(allowed_updates)}
+            try:
+                async with http.post(url, data=params) as resp:
+                    body = await resp.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                log.warning("getUpdates failed: %s; retry in %.0fs", e, backoff)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+                continue
+            if not body.get("ok"):
+                delay = body.get("parameters", {}).get("retry_after", backoff)
+                log.warning("getUpdates: %s; retry in %.0fs", body.get("description"), delay)
+                await asyncio.sleep(delay)
+                backoff = min(backoff * 2, 30.0)
+                continue
+            backoff = 1.0
+            updates = body["result"]
+            if updates:
+                offset = updates[-1]["update_id"] + 1
+                yield updates
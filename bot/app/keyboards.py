@@ -1,102 +1,187 @@
+import json
+from functools import lru_cache
+from typing import Any
+
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from pydantic import ConfigDict, PrivateAttr
 
 
-def main_menu() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📘 О занятиях", callback_data="menu:about")],
-        [InlineKeyboardButton(text="🧪 Мини-диагностика", callback_data="menu:diag")],
-        [InlineKeyboardButton(text="🗓 Записаться в группу", callback_data="lead:start")],
-        [InlineKeyboardButton(text="📝 Проверка ДЗ", callback_data="hw:start")],
-        [InlineKeyboardButton(text="⭐ Отзывы", callback_data="menu:reviews")],
-        [InlineKeyboardButton(text="❓ FAQ", callback_data="menu:faq")],
-        [InlineKeyboardButton(text="💬 Задать вопрос", callback_data="support:ask")],
+# ---------------- frozen markup ----------------
+# Статические клавиатуры собираются один раз при импорте: без повторной pydantic-валидации
+# на каждом апдейте. JSON для Bot API тоже считается один раз (см. app.tg_session).
+# Клавиатуры в aiogram 3.7 — MutableTelegramObject (frozen=False, в отличие от TelegramObject):
+# frozen=True здесь не повтор, а то, что не даёт поменять общий объект и разойтись с его _json.
+
+class FrozenButton(InlineKeyboardButton):
+    model_config = ConfigDict(frozen=True)
+
+
+class FrozenMarkup(InlineKeyboardMarkup):
+    model_config = ConfigDict(frozen=True)
+
+    # готовый JSON для Bot API (markup_json)
+    _json: str | None = PrivateAttr(default=None)
+
+
+def _prune(value: Any) -> Any:
+    # как BaseSession.prepare_value: None-поля в запрос не попадают
+    if isinstance(value, dict):
+        return {k: _prune(v) for k, v in value.items() if v is not None}
+    if isinstance(value, list):
+        return [_prune(v) for v in value]
+    return value
+
+
+def _freeze(rows: list[list[tuple[str, str]]]) -> FrozenMarkup:
+    markup = FrozenMarkup(inline_keyboard=[
+        [FrozenButton(text=text, callback_data=data) for text, data in row] for row in rows
     ])
+    markup._json = json.dumps(_prune(markup.model_dump(warnings=False)))
+    return markup
+
+
+def markup_json(markup: Any) -> str | None:
+    # готовый JSON для замороженной клавиатуры, иначе None
+    return getattr(markup, "_json", None) if isinstance(markup, FrozenMarkup) else None
+
+
+# ---------------- static keyboards ----------------
+
+_MAIN_MENU = _freeze([
+    [("📘 О занятиях", "menu:about")],
+    [("🧪 Мини-диагностика", "menu:diag")],
+    [("🗓 Записаться в группу", "lead:start")],
+    [("📝 Проверка ДЗ", "hw:start")],
+    [("⭐ Отзывы", "menu:reviews")],
+    [("❓ FAQ", "menu:faq")],
+    [("💬 Задать вопрос", "support:ask")],
+])
+
+_BACK_TO_MENU = _freeze([
+    [("🏠 В меню", "menu:home")],
+])
+
+_SUPPORT_MENU = _freeze([
+    [("🗓 Записаться", "lead:start")],
+    [("🏠 В меню", "menu:home")],
+])
+
+_LEAD_CLASS = _freeze([
+    [("1–4", "lead:class:1-4"), ("5–8", "lead:class:5-8")],
+    [("9", "lead:class:9"), ("10", "lead:class:10"), ("11", "lead:class:11")],
+])
+
+_LEAD_GOAL = _freeze([
+    [("📈 Подтянуть успеваемость", "lead:goal:improve")],
+    [("🧩 Подготовка к ОГЭ", "lead:goal:oge")],
+    [("🎯 Подготовка к ЕГЭ", "lead:goal:ege")],
+])
+
+_LEAD_TIME = _freeze([
+    [("🌤 Утро", "lead:time:morning")],
+    [("☀️ День", "lead:time:day")],
+    [("🌙 Вечер", "lead:time:evening")],
+])
+
+_LEAD_FINISH = _freeze([
+    [("✅ Отправить заявку", "lead:submit")],
+    [("🏠 В меню", "menu:home")],
+])
+
+_HW_CLASS = _freeze([
+    [("1–4", "hw:class:1-4"), ("5–8", "hw:class:5-8")],
+    [("9", "hw:class:9"), ("10", "hw:class:10"), ("11", "hw:class:11")],
+    [("🏠 В меню", "menu:home")],
+])
+
+_HW_TOPIC = _freeze([
+    [("➕ Алгебра", "hw:topic:algebra")],
+    [("📐 Геометрия", "hw:topic:geometry")],
+    [("📊 Текстовые задачи", "hw:topic:word")],
+    [("🎓 Экзамен (ОГЭ/ЕГЭ)", "hw:topic:exam")],
+    [("🏠 В меню", "menu:home")],
+])
+
+_BULK_CONFIRM = _freeze([
+    [("✅ Выполнить", "bulk:go"), ("✖️ Отмена", "bulk:cancel")],
+])
+
+
+def main_menu() -> InlineKeyboardMarkup:
+    return _MAIN_MENU
 
 
 def back_to_menu() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🏠 В меню", callback_data="menu:home")]
-    ])
+    return _BACK_TO_MENU
 
 
 def support_menu() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🗓 Записаться", callback_data="lead:start")],
-        [InlineKeyboardButton(text="🏠 В меню", callback_data="menu:home")]
-    ])
+    return _SUPPORT_MENU
 
 
 def lead_class_kb() -> InlineKeyboardMarkup:
-    buttons = [
-        InlineKeyboardButton(text="1–4", callback_data="lead:class:1-4"),
-        InlineKeyboardButton(text="5–8", callback_data="lead:class:5-8"),
-        InlineKeyboardButton(text="9", callback_data="lead:class:9"),
-        InlineKeyboardButton(text="10", callback_data="lead:class:10"),
-        InlineKeyboardButton(text="11", callback_data="lead:class:11"),
-    ]
-    return InlineKeyboardMarkup(inline_keyboard=[buttons[:2], buttons[2:]])
+    return _LEAD_CLASS
 
 
 def lead_goal_kb() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📈 Подтянуть успеваемость", callback_data="lead:goal:improve")],
-        [InlineKeyboardButton(text="🧩 Подготовка к ОГЭ", callback_data="lead:goal:oge")],
-        [InlineKeyboardButton(text="🎯 Подготовка к ЕГЭ", callback_data="lead:goal:ege")],
-    ])
+    return _LEAD_GOAL
 
 
 def lead_time_kb() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🌤 Утро", callback_data="lead:time:morning")],
-        [InlineKeyboardButton(text="☀️ День", callback_data="lead:time:day")],
-        [InlineKeyboardButton(text="🌙 Вечер", callback_data="lead:time:evening")],
-    ])
+    return _LEAD_TIME
 
 
 def lead_finish_kb() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ Отправить заявку", callback_data="lead:submit")],
-        [InlineKeyboardButton(text="🏠 В меню", callback_data="menu:home")],
-    ])
+    return _LEAD_FINISH
 
 
 def hw_class_kb() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="1–4", callback_data="hw:class:1-4"),
-         InlineKeyboardButton(text="5–8", callback_data="hw:class:5-8")],
-        [InlineKeyboardButton(text="9", callback_data="hw:class:9"),
-         InlineKeyboardButton(text="10", callback_data="hw:class:10"),
-         InlineKeyboardButton(text="11", callback_data="hw:class:11")],
-        [InlineKeyboardButton(text="🏠 В меню", callback_data="menu:home")],
-    ])
+    return _HW_CLASS
 
 
 def hw_topic_kb() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="➕ Алгебра", callback_data="hw:topic:algebra")],
-        [InlineKeyboardButton(text="📐 Геометрия", callback_data="hw:topic:geometry")],
-        [InlineKeyboardButton(text="📊 Текстовые задачи", callback_data="hw:topic:word")],
-        [InlineKeyboardButton(text="🎓 Экзамен (ОГЭ/ЕГЭ)", callback_data="hw:topic:exam")],
-        [InlineKeyboardButton(text="🏠 В меню", callback_data="menu:home")],
+    return _HW_TOPIC
+
+
+def bulk_confirm_kb() -> InlineKeyboardMarkup:
+    return _BULK_CONFIRM
+
+
+# ---------------- id-parameterised (bounded cache) ----------------
+
+# month — partitions.month_key строки: по нему поиск по id идёт в одну партицию
+
+@lru_cache(maxsize=1024)
+def admin_lead_actions(lead_id: int, month: int) -> InlineKeyboardMarkup:
+    return _freeze([
+        [("✅ Подтвердить", f"admin:lead:ok:{lead_id}:{month}"), ("❌ Отказать", f"admin:lead:no:{lead_id}:{month}")],
     ])
 
 
-def admin_lead_actions(lead_id: int) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text="✅ Подтвердить", callback_data=f"admin:lead:ok:{lead_id}"),
-            InlineKeyboardButton(text="❌ Отказать", callback_data=f"admin:lead:no:{lead_id}"),
-        ]
+@lru_cache(maxsize=1024)
+def admin_hw_actions(hw_id: int, month: int) -> InlineKeyboardMarkup:
+    ref = f"{hw_id}:{month}"
+    return _freeze([
+        [("✅ Принято", f"admin:hw:accept:{ref}"), ("🔁 На доработку", f"admin:hw:rework:{ref}")],
+        [("💬 Комментарий", f"admin:hw:comment:{ref}")],
     ])
 
 
-def admin_hw_actions(hw_id: int) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text="✅ Принято", callback_data=f"admin:hw:accept:{hw_id}"),
-            InlineKeyboardButton(text="🔁 На доработку", callback_data=f"admin:hw:rework:{hw_id}"),
-        ],
-        [
-            InlineKeyboardButton(text="💬 Комментарий", callback_data=f"admin:hw:comment:{hw_id}")
-        ],
+@lru_cache(maxsize=64)
+def broadcast_confirm_kb(broadcast_id: int) -> InlineKeyboardMarkup:
+    return _freeze([
+        [("📣 Запустить", f"bc:go:{broadcast_id}"), ("✖️ Отмена", f"bc:cancel:{broadcast_id}")],
     ])
+
+
+def queue_kb(items: list[tuple[str, str]], prev_data: str | None, next_data: str | None) -> InlineKeyboardMarkup:
+    # items: (текст кнопки, callback_data); внизу — навигация по страницам
+    rows = [[InlineKeyboardButton(text=text, callback_data=data)] for text, data in items]
+    nav = []
+    if prev_data:
+        nav.append(InlineKeyboardButton(text="◀️ Назад", callback_data=prev_data))
+    if next_data:
+        nav.append(InlineKeyboardButton(text="Вперёд ▶️", callback_data=next_data))
+    if nav:
+        rows.append(nav)
+    return InlineKeyboardMarkup(inline_keyboard=rows)
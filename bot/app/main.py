@@ -1,10 +1,15 @@
 import asyncio
-from datetime import datetime
+import logging
+import os
+import sys
+import time
+from datetime import datetime, timedelta
 from aiogram.client.default import DefaultBotProperties
 from aiogram import Bot, Dispatcher, F
 from aiogram.enums import ParseMode
-from aiogram.filters import CommandStart
-from aiogram.types import Message, CallbackQuery
+from aiogram.filters import CommandStart, Command, CommandObject
+from aiogram.exceptions import TelegramEntityTooLarge
+from aiogram.types import Message, CallbackQuery, FSInputFile
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 
@@ -12,16 +17,39 @@ from sqlalchemy import select, update, desc
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.config import settings
-from app.db import SessionLocal, init_db
-from app.models import User, Lead, Homework
+from app.db import SessionLocal, engine, init_db, warm_pool, health_loop
 from app import texts
 from app.keyboards import (
     main_menu, back_to_menu, support_menu,
     lead_class_kb, lead_goal_kb, lead_time_kb, lead_finish_kb,
     hw_class_kb, hw_topic_kb,
     admin_lead_actions, admin_hw_actions,
+    queue_kb, bulk_confirm_kb, broadcast_confirm_kb,
 )
-from app.utils import classify_message
+from app.utils import classify_message, md_escape
+from app.delivery import homework_calls, album_calls, execute
+from app.sender import sender
+from app import outbox
+from app.webhook import check_webhook_settings, run_webhook
+from app.supervisor import run_supervisor, run_worker
+from app.scheduler import make_scheduler, run_polling
+from app.partitions import month_key, partition_loop
+from app.fsm_storage import storage, FsmFlushMiddleware, purge_loop
+from app.users import users
+from app.middlewares import DbSessionMiddleware, LazySession
+from app import repo
+from app.tg_session import BotSession
+from app.render import edit_screen, remember
+from app.throttle import ThrottleMiddleware, throttler
+from app.archive import archiver
+from app.models import Homework, HomeworkAttachment
+from app.albums import albums
+from app.broadcast import broadcaster
+from app import export
+from app import stats
+from app.stats import stats_cache
+from app import metrics
+from app.metrics import HandlerMetricsMiddleware
 
 
 # ---------------- FSM ----------------
@@ -45,7 +73,10 @@ class HomeworkStates(StatesGroup):
 
 
 class AdminStates(StatesGroup):
-    waiting_hw_comment = State()  # stores hw_id
+    waiting_hw_comment = State()  # stores hw_id, hw_month
+
+
+log = logging.getLogger(__name__)
 
 
 # ---------------- helpers ----------------
@@ -58,39 +89,39 @@ async def db_session() -> AsyncSession:
     return SessionLocal()
 
 
-async def upsert_user(session: AsyncSession, message: Message):
-    tg_id = message.from_user.id
-    user = await session.get(User, tg_id)
-    if not user:
-        user = User(
-            tg_id=tg_id,
-            username=message.from_user.username,
-            full_name=message.from_user.full_name,
-        )
-        session.add(user)
-        await session.commit()
+async def notify_admins(session: AsyncSession, text: str, reply_markup=None):
+    # кладём в outbox; доставка — воркерами через rate-limited sender после коммита
+    await outbox.enqueue(session, settings.admin_ids, [
+        ("send_message", {"text": text, "reply_markup": reply_markup, "parse_mode": ParseMode.MARKDOWN}),
+    ])
 
 
-async def notify_admins(bot: Bot, text: str, reply_markup=None):
-    for admin_id in settings.admin_ids:
-        try:
-            await bot.send_message(admin_id, text, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
-        except Exception:
-            # не ломаем поток из-за недоступного админа
-            pass
+async def notify_user(session: AsyncSession, tg_id: int, text: str, **kwargs):
+    await notify_users(session, [tg_id], text, **kwargs)
+
+
+async def notify_users(session: AsyncSession, tg_ids: list[int], text: str, **kwargs):
+    # одно и то же сообщение многим: один executemany в outbox
+    await outbox.enqueue(session, tg_ids, [("send_message", {"text": text, "reply_markup": main_menu(), **kwargs})])
 
 
 # ---------------- bot ----------------
 
-dp = Dispatcher()
+dp = Dispatcher(storage=storage)
+dp.update.outer_middleware(FsmFlushMiddleware(storage))
+dp.update.outer_middleware(DbSessionMiddleware())
+dp.message.outer_middleware(ThrottleMiddleware(throttler))
+dp.callback_query.outer_middleware(ThrottleMiddleware(throttler))
+dp.message.middleware(HandlerMetricsMiddleware())
+dp.callback_query.middleware(HandlerMetricsMiddleware())
 
 
 @dp.message(CommandStart())
 async def cmd_start(message: Message, state: FSMContext):
     await state.clear()
-    async with SessionLocal() as s:
-        await upsert_user(s, message)
-    await message.answer(texts.WELCOME, reply_markup=main_menu())
+    users.touch(message.from_user)
+    sent = await message.answer(texts.WELCOME, reply_markup=main_menu())
+    remember(sent, texts.WELCOME, main_menu())
 
 
 # ---- MENU callbacks ----
@@ -98,25 +129,25 @@ async def cmd_start(message: Message, state: FSMContext):
 @dp.callback_query(F.data == "menu:home")
 async def cb_home(query: CallbackQuery, state: FSMContext):
     await state.clear()
-    await query.message.edit_text(texts.WELCOME, reply_markup=main_menu())
+    await edit_screen(query.message, texts.WELCOME, reply_markup=main_menu())
     await query.answer()
 
 
 @dp.callback_query(F.data == "menu:about")
 async def cb_about(query: CallbackQuery):
-    await query.message.edit_text(texts.ABOUT, reply_markup=back_to_menu(), parse_mode=ParseMode.MARKDOWN)
+    await edit_screen(query.message, texts.ABOUT, reply_markup=back_to_menu(), parse_mode=ParseMode.MARKDOWN)
     await query.answer()
 
 
 @dp.callback_query(F.data == "menu:reviews")
 async def cb_reviews(query: CallbackQuery):
-    await query.message.edit_text(texts.REVIEWS, reply_markup=back_to_menu(), parse_mode=ParseMode.MARKDOWN)
+    await edit_screen(query.message, texts.REVIEWS, reply_markup=back_to_menu(), parse_mode=ParseMode.MARKDOWN)
     await query.answer()
 
 
 @dp.callback_query(F.data == "menu:faq")
 async def cb_faq(query: CallbackQuery):
-    await query.message.edit_text(texts.FAQ_TEXT, reply_markup=support_menu(), parse_mode=ParseMode.MARKDOWN)
+    await edit_screen(query.message, texts.FAQ_TEXT, reply_markup=support_menu(), parse_mode=ParseMode.MARKDOWN)
     await query.answer()
 
 
@@ -132,7 +163,7 @@ async def cb_diag(query: CallbackQuery):
         "— ЕГЭ\n\n"
         "Нажмите *Записаться* — и в заявке укажите цель и класс 🙂"
     )
-    await query.message.edit_text(txt, reply_markup=support_menu(), parse_mode=ParseMode.MARKDOWN)
+    await edit_screen(query.message, txt, reply_markup=support_menu(), parse_mode=ParseMode.MARKDOWN)
     await query.answer()
 
 
@@ -141,12 +172,12 @@ async def cb_diag(query: CallbackQuery):
 @dp.callback_query(F.data == "support:ask")
 async def cb_support_ask(query: CallbackQuery, state: FSMContext):
     await state.set_state(SupportStates.waiting_question)
-    await query.message.edit_text(texts.ASK_QUESTION_HINT, reply_markup=back_to_menu())
+    await edit_screen(query.message, texts.ASK_QUESTION_HINT, reply_markup=back_to_menu())
     await query.answer()
 
 
 @dp.message(SupportStates.waiting_question)
-async def support_question(message: Message, state: FSMContext, bot: Bot):
+async def support_question(message: Message, state: FSMContext, db: LazySession):
     text = (message.text or "").strip()
     if not text:
         await message.answer("Напишите вопрос текстом одним сообщением 🙂")
@@ -156,11 +187,13 @@ async def support_question(message: Message, state: FSMContext, bot: Bot):
     user = message.from_user
     admin_text = (
         "💬 *Вопрос от ученика*\n\n"
-        f"От: {user.full_name} (@{user.username or '—'})\n"
+        f"От: {md_escape(user.full_name)} (@{md_escape(user.username or '—')})\n"
         f"ID: `{user.id}`\n\n"
-        f"Текст:\n{text}"
+        f"Текст:\n{md_escape(text)}"
     )
-    await notify_admins(bot, admin_text)
+    await notify_admins(db.session, admin_text)
+    await db.session.commit()
+    outbox.wakeup()
     await message.answer("✅ Принято! Я отвечу вам в ближайшее время.", reply_markup=main_menu())
 
 
@@ -169,7 +202,8 @@ async def support_question(message: Message, state: FSMContext, bot: Bot):
 @dp.callback_query(F.data == "lead:start")
 async def lead_start(query: CallbackQuery, state: FSMContext):
     await state.set_state(LeadStates.student_class)
-    await query.message.edit_text(
+    await edit_screen(
+        query.message,
         "🗓 *Запись в группу*\n\nВыберите класс ученика:",
         reply_markup=lead_class_kb(),
         parse_mode=ParseMode.MARKDOWN,
@@ -182,7 +216,8 @@ async def lead_class(query: CallbackQuery, state: FSMContext):
     student_class = query.data.split(":")[-1]
     await state.update_data(student_class=student_class)
     await state.set_state(LeadStates.goal)
-    await query.message.edit_text(
+    await edit_screen(
+        query.message,
         "🎯 Какая цель занятий?",
         reply_markup=lead_goal_kb(),
     )
@@ -195,7 +230,8 @@ async def lead_goal(query: CallbackQuery, state: FSMContext):
     goal_map = {"improve": "подтянуть успеваемость", "oge": "ОГЭ", "ege": "ЕГЭ"}
     await state.update_data(goal=goal_map.get(goal_code, goal_code))
     await state.set_state(LeadStates.time_pref)
-    await query.message.edit_text(
+    await edit_screen(
+        query.message,
         "🕒 Когда удобнее заниматься?",
         reply_markup=lead_time_kb(),
     )
@@ -208,7 +244,8 @@ async def lead_time(query: CallbackQuery, state: FSMContext):
     time_map = {"morning": "утро", "day": "день", "evening": "вечер"}
     await state.update_data(time_pref=time_map.get(time_code, time_code))
     await state.set_state(LeadStates.contact)
-    await query.message.edit_text(
+    await edit_screen(
+        query.message,
         "📱 Оставьте контакт для связи (например, номер или @ник).\n"
         "Можно просто отправить @username, если так удобнее.",
         reply_markup=back_to_menu(),
@@ -231,42 +268,45 @@ async def lead_contact(message: Message, state: FSMContext):
         f"Класс: *{data['student_class']}*\n"
         f"Цель: *{data['goal']}*\n"
         f"Время: *{data['time_pref']}*\n"
-        f"Контакт: `{data['contact']}`\n\n"
+        f"Контакт: {md_escape(data['contact'])}\n\n"
         "Если всё верно — отправляйте."
     )
     await message.answer(summary, reply_markup=lead_finish_kb(), parse_mode=ParseMode.MARKDOWN)
 
 
 @dp.callback_query(LeadStates.confirm, F.data == "lead:submit")
-async def lead_submit(query: CallbackQuery, state: FSMContext, bot: Bot):
+async def lead_submit(query: CallbackQuery, state: FSMContext, db: LazySession):
     data = await state.get_data()
     await state.clear()
 
-    async with SessionLocal() as s:
-        lead = Lead(
-            tg_id=query.from_user.id,
-            student_class=data["student_class"],
-            goal=data["goal"],
-            time_pref=data["time_pref"],
-            contact=data.get("contact"),
-            status="new",
-        )
-        s.add(lead)
-        await s.commit()
-        await s.refresh(lead)
+    s = db.session
+    created_at = datetime.utcnow()
+    lead_id = await repo.create_lead(
+        s,
+        created_at=created_at,
+        tg_id=query.from_user.id,
+        student_class=data["student_class"],
+        goal=data["goal"],
+        time_pref=data["time_pref"],
+        contact=data.get("contact"),
+        status="new",
+    )
 
     admin_text = (
         "📥 *Новая заявка*\n\n"
-        f"От: {query.from_user.full_name} (@{query.from_user.username or '—'})\n"
+        f"От: {md_escape(query.from_user.full_name)} (@{md_escape(query.from_user.username or '—')})\n"
         f"ID: `{query.from_user.id}`\n\n"
         f"Класс: *{data['student_class']}*\n"
         f"Цель: *{data['goal']}*\n"
         f"Время: *{data['time_pref']}*\n"
-        f"Контакт: `{data.get('contact')}`\n"
-        f"Заявка: `#{lead.id}`"
+        f"Контакт: {md_escape(data.get('contact') or '—')}\n"
+        f"Заявка: `#{lead_id}`"
     )
-    await notify_admins(bot, admin_text, reply_markup=admin_lead_actions(lead.id))
-    await query.message.edit_text(texts.LEAD_DONE, reply_markup=main_menu())
+    await notify_admins(s, admin_text, reply_markup=admin_lead_actions(lead_id, month_key(created_at)))
+    await s.commit()
+    outbox.wakeup()
+
+    await edit_screen(query.message, texts.LEAD_DONE, reply_markup=main_menu())
     await query.answer()
 
 
@@ -275,7 +315,7 @@ async def lead_submit(query: CallbackQuery, state: FSMContext, bot: Bot):
 @dp.callback_query(F.data == "hw:start")
 async def hw_start(query: CallbackQuery, state: FSMContext):
     await state.set_state(HomeworkStates.student_class)
-    await query.message.edit_text(texts.HW_START, reply_markup=hw_class_kb(), parse_mode=ParseMode.MARKDOWN)
+    await edit_screen(query.message, texts.HW_START, reply_markup=hw_class_kb(), parse_mode=ParseMode.MARKDOWN)
     await query.answer()
 
 
@@ -284,7 +324,7 @@ async def hw_class(query: CallbackQuery, state: FSMContext):
     student_class = query.data.split(":")[-1]
     await state.update_data(student_class=student_class)
     await state.set_state(HomeworkStates.topic)
-    await query.message.edit_text("📌 Выберите тему:", reply_markup=hw_topic_kb())
+    await edit_screen(query.message, "📌 Выберите тему:", reply_markup=hw_topic_kb())
     await query.answer()
 
 
@@ -299,19 +339,41 @@ async def hw_topic(query: CallbackQuery, state: FSMContext):
     }
     await state.update_data(topic=topic_map.get(topic_code, topic_code))
     await state.set_state(HomeworkStates.waiting_payload)
-    await query.message.edit_text(
+    await edit_screen(
+        query.message,
         "Отправьте ДЗ одним сообщением:\n"
         "— текст\n"
         "— или фото\n"
-        "— или файл (pdf/word/картинка)\n\n"
+        "— или файл (pdf/word/картинка)\n"
+        "— или несколько фото/файлов альбомом\n\n"
         "Можно добавить подпись: где застряли / что не понятно.",
         reply_markup=back_to_menu(),
     )
     await query.answer()
 
 
+def hw_header(user, data: dict, hw_id: int) -> str:
+    return (
+        "📝 *Новое ДЗ*\n\n"
+        f"От: {md_escape(user.full_name)} (@{md_escape(user.username or '—')})\n"
+        f"ID: `{user.id}`\n"
+        f"Класс: *{md_escape(data['student_class'])}*\n"
+        f"Тема: *{md_escape(data['topic'])}*\n"
+        f"ДЗ: `#{hw_id}`\n"
+    )
+
+
 @dp.message(HomeworkStates.waiting_payload)
-async def hw_payload(message: Message, state: FSMContext, bot: Bot):
+async def hw_payload(message: Message, state: FSMContext, db: LazySession):
+    if message.media_group_id:
+        # альбом: сообщения копит коллектор, на весь альбом создаётся одно ДЗ (hw_album)
+        albums.add(message, lambda messages: hw_album(messages, state))
+        return
+    # сообщение сразу после альбома, раньше таймера коллектора: сначала оформляем альбом.
+    # Он уже стал ДЗ (ответ ученику отправлен) — это сообщение второе ДЗ не создаёт
+    if await albums.flush_chat(message.chat.id) and await state.get_state() != HomeworkStates.waiting_payload.state:
+        return
+
     data = await state.get_data()
 
     payload_type = "text"
@@ -330,125 +392,148 @@ async def hw_payload(message: Message, state: FSMContext, bot: Bot):
     else:
         payload_text = message.text
 
+    s = db.session
+    created_at = datetime.utcnow()
+    month = month_key(created_at)
+    hw_id = await repo.create_homework(
+        s,
+        created_at=created_at,
+        tg_id=message.from_user.id,
+        student_class=data["student_class"],
+        topic=data["topic"],
+        payload_type=payload_type,
+        payload_text=payload_text,
+        file_id=file_id,
+        caption=caption,
+        status="new",
+        admin_comment=None,
+    )
+
+    # notify admins with forwarded-like content
+    header = hw_header(message.from_user, data, hw_id)
+    calls = homework_calls(header, payload_type, payload_text, file_id, caption, admin_hw_actions(hw_id, month))
+    await outbox.enqueue(s, settings.admin_ids, calls)
+    await s.commit()
+    outbox.wakeup()
+    if file_id:
+        archiver.submit(Homework, hw_id, file_id, month)
+
+    await state.clear()
+    await message.answer(texts.HW_DONE, reply_markup=main_menu())
+
+
+def _album_item(message: Message) -> tuple[str, str] | None:
+    if message.photo:
+        return "photo", message.photo[-1].file_id
+    if message.video:
+        return "video", message.video.file_id
+    if message.document:
+        return "document", message.document.file_id
+    return None
+
+
+async def hw_album(messages: list[Message], state: FSMContext):
+    # зовётся коллектором по таймеру, вне middleware: своя сессия и свой flush FSM
+    if await state.get_state() != HomeworkStates.waiting_payload.state:
+        return
+    data = await state.get_data()
+    first = messages[0]
+    items = [item for item in map(_album_item, messages) if item]
+    if not items:
+        # например, альбом из одних аудио — ДЗ не создаём, ждём следующую попытку
+        await first.answer(texts.HW_ALBUM_UNSUPPORTED)
+        return
+    caption = next((m.caption for m in messages if m.caption), None)
+
+    created_at = datetime.utcnow()
+    month = month_key(created_at)
     async with SessionLocal() as s:
-        hw = Homework(
-            tg_id=message.from_user.id,
+        hw_id, attachment_ids = await repo.create_homework_album(
+            s,
+            items,
+            created_at=created_at,
+            tg_id=first.from_user.id,
             student_class=data["student_class"],
             topic=data["topic"],
-            payload_type=payload_type,
-            payload_text=payload_text,
-            file_id=file_id,
+            payload_text=None,
+            file_id=None,
             caption=caption,
             status="new",
             admin_comment=None,
-            updated_at=datetime.utcnow(),
         )
-        s.add(hw)
+        calls = album_calls(hw_header(first.from_user, data, hw_id), items, caption, admin_hw_actions(hw_id, month))
+        await outbox.enqueue(s, settings.admin_ids, calls)
         await s.commit()
-        await s.refresh(hw)
-
-    # notify admins with forwarded-like content
-    header = (
-        "📝 *Новое ДЗ*\n\n"
-        f"От: {message.from_user.full_name} (@{message.from_user.username or '—'})\n"
-        f"ID: `{message.from_user.id}`\n"
-        f"Класс: *{data['student_class']}*\n"
-        f"Тема: *{data['topic']}*\n"
-        f"ДЗ: `#{hw.id}`\n"
-    )
-
-    for admin_id in settings.admin_ids:
-        try:
-            await bot.send_message(admin_id, header, parse_mode=ParseMode.MARKDOWN)
-            if payload_type == "photo":
-                await bot.send_photo(admin_id, file_id, caption=caption or "—")
-            elif payload_type == "document":
-                await bot.send_document(admin_id, file_id, caption=caption or "—")
-            else:
-                await bot.send_message(admin_id, payload_text or "—")
-            await bot.send_message(admin_id, "Действия:", reply_markup=admin_hw_actions(hw.id))
-        except Exception:
-            pass
+    outbox.wakeup()
+    for attachment_id, (_, file_id) in zip(attachment_ids, items):
+        archiver.submit(HomeworkAttachment, attachment_id, file_id)
 
     await state.clear()
-    await message.answer(texts.HW_DONE, reply_markup=main_menu())
+    await storage.flush()
+    await first.answer(texts.HW_DONE, reply_markup=main_menu())
 
 
 # ---------------- ADMIN actions ----------------
 
-@dp.callback_query(F.data.startswith("admin:lead:"), F.from_user.func(lambda u: u.id in settings.admin_ids))
-async def admin_lead_action(query: CallbackQuery):
-    _, _, action, lead_id = query.data.split(":")
-    lead_id = int(lead_id)
+def parse_ref(ref: list[str]) -> tuple[int, int | None]:
+    # "<id>:<месяц партиции>" из callback_data; у кнопок сообщений, отправленных до партиций, месяца нет
+    return int(ref[0]), int(ref[1]) if len(ref) > 1 else None
 
-    async with SessionLocal() as s:
-        lead = await s.get(Lead, lead_id)
-        if not lead:
-            await query.answer("Заявка не найдена", show_alert=True)
-            return
 
-        new_status = "approved" if action == "ok" else "rejected"
-        lead.status = new_status
-        await s.commit()
+@dp.callback_query(F.data.startswith("admin:lead:"), F.from_user.func(lambda u: u.id in settings.admin_ids))
+async def admin_lead_action(query: CallbackQuery, db: LazySession):
+    _, _, action, *ref = query.data.split(":")
+    lead_id, month = parse_ref(ref)
+
+    s = db.session
+    new_status = "approved" if action == "ok" else "rejected"
+    lead = await repo.set_lead_status(s, lead_id, new_status, month)
+    if not lead:
+        await query.answer("Заявка не найдена", show_alert=True)
+        return
 
     # notify user
-    try:
-        if action == "ok":
-            await query.bot.send_message(
-                lead.tg_id,
-                "✅ Заявка подтверждена!\n\nЯ напишу вам детали по группе и времени занятий.",
-                reply_markup=main_menu(),
-            )
-        else:
-            await query.bot.send_message(
-                lead.tg_id,
-                "Спасибо за заявку! Сейчас подходящих мест нет 😔\n"
-                "Я могу предложить другое время/формат — напишите, пожалуйста, в ответ.",
-                reply_markup=main_menu(),
-            )
-    except Exception:
-        pass
+    text_user = texts.LEAD_APPROVED if action == "ok" else texts.LEAD_REJECTED
+    await notify_user(s, lead.tg_id, text_user)
+    await s.commit()
+    outbox.wakeup()
 
     await query.answer("Готово ✅")
 
 
 @dp.callback_query(F.data.startswith("admin:hw:"), F.from_user.func(lambda u: u.id in settings.admin_ids))
-async def admin_hw_action(query: CallbackQuery, state: FSMContext):
-    _, _, action, hw_id = query.data.split(":")
-    hw_id = int(hw_id)
+async def admin_hw_action(query: CallbackQuery, state: FSMContext, db: LazySession):
+    _, _, action, *ref = query.data.split(":")
+    hw_id, month = parse_ref(ref)
 
     if action == "comment":
         await state.set_state(AdminStates.waiting_hw_comment)
-        await state.update_data(hw_id=hw_id)
+        await state.update_data(hw_id=hw_id, hw_month=month)
         await query.message.answer(f"💬 Напишите комментарий для ДЗ #{hw_id} одним сообщением.")
         await query.answer()
         return
 
-    async with SessionLocal() as s:
-        hw = await s.get(Homework, hw_id)
-        if not hw:
-            await query.answer("ДЗ не найдено", show_alert=True)
-            return
-
-        if action == "accept":
-            hw.status = "accepted"
-            text_user = "✅ ДЗ проверено: *Принято*.\n\nЕсли хотите — отправьте следующее 🙂"
-        else:
-            hw.status = "rework"
-            text_user = "🔁 ДЗ проверено: *Нужно доработать*.\n\nЕсли хотите — отправьте исправленную версию."
-        hw.updated_at = datetime.utcnow()
-        await s.commit()
+    if action == "accept":
+        new_status = "accepted"
+        text_user = texts.HW_ACCEPTED
+    else:
+        new_status = "rework"
+        text_user = texts.HW_REWORK
 
-    try:
-        await query.bot.send_message(hw.tg_id, text_user, parse_mode=ParseMode.MARKDOWN, reply_markup=main_menu())
-    except Exception:
-        pass
+    s = db.session
+    hw = await repo.set_homework_status(s, hw_id, new_status, month)
+    if not hw:
+        await query.answer("ДЗ не найдено", show_alert=True)
+        return
+    await notify_user(s, hw.tg_id, text_user, parse_mode=ParseMode.MARKDOWN)
+    await s.commit()
+    outbox.wakeup()
 
     await query.answer("Статус отправлен ✅")
 
 
 @dp.message(AdminStates.waiting_hw_comment, F.from_user.func(lambda u: u.id in settings.admin_ids))
-async def admin_hw_comment(message: Message, state: FSMContext):
+async def admin_hw_comment(message: Message, state: FSMContext, db: LazySession):
     text = (message.text or "").strip()
     if not text:
         await message.answer("Комментарий должен быть текстом 🙂")
@@ -457,29 +542,406 @@ async def admin_hw_comment(message: Message, state: FSMContext):
     data = await state.get_data()
     hw_id = int(data["hw_id"])
 
-    async with SessionLocal() as s:
-        hw = await s.get(Homework, hw_id)
+    s = db.session
+    tg_id = await repo.set_homework_comment(s, hw_id, text, data.get("hw_month"))
+    if tg_id is None:
+        await message.answer("ДЗ не найдено.")
+        await state.clear()
+        return
+
+    await notify_user(s, tg_id, f"💬 *Комментарий по ДЗ #{hw_id}*\n\n{text}", parse_mode=ParseMode.MARKDOWN)
+    await s.commit()
+    outbox.wakeup()
+
+    await state.clear()
+    await message.answer("Комментарий отправлен ✅")
+
+
+# ---------------- ADMIN queue: keyset-пагинация ----------------
+
+EPOCH = datetime(1970, 1, 1)
+is_admin_user = F.from_user.func(lambda u: u.id in settings.admin_ids)
+
+
+def encode_cursor(created_at: datetime, item_id: int) -> str:
+    return f"{(created_at - EPOCH) // timedelta(microseconds=1)}:{item_id}"
+
+
+def decode_cursor(us: str, item_id: str) -> repo.Cursor:
+    return EPOCH + timedelta(microseconds=int(us)), int(item_id)
+
+
+def fmt_dt(dt: datetime) -> str:
+    return dt.strftime("%d.%m %H:%M")
+
+
+async def render_queue(s: AsyncSession, kind: str, cursor: repo.Cursor | None, forward: bool, tg_id: int | None = None):
+    # kind: hw / lead / st (история ученика); -> (text, reply_markup)
+    limit = settings.QUEUE_PAGE_SIZE
+    if kind == "hw":
+        rows, has_prev, has_next = await repo.homework_queue_page(s, cursor, forward, limit)
+        title = "📝 *ДЗ на проверке*"
+        prefix = "q:hw"
+    elif kind == "lead":
+        rows, has_prev, has_next = await repo.lead_queue_page(s, cursor, forward, limit)
+        title = "📥 *Новые заявки*"
+        prefix = "q:lead"
+    else:
+        rows, has_prev, has_next = await repo.student_homework_page(s, tg_id, cursor, forward, limit)
+        lead = await repo.last_lead(s, tg_id) if cursor is None else None
+        title = f"👤 *Ученик* `{tg_id}`"
+        if lead:
+            title += f"\nПоследняя заявка: `#{lead.id}` ({lead.status}, {fmt_dt(lead.created_at)})"
+        title += "\n\n*История ДЗ*"
+        prefix = f"q:st:{tg_id}"
+
+    if not rows:
+        return f"{title}\n\nПусто ✅", None
+
+    lines = []
+    items = []
+    for row in rows:
+        ref = f"{row.id}:{month_key(row.created_at)}"
+        if kind == "lead":
+            lines.append(
+                f"`#{row.id}` · {md_escape(row.student_class)} кл. · {md_escape(row.goal)} · "
+                f"{md_escape(row.time_pref)} · {fmt_dt(row.created_at)}"
+            )
+            items.append((f"#{row.id} · {row.student_class} кл. · {row.goal}", f"q:open:lead:{ref}"))
+        else:
+            status = f" · {row.status}" if kind == "st" else ""
+            lines.append(
+                f"`#{row.id}` · {md_escape(row.student_class)} кл. · {md_escape(row.topic)} · "
+                f"{row.payload_type}{status} · {fmt_dt(row.created_at)}"
+            )
+            items.append((f"#{row.id} · {row.topic}", f"q:open:hw:{ref}"))
+
+    first, last = rows[0], rows[-1]
+    prev_data = f"{prefix}:p:{encode_cursor(first.created_at, first.id)}" if has_prev else None
+    next_data = f"{prefix}:n:{encode_cursor(last.created_at, last.id)}" if has_next else None
+    text = title + "\n\n" + "\n".join(lines)
+    return text, queue_kb(items, prev_data, next_data)
+
+
+@dp.message(Command("queue"), is_admin_user)
+async def admin_queue(message: Message, db: LazySession):
+    text, kb = await render_queue(db.session, "hw", None, True)
+    await message.answer(text, reply_markup=kb, parse_mode=ParseMode.MARKDOWN)
+
+
+@dp.message(Command("leads"), is_admin_user)
+async def admin_leads(message: Message, db: LazySession):
+    text, kb = await render_queue(db.session, "lead", None, True)
+    await message.answer(text, reply_markup=kb, parse_mode=ParseMode.MARKDOWN)
+
+
+@dp.message(Command("student"), is_admin_user)
+async def admin_student(message: Message, command: CommandObject, db: LazySession):
+    try:
+        tg_id = int((command.args or "").strip())
+    except ValueError:
+        await message.answer("Использование: /student <tg_id>")
+        return
+    text, kb = await render_queue(db.session, "st", None, True, tg_id=tg_id)
+    await message.answer(text, reply_markup=kb, parse_mode=ParseMode.MARKDOWN)
+
+
+@dp.callback_query(F.data.startswith("q:open:"), is_admin_user)
+async def admin_queue_open(query: CallbackQuery, db: LazySession):
+    _, _, kind, *ref = query.data.split(":")
+    item_id, month = parse_ref(ref)
+    admin_id = query.from_user.id
+
+    if kind == "lead":
+        lead = await repo.get_lead(db.session, item_id, month)
+        if not lead:
+            await query.answer("Заявка не найдена", show_alert=True)
+            return
+        text = (
+            f"📥 *Заявка* `#{lead.id}` ({lead.status})\n\n"
+            f"ID: `{lead.tg_id}`\n"
+            f"Класс: *{md_escape(lead.student_class)}*\n"
+            f"Цель: *{md_escape(lead.goal)}*\n"
+            f"Время: *{md_escape(lead.time_pref)}*\n"
+            f"Контакт: {md_escape(lead.contact or '—')}"
+        )
+        calls = [("send_message", {"text": text, "parse_mode": ParseMode.MARKDOWN,
+                                   "reply_markup": admin_lead_actions(lead.id, month_key(lead.created_at))})]
+    else:
+        hw = await repo.get_homework(db.session, item_id, month)
         if not hw:
-            await message.answer("ДЗ не найдено.")
-            await state.clear()
+            await query.answer("ДЗ не найдено", show_alert=True)
             return
+        header = (
+            f"📝 *ДЗ* `#{hw.id}` ({hw.status})\n\n"
+            f"ID: `{hw.tg_id}`\n"
+            f"Класс: *{md_escape(hw.student_class)}*\n"
+            f"Тема: *{md_escape(hw.topic)}*\n"
+        )
+        if hw.payload_type == "album":
+            items = await repo.homework_attachments(db.session, hw.id)
+            calls = album_calls(header, items, hw.caption, admin_hw_actions(hw.id, month_key(hw.created_at)))
+        else:
+            calls = homework_calls(header, hw.payload_type, hw.payload_text, hw.file_id, hw.caption,
+                                   admin_hw_actions(hw.id, month_key(hw.created_at)))
+
+    await query.answer()
+    for call in calls:
+        await sender.call(admin_id, lambda: execute(query.bot, admin_id, call))
+
+
+@dp.callback_query(F.data.startswith("q:"), is_admin_user)
+async def admin_queue_page(query: CallbackQuery, db: LazySession):
+    parts = query.data.split(":")
+    tg_id = None
+    if parts[1] == "st":
+        tg_id = int(parts[2])
+        parts = parts[:2] + parts[3:]
+    _, kind, direction, us, item_id = parts
 
-        hw.admin_comment = text
-        hw.updated_at = datetime.utcnow()
+    text, kb = await render_queue(db.session, kind, decode_cursor(us, item_id), direction == "n", tg_id=tg_id)
+    await edit_screen(query.message, text, reply_markup=kb, parse_mode=ParseMode.MARKDOWN)
+    await query.answer()
+
+
+# ---------------- ADMIN: массовая модерация ----------------
+# /approve_leads [класс] [утро|день|вечер], /reject_leads ..., /accept_hw <id ...>, /rework_hw <id ...>
+# Команда показывает превью с подтверждением; операция лежит в FSM-данных админа до нажатия кнопки.
+
+LEAD_CLASSES = {"1-4", "5-8", "9", "10", "11"}
+LEAD_TIMES = {"утро", "день", "вечер"}
+BULK_LEAD = {"approve_leads": ("approved", texts.LEAD_APPROVED), "reject_leads": ("rejected", texts.LEAD_REJECTED)}
+BULK_HW = {"accept_hw": ("accepted", texts.HW_ACCEPTED), "rework_hw": ("rework", texts.HW_REWORK)}
+
+
+def parse_lead_filter(args: str | None) -> dict[str, str] | None:
+    filters: dict[str, str] = {}
+    for token in (args or "").lower().replace("–", "-").split():
+        if token in LEAD_CLASSES:
+            filters["student_class"] = token
+        elif token in LEAD_TIMES:
+            filters["time_pref"] = token
+        else:
+            return None
+    return filters
+
+
+def parse_ids(args: str | None) -> list[int] | None:
+    # "12 15, 18-25" -> [12, 15, 18, ..., 25]
+    ids: list[int] = []
+    for token in (args or "").replace(",", " ").split():
+        first, _, last = token.partition("-")
+        if not first.isdigit() or (last and not last.isdigit()):
+            return None
+        start, end = int(first), int(last or first)
+        ids.extend(range(start, min(end, start + settings.BULK_MAX_IDS) + 1))
+        if len(ids) > settings.BULK_MAX_IDS:
+            return None
+    return list(dict.fromkeys(ids)) or None
+
+
+@dp.message(Command(*BULK_LEAD), is_admin_user)
+async def bulk_leads(message: Message, command: CommandObject, state: FSMContext, db: LazySession):
+    filters = parse_lead_filter(command.args)
+    if filters is None:
+        await message.answer(f"Использование: /{command.command} [1-4|5-8|9|10|11] [утро|день|вечер]")
+        return
+    total, max_id = await repo.count_new_leads(db.session, **filters)
+    if not total:
+        await message.answer("Новых заявок по фильтру нет ✅")
+        return
+    # заявки, пришедшие после превью (id > max_id), подтверждение не затронет
+    await state.update_data(bulk={"command": command.command, "filters": filters, "total": total, "max_id": max_id})
+    scope = ", ".join(filters.values()) or "все"
+    await message.answer(
+        f"{'✅ Подтвердить' if command.command == 'approve_leads' else '❌ Отклонить'} "
+        f"новые заявки ({scope}): {total} шт.?",
+        reply_markup=bulk_confirm_kb(),
+    )
+
+
+@dp.message(Command(*BULK_HW), is_admin_user)
+async def bulk_homeworks(message: Message, command: CommandObject, state: FSMContext):
+    ids = parse_ids(command.args)
+    if ids is None:
+        await message.answer(f"Использование: /{command.command} 12 15 18-25 (не больше {settings.BULK_MAX_IDS} ДЗ)")
+        return
+    await state.update_data(bulk={"command": command.command, "ids": ids, "total": len(ids)})
+    verdict = "Принято" if command.command == "accept_hw" else "На доработку"
+    await message.answer(f"Отметить «{verdict}» непроверенные ДЗ: {len(ids)} шт.?", reply_markup=bulk_confirm_kb())
+
+
+@dp.callback_query(F.data == "bulk:cancel", is_admin_user)
+async def bulk_cancel(query: CallbackQuery, state: FSMContext):
+    await state.update_data(bulk=None)
+    await edit_screen(query.message, "Отменено.")
+    await query.answer()
+
+
+@dp.callback_query(F.data == "bulk:go", is_admin_user)
+async def bulk_go(query: CallbackQuery, state: FSMContext, db: LazySession):
+    op = (await state.get_data()).get("bulk")
+    if not op:
+        await query.answer("Операция уже выполнена или устарела", show_alert=True)
+        return
+    await state.update_data(bulk=None)
+    await query.answer()
+
+    s = db.session
+    batch_size = settings.BULK_BATCH_SIZE
+    command = op["command"]
+    if command in BULK_LEAD:
+        status, text_user = BULK_LEAD[command]
+        notify_kwargs = {}
+
+        async def batches():
+            after_id = 0
+            while ids := await repo.new_lead_ids(s, after_id, op["max_id"], batch_size, **op["filters"]):
+                after_id = ids[-1]
+                yield await repo.bulk_set_lead_status(s, ids, status)
+    else:
+        status, text_user = BULK_HW[command]
+        notify_kwargs = {"parse_mode": ParseMode.MARKDOWN}
+
+        async def batches():
+            ids = op["ids"]
+            for i in range(0, len(ids), batch_size):
+                yield await repo.bulk_set_homework_status(s, ids[i:i + batch_size], status)
+
+    # пачка = UPDATE ... RETURNING + уведомления одним executemany в outbox, коммит; прогресс — в одном сообщении
+    done, last_edit = 0, 0.0
+    async for rows in batches():
+        await notify_users(s, list(dict.fromkeys(row.tg_id for row in rows)), text_user, **notify_kwargs)
         await s.commit()
+        outbox.wakeup()
+        done += len(rows)
+        if time.monotonic() - last_edit >= 1.0:
+            last_edit = time.monotonic()
+            await edit_screen(query.message, f"⏳ Обработано {done} из {op['total']}…")
+    skipped = op["total"] - done
+    await edit_screen(
+        query.message,
+        f"✅ Готово: {done} из {op['total']}. Уведомления отправляются."
+        + (f"\nПропущено {skipped}: уже разобраны или не найдены." if skipped > 0 else ""),
+    )
+
+
+# ---------------- ADMIN: статистика ----------------
+# /stats [дней] — из роллапа stats_daily (обновляется в repo при каждой записи), кэш STATS_CACHE_TTL сек
+
+@dp.message(Command("stats"), is_admin_user)
+async def admin_stats(message: Message, command: CommandObject):
+    args = (command.args or "").strip()
+    if args and (not args.isdigit() or not 1 <= int(args) <= settings.STATS_MAX_DAYS):
+        await message.answer(f"Использование: /stats [дней, 1–{settings.STATS_MAX_DAYS}]")
+        return
+    await message.answer(await stats_cache.get(int(args or settings.STATS_DAYS)))
+
+
+@dp.message(Command("stats_rebuild"), is_admin_user)
+async def admin_stats_rebuild(message: Message, db: LazySession):
+    started = time.monotonic()
+    rows = await stats.rebuild(db.session)
+    await db.session.commit()
+    stats_cache.clear()
+    await message.answer(f"✅ Статистика пересчитана: {rows} строк за {time.monotonic() - started:.1f} с")
+
+
+# ---------------- ADMIN: выгрузка ----------------
+
+@dp.message(Command("export"), is_admin_user)
+async def admin_export(message: Message, command: CommandObject):
+    try:
+        params = export.parse_args(command.args)
+    except export.ExportError as e:
+        await message.answer(str(e))
+        return
 
+    progress = await message.answer("⏳ Готовлю выгрузку…")
+    try:
+        path, count = await export.export_file(params)
+    except export.ExportError as e:
+        await edit_screen(progress, str(e))
+        return
     try:
-        await message.bot.send_message(
-            hw.tg_id,
-            f"💬 *Комментарий по ДЗ #{hw_id}*\n\n{text}",
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=main_menu(),
+        if not count:
+            await edit_screen(progress, "По фильтру ничего не найдено.")
+            return
+        await message.answer_document(
+            FSInputFile(path, filename=export.export_filename(params)), caption=f"Строк: {count}",
         )
-    except Exception:
-        pass
+        await edit_screen(progress, "✅ Выгрузка готова")
+    except TelegramEntityTooLarge:
+        await edit_screen(progress, "Файл больше лимита Telegram (50 МБ) — сузьте фильтр по датам.")
+    finally:
+        os.remove(path)
+
+
+# ---------------- ADMIN: рассылки ----------------
+# /broadcast <текст> или /broadcast ответом на сообщение (копируется как есть, с медиа и форматированием)
+
+@dp.message(Command("broadcast"), is_admin_user)
+async def admin_broadcast(message: Message, command: CommandObject, db: LazySession):
+    if message.reply_to_message:
+        method = "copy_message"
+        payload = {"from_chat_id": message.chat.id, "message_id": message.reply_to_message.message_id}
+    elif command.args:
+        method, payload = "send_message", {"text": command.args, "parse_mode": None}
+    else:
+        await message.answer("Использование: /broadcast <текст> или ответом на сообщение, которое нужно разослать")
+        return
+
+    s = db.session
+    total = await repo.count_broadcast_recipients(s)
+    broadcast_id = await repo.create_broadcast(
+        s, created_by=message.from_user.id, method=method, payload=outbox.to_json(payload), total=total,
+    )
+    await s.commit()
+    await message.answer(
+        f"📣 Рассылка #{broadcast_id}: получателей ~{total}. Запустить?",
+        reply_markup=broadcast_confirm_kb(broadcast_id),
+    )
 
-    await state.clear()
-    await message.answer("Комментарий отправлен ✅")
+
+@dp.callback_query(F.data.startswith("bc:"), is_admin_user)
+async def admin_broadcast_action(query: CallbackQuery, db: LazySession):
+    _, action, broadcast_id = query.data.split(":")
+    broadcast_id = int(broadcast_id)
+
+    s = db.session
+    if action == "go":
+        ok = await repo.set_broadcast_status(
+            s, broadcast_id, "running", ("draft",),
+            progress_chat_id=query.message.chat.id, progress_message_id=query.message.message_id,
+        )
+    else:
+        ok = await repo.set_broadcast_status(s, broadcast_id, "cancelled", ("draft",))
+    await s.commit()
+    if not ok:
+        await query.answer("Рассылка уже запущена или отменена", show_alert=True)
+        return
+
+    if action == "go":
+        broadcaster.start(query.bot, broadcast_id)
+        await edit_screen(query.message, f"⏳ Рассылка #{broadcast_id} запущена. Остановить: /broadcast_stop {broadcast_id}")
+    else:
+        await edit_screen(query.message, f"Рассылка #{broadcast_id} отменена.")
+    await query.answer()
+
+
+@dp.message(Command("broadcast_stop"), is_admin_user)
+async def admin_broadcast_stop(message: Message, command: CommandObject, db: LazySession):
+    try:
+        broadcast_id = int((command.args or "").strip())
+    except ValueError:
+        await message.answer("Использование: /broadcast_stop <id>")
+        return
+    s = db.session
+    ok = await repo.set_broadcast_status(s, broadcast_id, "cancelled", ("draft", "running"),
+                                         finished_at=datetime.utcnow())
+    await s.commit()
+    # воркер рассылки увидит статус на ближайшем чекпоинте
+    await message.answer("⛔ Остановлено." if ok else "Рассылка не найдена или уже завершена.")
 
 
 # ---------------- fallback: auto-answers ----------------
@@ -510,14 +972,82 @@ async def any_text(message: Message, state: FSMContext):
     await message.answer(texts.UNKNOWN_TEXT, reply_markup=support_menu())
 
 
-async def main():
-    await init_db()
+async def _phase(timings: dict[str, float], name: str, coro):
+    started = time.perf_counter()
+    try:
+        return await coro
+    finally:
+        timings[name] = time.perf_counter() - started
+
+
+async def main(worker_index: int | None = None):
+    # worker_index — номер процесса-воркера супервизора; None — обычный запуск
+    started = time.perf_counter()
+    if settings.BOT_MODE == "webhook":
+        check_webhook_settings()
     bot = Bot(
     settings.BOT_TOKEN,
+    session=BotSession(),
     default=DefaultBotProperties(parse_mode=ParseMode.HTML),
     )
-    await dp.start_polling(bot)
+    if worker_index is None and settings.SUPERVISOR_WORKERS > 1:
+        # схема обновляется один раз до старта воркеров; сам супервизор апдейты не обрабатывает
+        await asyncio.gather(init_db(), bot.me())
+        await run_supervisor(bot, dp)
+        return
+
+    # независимые шаги старта — параллельно; клавиатуры и классификатор уже собраны при импорте.
+    # bot.me() кэширует ответ — повторно getMe не запрашивается
+    timings: dict[str, float] = {}
+    await asyncio.gather(
+        _phase(timings, "schema", init_db()),
+        _phase(timings, "db_pool", warm_pool()),
+        _phase(timings, "get_me", bot.me()),
+    )
+    log.info(
+        "startup %.3fs: %s",
+        time.perf_counter() - started,
+        ", ".join(f"{name} {t:.3f}s" for name, t in timings.items()),
+    )
+    # фоновые задачи «на всю базу» — в одном процессе (воркер 0), остальные — в каждом
+    primary = worker_index in (None, 0)
+    workers = outbox.start_workers(bot)
+    if primary:
+        workers.append(asyncio.create_task(purge_loop(storage)))
+        workers.append(asyncio.create_task(partition_loop(engine, settings.PARTITION_CHECK_INTERVAL)))
+    workers.append(asyncio.create_task(users.run()))
+    workers.append(asyncio.create_task(health_loop(settings.DB_HEALTH_INTERVAL)))
+    workers += archiver.start(bot, backfill=primary)
+    broadcaster.enabled = primary
+    if primary:
+        await broadcaster.resume(bot)
+        if worker_index is not None:
+            workers.append(asyncio.create_task(broadcaster.watch(bot)))
+    metrics_runner = None
+    if settings.METRICS_PORT:
+        metrics_runner = await metrics.start_server(settings.METRICS_HOST, settings.METRICS_PORT)
+    # все апдейты — через планировщик: по очереди в чате, параллельно между чатами
+    scheduler = make_scheduler(bot, dp)
+    try:
+        if worker_index is not None:
+            await run_worker(scheduler)
+        elif settings.BOT_MODE == "webhook":
+            await run_webhook(bot, dp, submit=scheduler.submit)
+        else:
+            await run_polling(bot, dp, scheduler)
+    finally:
+        await scheduler.drain(10.0)
+        for task in workers:
+            task.cancel()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await storage.close()
+        await users.flush()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    # `python -m app.main worker <n>` — процесс-воркер, его запускает супервизор
+    worker_index = int(sys.argv[2]) if sys.argv[1:2] == ["worker"] else None
+    log_format = logging.BASIC_FORMAT if worker_index is None else f"[worker {worker_index}] {logging.BASIC_FORMAT}"
+    logging.basicConfig(level=logging.INFO, format=log_format)
+    asyncio.run(main(worker_index))
\ No newline at end of file
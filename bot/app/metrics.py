@@ -0,0 +1,182 @@
+import logging
+import time
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Dict, Iterable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from aiohttp import web
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelKey = tuple[tuple[str, str], ...]
+
+
+def _labels(key: LabelKey, extra: str = "") -> str:
+    parts = [f'{k}="{_escape(v)}"' for k, v in key]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        REGISTRY.append(self)
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        super().__init__(name, help_text)
+        self.values: dict[LabelKey, float] = {}
+
+    def inc(self, value: float = 1.0, **labels: str):
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0.0) + value
+
+    def render(self) -> list[str]:
+        return self.header() + [f"{self.name}{_labels(k)} {v}" for k, v in self.values.items()]
+
+
+class Gauge(_Metric):
+    # значение снимается функцией в момент скрейпа: fn() -> {labels: value}
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, fn: Callable[[], dict[LabelKey, float]]):
+        super().__init__(name, help_text)
+        self.fn = fn
+
+    def render(self) -> list[str]:
+        try:
+            values = self.fn()
+        except Exception:
+            log.exception("gauge %s failed", self.name)
+            return []
+        return self.header() + [f"{self.name}{_labels(k)} {v}" for k, v in values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [counts по бакетам..., +Inf], sum
+        self.series: dict[LabelKey, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(sorted(labels.items()))
+        series = self.series.get(key)
+        if series is None:
+            series = ([0] * (len(self.buckets) + 1), [0.0])
+            self.series[key] = series
+        counts, total = series
+        counts[bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def render(self) -> list[str]:
+        lines = self.header()
+        for key, (counts, total) in self.series.items():
+            acc = 0
+            for bound, n in zip(self.buckets, counts):
+                acc += n
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_labels(key, le)} {acc}")
+            acc += counts[-1]
+            inf = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(key, inf)} {acc}")
+            lines.append(f"{self.name}_sum{_labels(key)} {total[0]}")
+            lines.append(f"{self.name}_count{_labels(key)} {acc}")
+        return lines
+
+
+REGISTRY: list[_Metric] = []
+
+
+def render() -> str:
+    lines: list[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ---------------- metrics ----------------
+
+handler_seconds = Histogram("bot_handler_seconds", "Handler latency")
+handler_errors = Counter("bot_handler_errors_total", "Handler exceptions")
+db_query_seconds = Histogram("bot_db_query_seconds", "SQL statement latency")
+tg_api_seconds = Histogram("bot_telegram_api_seconds", "Telegram Bot API call latency")
+tg_api_errors = Counter("bot_telegram_api_errors_total", "Telegram Bot API errors")
+fsm_transitions = Counter("bot_fsm_transitions_total", "FSM state transitions (funnel steps)")
+throttled = Counter("bot_throttled_total", "Updates dropped by anti-flood")
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    # inner-middleware: к этому моменту фильтры пройдены и известен конкретный хендлер
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(handler=name)
+            raise
+        finally:
+            handler_seconds.observe(time.perf_counter() - started, handler=name)
+
+
+def install_db_hooks(sync_engine):
+    from sqlalchemy import event
+
+    # время старта — на контексте выполнения, а не стеком в conn.info: after_cursor_execute
+    # при ошибке запроса не вызывается, и стек бы «съехал» для следующих запросов
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._query_started = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_query_started", None)
+        if started is None:
+            return
+        op = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "?"
+        db_query_seconds.observe(time.perf_counter() - started, op=op)
+
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+def add_routes(app: web.Application):
+    app.router.add_get("/metrics", _handle_metrics)
+
+
+async def start_server(host: str, port: int) -> web.AppRunner:
+    app = web.Application()
+    add_routes(app)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    log.info("metrics on http://%s:%s/metrics", host, port)
+    return runner
@@ -0,0 +1,42 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db import SessionLocal
+
+
+class LazySession:
+    # сессия создаётся только при первом обращении; апдейты без БД её не трогают
+    __slots__ = ("_session",)
+
+    def __init__(self):
+        self._session: AsyncSession | None = None
+
+    @property
+    def session(self) -> AsyncSession:
+        if self._session is None:
+            self._session = SessionLocal()
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class DbSessionMiddleware(BaseMiddleware):
+    # не больше одной сессии на апдейт; коммит — в хендлере, незакоммиченное откатывается при закрытии
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        db = LazySession()
+        data["db"] = db
+        try:
+            return await handler(event, data)
+        finally:
+            await db.close()
@@ -0,0 +1,143 @@
+import hashlib
+import logging
+from datetime import datetime
+from typing import Any, Awaitable, Callable
+
+from sqlalchemy import select, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from app.db import Base
+from app import partitions
+from app.models import Homework, Lead, SchemaVersion
+
+log = logging.getLogger(__name__)
+
+# ключ pg_advisory_xact_lock: схему обновляет одна реплика, остальные ждут
+MIGRATION_LOCK = 452294
+
+# Версионированные миграции для уже существующих баз: create_all новые колонки и индексы
+# в старые таблицы не добавляет. Каждый шаг идемпотентен (IF [NOT] EXISTS) — безопасно
+# и на свежей базе, где create_all уже всё создал. Номера только растут.
+# Шаг — SQL-строка или async-функция от соединения (то, что одним SQL не выразить).
+# Шаг видит схему своей версии, а не текущие модели: колонки, добавленные позже
+# (например, archive_error из миграции 7), в старых таблицах ещё нет.
+MIGRATIONS: list[tuple[int, str, list[str | Callable[[AsyncConnection], Awaitable[Any]]]]] = [
+    (1, "keyset-индексы очередей и истории ученика", [
+        "CREATE INDEX IF NOT EXISTS ix_leads_status_created_id ON leads (status, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS ix_leads_tg_id_created ON leads (tg_id, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS ix_homeworks_status_created_id ON homeworks (status, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS ix_homeworks_new_created_id ON homeworks (created_at, id) WHERE status = 'new'",
+        "CREATE INDEX IF NOT EXISTS ix_homeworks_tg_id_created ON homeworks (tg_id, created_at, id)",
+        # одиночные индексы по tg_id покрываются составными выше
+        "DROP INDEX IF EXISTS ix_leads_tg_id",
+        "DROP INDEX IF EXISTS ix_homeworks_tg_id",
+    ]),
+    (2, "архив файлов ДЗ", [
+        "ALTER TABLE homeworks ADD COLUMN IF NOT EXISTS file_sha256 VARCHAR(64)",
+        "CREATE INDEX IF NOT EXISTS ix_homeworks_unarchived ON homeworks (id) "
+        "WHERE file_id IS NOT NULL AND file_sha256 IS NULL",
+    ]),
+    (3, "рассылки: отметка заблокировавших бота", [
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS blocked_at TIMESTAMP WITHOUT TIME ZONE",
+    ]),
+    (4, "роллап статистики /stats", [
+        "ALTER TABLE homeworks ADD COLUMN IF NOT EXISTS reviewed_at TIMESTAMP WITHOUT TIME ZONE",
+        # для уже проверенных ДЗ точного момента нет — берём последнее изменение
+        "UPDATE homeworks SET reviewed_at = updated_at WHERE status <> 'new' AND reviewed_at IS NULL",
+        # начальное заполнение (то же, что /stats_rebuild)
+        "DELETE FROM stats_daily",
+        "INSERT INTO stats_daily (day, kind, student_class, dim, status, n, seconds) "
+        "SELECT created_at::date, 'lead', student_class, goal, status, count(*), 0 FROM leads "
+        "GROUP BY 1, 3, 4, 5",
+        "INSERT INTO stats_daily (day, kind, student_class, dim, status, n, seconds) "
+        "SELECT created_at::date, 'hw', student_class, topic, status, count(*), 0 FROM homeworks "
+        "GROUP BY 1, 3, 4, 5",
+        "INSERT INTO stats_daily (day, kind, student_class, dim, status, n, seconds) "
+        "SELECT reviewed_at::date, 'review', student_class, topic, '', count(*), "
+        "sum(extract(epoch FROM reviewed_at - created_at))::bigint FROM homeworks "
+        "WHERE reviewed_at IS NOT NULL GROUP BY 1, 3, 4",
+    ]),
+    (5, "помесячные партиции leads / homeworks", [
+        lambda conn: partitions.convert(conn, Lead),
+        lambda conn: partitions.convert(conn, Homework),
+    ]),
+    (6, "outbox: аренда строк и порядок внутри чата", [
+        "DROP INDEX IF EXISTS ix_outbox_pending",
+        "CREATE INDEX IF NOT EXISTS ix_outbox_due ON outbox (next_attempt_at, id) "
+        "WHERE status IN ('pending', 'sending')",
+        "CREATE INDEX IF NOT EXISTS ix_outbox_chat_id ON outbox (chat_id, id) "
+        "WHERE status IN ('pending', 'sending')",
+    ]),
+    (7, "архив: файлы, которые не скачать", [
+        "ALTER TABLE homeworks ADD COLUMN IF NOT EXISTS archive_error TEXT",
+        "ALTER TABLE homework_attachments ADD COLUMN IF NOT EXISTS archive_error TEXT",
+    ]),
+    (8, "/stats: проверки ДЗ с месяцем создания", [
+        # идёт сразу за переходом на партиции — отключённых в архив партиций ещё нет
+        "DELETE FROM stats_daily WHERE kind = 'review' AND status = ''",
+        "INSERT INTO stats_daily (day, kind, student_class, dim, status, n, seconds) "
+        "SELECT reviewed_at::date, 'review', student_class, topic, to_char(created_at, 'YYYY-MM'), count(*), "
+        "sum(extract(epoch FROM reviewed_at - created_at))::bigint FROM homeworks "
+        "WHERE reviewed_at IS NOT NULL GROUP BY 1, 3, 4, 5 "
+        "ON CONFLICT (day, kind, student_class, dim, status) DO NOTHING",
+    ]),
+]
+
+LATEST = MIGRATIONS[-1][0]
+
+
+def schema_fingerprint() -> str:
+    # отпечаток DDL всех моделей: поменялась модель — отпечаток другой, схема будет сверена заново
+    dialect = postgresql.dialect()
+    parts = []
+    for table in Base.metadata.sorted_tables:
+        parts.append(str(CreateTable(table).compile(dialect=dialect)))
+        for index in sorted(table.indexes, key=lambda i: i.name or ""):
+            parts.append(str(CreateIndex(index).compile(dialect=dialect)))
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+
+async def _current(conn: AsyncConnection) -> tuple[int, str] | None:
+    if not await conn.scalar(text("SELECT to_regclass('schema_version') IS NOT NULL")):
+        return None
+    row = (await conn.execute(
+        select(SchemaVersion.version, SchemaVersion.fingerprint).where(SchemaVersion.id == 1)
+    )).first()
+    return (row.version, row.fingerprint) if row else None
+
+
+async def migrate(engine: AsyncEngine) -> bool:
+    # True — схема менялась; False — версия и отпечаток совпали, DDL не выполнялся
+    fingerprint = schema_fingerprint()
+    async with engine.connect() as conn:
+        if await _current(conn) == (LATEST, fingerprint):
+            return False
+
+    async with engine.begin() as conn:
+        await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK})
+        current = await _current(conn)
+        if current == (LATEST, fingerprint):
+            return False
+
+        await conn.run_sync(Base.metadata.create_all)
+        applied = current[0] if current else 0
+        for version, title, statements in MIGRATIONS:
+            if version <= applied:
+                continue
+            for step in statements:
+                if callable(step):
+                    await step(conn)
+                else:
+                    await conn.execute(text(step))
+            log.info("migration %s applied: %s", version, title)
+
+        values = dict(version=LATEST, fingerprint=fingerprint, applied_at=datetime.utcnow())
+        await conn.execute(
+            insert(SchemaVersion)
+            .values(id=1, **values)
+            .on_conflict_do_update(index_elements=[SchemaVersion.id], set_=values)
+        )
+    return True
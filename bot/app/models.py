@@ -1,5 +1,5 @@
-from datetime import datetime
-from sqlalchemy import BigInteger, String, DateTime, Text, Integer
+from datetime import date, datetime
+from sqlalchemy import BigInteger, String, Date, DateTime, Text, Integer, JSON, Index, text
 from sqlalchemy.orm import Mapped, mapped_column
 
 from app.db import Base
@@ -12,13 +12,15 @@ class User(Base):
     username: Mapped[str | None] = mapped_column(String(64), nullable=True)
     full_name: Mapped[str | None] = mapped_column(String(128), nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    # бот заблокирован пользователем (403 при рассылке); такие пропускаются, /start снимает отметку
+    blocked_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
 
 
 class Lead(Base):
     __tablename__ = "leads"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    tg_id: Mapped[int] = mapped_column(BigInteger, nullable=False, index=True)
+    tg_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
 
     student_class: Mapped[str] = mapped_column(String(16), nullable=False)   # "5", "9", "11"
     goal: Mapped[str] = mapped_column(String(64), nullable=False)            # "подтянуть", "ОГЭ", "ЕГЭ"
@@ -26,26 +28,177 @@ class Lead(Base):
     contact: Mapped[str | None] = mapped_column(String(64), nullable=True)
 
     status: Mapped[str] = mapped_column(String(24), default="new", nullable=False)  # new/approved/rejected
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    # ключ помесячных партиций (app.partitions) — поэтому входит в PK
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, primary_key=True)
+
+    __table_args__ = (
+        # очередь заявок (keyset по created_at, id) и история ученика
+        Index("ix_leads_status_created_id", "status", "created_at", "id"),
+        Index("ix_leads_tg_id_created", "tg_id", "created_at", "id"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
 
 
 class Homework(Base):
     __tablename__ = "homeworks"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    tg_id: Mapped[int] = mapped_column(BigInteger, nullable=False, index=True)
+    tg_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
 
     student_class: Mapped[str] = mapped_column(String(16), nullable=False)
     topic: Mapped[str] = mapped_column(String(64), nullable=False)
 
     # Telegram message reference
-    payload_type: Mapped[str] = mapped_column(String(16), nullable=False)  # text/photo/document
+    payload_type: Mapped[str] = mapped_column(String(16), nullable=False)  # text/photo/document/album
     payload_text: Mapped[str | None] = mapped_column(Text, nullable=True)
     file_id: Mapped[str | None] = mapped_column(Text, nullable=True)
     caption: Mapped[str | None] = mapped_column(Text, nullable=True)
+    # копия файла в локальном архиве (StoredFile.sha256); NULL — ещё не скачан
+    file_sha256: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    # файл не скачать никогда (больше лимита getFile и т.п.) — backfill его больше не берёт
+    archive_error: Mapped[str | None] = mapped_column(Text, nullable=True)
 
     status: Mapped[str] = mapped_column(String(24), default="new", nullable=False)  # new/accepted/rework
     admin_comment: Mapped[str | None] = mapped_column(Text, nullable=True)
 
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    # ключ помесячных партиций (app.partitions) — поэтому входит в PK
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, primary_key=True)
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    # первая проверка (принято / на доработку) — для статистики «время до проверки»
+    reviewed_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_homeworks_status_created_id", "status", "created_at", "id"),
+        # горячая очередь на проверку — маленький частичный индекс
+        Index("ix_homeworks_new_created_id", "created_at", "id", postgresql_where=text("status = 'new'")),
+        Index("ix_homeworks_tg_id_created", "tg_id", "created_at", "id"),
+        # что ещё не заархивировано (догоняем после рестарта)
+        Index("ix_homeworks_unarchived", "id", postgresql_where=text("file_id IS NOT NULL AND file_sha256 IS NULL")),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
+
+class HomeworkAttachment(Base):
+    # файлы ДЗ, присланного альбомом (Homework.payload_type = "album"); связь по homework_id без FK
+    __tablename__ = "homework_attachments"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    homework_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    position: Mapped[int] = mapped_column(Integer, nullable=False)
+
+    payload_type: Mapped[str] = mapped_column(String(16), nullable=False)  # photo/video/document
+    file_id: Mapped[str] = mapped_column(Text, nullable=False)
+    file_sha256: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    archive_error: Mapped[str | None] = mapped_column(Text, nullable=True)
+
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        Index("ix_homework_attachments_hw", "homework_id", "position"),
+        Index("ix_homework_attachments_unarchived", "id", postgresql_where=text("file_sha256 IS NULL")),
+    )
+
+
+class StoredFile(Base):
+    # файл в контентно-адресуемом архиве: путь на диске выводится из sha256, одинаковые файлы хранятся один раз
+    __tablename__ = "stored_files"
+
+    sha256: Mapped[str] = mapped_column(String(64), primary_key=True)
+    size: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class StoredFileId(Base):
+    # file_unique_id Telegram -> хеш уже скачанного файла: повторно присланный файл не скачивается
+    __tablename__ = "stored_file_ids"
+
+    file_unique_id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    sha256: Mapped[str] = mapped_column(String(64), nullable=False)
+
+
+class Broadcast(Base):
+    # рассылка по users: получатели идут по возрастанию tg_id, last_tg_id — чекпоинт для продолжения после рестарта
+    __tablename__ = "broadcasts"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    created_by: Mapped[int] = mapped_column(BigInteger, nullable=False)
+
+    method: Mapped[str] = mapped_column(String(32), nullable=False)  # send_message/copy_message
+    payload: Mapped[dict] = mapped_column(JSON, nullable=False)      # kwargs метода без chat_id
+
+    status: Mapped[str] = mapped_column(String(16), default="draft", nullable=False)  # draft/running/done/cancelled
+    last_tg_id: Mapped[int] = mapped_column(BigInteger, default=0, nullable=False)
+    total: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    sent: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    failed: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    blocked: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+
+    # сообщение админа, в котором показывается прогресс
+    progress_chat_id: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
+    progress_message_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+
+class StatsDaily(Base):
+    """
+    Роллап для /stats: счётчики по дню создания и измерениям, обновляются
+    в той же транзакции, что и запись заявки / ДЗ (app.stats.Rollup).
+    kind: lead (dim = цель), hw (dim = тема), review (первая проверка ДЗ: n и seconds по дню проверки;
+    status = месяц создания ДЗ "ГГГГ-ММ" — его партиция, чтобы пересчёт не трогал ДЗ из архива).
+    """
+    __tablename__ = "stats_daily"
+
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    kind: Mapped[str] = mapped_column(String(16), primary_key=True)
+    student_class: Mapped[str] = mapped_column(String(16), primary_key=True)
+    dim: Mapped[str] = mapped_column(String(64), primary_key=True)
+    status: Mapped[str] = mapped_column(String(24), primary_key=True)
+
+    n: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    seconds: Mapped[int] = mapped_column(BigInteger, default=0, nullable=False)
+
+
+class Outbox(Base):
+    # исходящие уведомления: пишутся в той же транзакции, что и Lead/Homework, отправляются воркерами
+    __tablename__ = "outbox"
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    chat_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+
+    method: Mapped[str] = mapped_column(String(32), nullable=False)  # send_message/send_photo/...
+    payload: Mapped[dict] = mapped_column(JSON, nullable=False)      # kwargs метода без chat_id
+
+    status: Mapped[str] = mapped_column(String(16), default="pending", nullable=False)  # pending/sending/dead
+    attempts: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    last_error: Mapped[str | None] = mapped_column(Text, nullable=True)
+
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        Index("ix_outbox_due", "next_attempt_at", "id", postgresql_where=text("status IN ('pending', 'sending')")),
+        # «есть ли у чата более ранняя неотправленная строка» при выборке
+        Index("ix_outbox_chat_id", "chat_id", "id", postgresql_where=text("status IN ('pending', 'sending')")),
+    )
+
+
+class FsmRecord(Base):
+    # состояние FSM (aiogram): ключ собирается DefaultKeyBuilder'ом
+    __tablename__ = "fsm_states"
+
+    key: Mapped[str] = mapped_column(String(255), primary_key=True)
+    state: Mapped[str | None] = mapped_column(String(128), nullable=True)
+    data: Mapped[dict] = mapped_column(JSON, nullable=False, default=dict)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+
+class SchemaVersion(Base):
+    # одна строка: номер последней применённой миграции и отпечаток DDL моделей (см. app.migrations)
+    __tablename__ = "schema_version"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    version: Mapped[int] = mapped_column(Integer, nullable=False)
+    fingerprint: Mapped[str] = mapped_column(String(64), nullable=False)
+    applied_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
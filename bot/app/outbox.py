@@ -0,0 +1,241 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from enum import Enum
+from typing import Any, Iterable
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramEntityTooLarge,
+    TelegramForbiddenError,
+    TelegramNotFound,
+    TelegramUnauthorizedError,
+)
+from aiogram.client.default import Default
+from aiogram.types import (
+    InlineKeyboardMarkup,
+    InputMediaAudio,
+    InputMediaDocument,
+    InputMediaPhoto,
+    InputMediaVideo,
+    TelegramObject,
+)
+from sqlalchemy import delete, exists, insert, select, text, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from app import metrics
+from app.config import settings
+from app.db import SessionLocal
+from app.delivery import Call, execute
+from app.models import Outbox
+from app.sender import sender
+
+log = logging.getLogger(__name__)
+
+# ошибки, которые повтором не исправить: бот заблокирован, битый file_id, неверная разметка
+PERMANENT_ERRORS = (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNotFound,
+    TelegramUnauthorizedError,
+    TelegramEntityTooLarge,
+)
+
+# ключ pg_advisory_xact_lock: выборку строк делает один воркер за раз (короткая транзакция без отправки)
+OUTBOX_LOCK = 452296
+
+# pending — ждёт отправки; sending — взята воркером до next_attempt_at (аренда), потом снова доступна
+ACTIVE = ("pending", "sending")
+
+_wakeup = asyncio.Event()
+
+# строки, от которых отказались (dead): reason — permanent (ошибку не исправить) или attempts (кончились попытки)
+outbox_dead = metrics.Counter("bot_outbox_dead_total", "Outbox notifications given up on, by reason")
+
+
+# ---------------- enqueue ----------------
+
+_MEDIA_TYPES = {
+    "photo": InputMediaPhoto,
+    "video": InputMediaVideo,
+    "document": InputMediaDocument,
+    "audio": InputMediaAudio,
+}
+
+
+def to_json(value: Any) -> Any:
+    if isinstance(value, TelegramObject):
+        return to_json(value.model_dump(exclude_none=True))
+    if isinstance(value, dict):
+        # Default(...) — «как в настройках бота»: не сохраняем, при отправке подставится снова
+        return {k: to_json(v) for k, v in value.items() if not isinstance(v, Default)}
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, list):
+        return [to_json(x) for x in value]
+    return value
+
+
+def from_json(payload: dict[str, Any]) -> dict[str, Any]:
+    kwargs = dict(payload)
+    if isinstance(kwargs.get("reply_markup"), dict):
+        kwargs["reply_markup"] = InlineKeyboardMarkup.model_validate(kwargs["reply_markup"])
+    if isinstance(kwargs.get("media"), list):
+        # send_media_group: элементы альбома по полю type
+        kwargs["media"] = [_MEDIA_TYPES[item["type"]].model_validate(item) for item in kwargs["media"]]
+    return kwargs
+
+
+async def enqueue(session: AsyncSession, chat_ids: Iterable[int], calls: list[Call]):
+    # один executemany в транзакции вызывающего — коммит он делает вместе с доменной записью
+    payloads = [(method, {k: to_json(v) for k, v in kwargs.items()}) for method, kwargs in calls]
+    rows = [
+        {"chat_id": chat_id, "method": method, "payload": payload}
+        for chat_id in chat_ids
+        for method, payload in payloads
+    ]
+    if rows:
+        await session.execute(insert(Outbox), rows)
+
+
+def wakeup():
+    # будим воркеры сразу после коммита, не дожидаясь интервала опроса
+    _wakeup.set()
+
+
+# ---------------- workers ----------------
+
+def _backoff(attempts: int) -> timedelta:
+    return timedelta(seconds=min(2 ** attempts, 600))
+
+
+def _is_parse_error(e: Exception) -> bool:
+    return isinstance(e, TelegramBadRequest) and "can't parse entities" in e.message
+
+
+async def _send(bot: Bot, row: Outbox):
+    kwargs = from_json(row.payload)
+    try:
+        await sender.call(row.chat_id, lambda: execute(bot, row.chat_id, (row.method, kwargs)))
+    except TelegramBadRequest as e:
+        # сломанная разметка (неэкранированный пользовательский текст) — уведомление важнее форматирования:
+        # один повтор простым текстом. У send_media_group разметки на верхнем уровне нет
+        if not _is_parse_error(e) or row.method == "send_media_group":
+            raise
+        log.warning("outbox #%s: %s, resending without parse_mode", row.id, e)
+        plain = {**kwargs, "parse_mode": None}
+        await sender.call(row.chat_id, lambda: execute(bot, row.chat_id, (row.method, plain)))
+
+
+async def _deliver_chat(bot: Bot, rows: list[Outbox]):
+    # строки одного чата — строго по порядку; при временной ошибке откладываем хвост целиком
+    now = datetime.utcnow()
+    for i, row in enumerate(rows):
+        try:
+            await _send(bot, row)
+        except PERMANENT_ERRORS as e:
+            row.status = "dead"
+            row.attempts += 1
+            row.last_error = str(e)
+            outbox_dead.inc(reason="permanent")
+            log.warning("outbox #%s dead: %s", row.id, e)
+            continue
+        except Exception as e:
+            row.attempts += 1
+            row.last_error = str(e)
+            if row.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+                row.status = "dead"
+                outbox_dead.inc(reason="attempts")
+                log.warning("outbox #%s dead after %s attempts: %s", row.id, row.attempts, e)
+                continue
+            retry_at = now + _backoff(row.attempts)
+            for rest in rows[i:]:
+                rest.status = "pending"
+                rest.next_attempt_at = retry_at
+            return
+        row.status = "sent"
+
+
+async def _claim() -> list[Outbox]:
+    # Аренда: строки помечаются sending до now + OUTBOX_LEASE и коммитятся сразу —
+    # отправка идёт без открытой транзакции и блокировок строк. Упал воркер — аренда истечёт, строки вернутся.
+    # Строка чата берётся, только если раньше неё у этого чата нет строки, которая ждёт повтора
+    # или арендована другим воркером (в том числе в другом процессе) — порядок в чате сохраняется.
+    now = datetime.utcnow()
+    earlier = aliased(Outbox)
+    blocked = exists().where(
+        earlier.chat_id == Outbox.chat_id,
+        earlier.id < Outbox.id,
+        earlier.status.in_(ACTIVE),
+        earlier.next_attempt_at > now,
+    )
+    due = (
+        select(Outbox.id)
+        .where(Outbox.status.in_(ACTIVE), Outbox.next_attempt_at <= now, ~blocked)
+        .order_by(Outbox.id)
+        .limit(settings.OUTBOX_BATCH_SIZE)
+    )
+    async with SessionLocal() as s, s.begin():
+        await s.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": OUTBOX_LOCK})
+        rows = (await s.scalars(
+            update(Outbox)
+            .where(Outbox.id.in_(due.scalar_subquery()))
+            .values(status="sending", next_attempt_at=now + timedelta(seconds=settings.OUTBOX_LEASE))
+            .returning(Outbox),
+            execution_options={"synchronize_session": False},
+        )).all()
+    return sorted(rows, key=lambda row: row.id)
+
+
+async def _finish(rows: list[Outbox]):
+    sent_ids = [row.id for row in rows if row.status == "sent"]
+    # dead и отложенные (pending); строки, до которых не дошло, остаются sending до конца аренды
+    changed = [
+        {"id": row.id, "status": row.status, "attempts": row.attempts,
+         "last_error": row.last_error, "next_attempt_at": row.next_attempt_at}
+        for row in rows
+        if row.status in ("dead", "pending")
+    ]
+    async with SessionLocal() as s, s.begin():
+        if sent_ids:
+            await s.execute(delete(Outbox).where(Outbox.id.in_(sent_ids)))
+        if changed:
+            await s.execute(update(Outbox), changed)
+
+
+async def drain_once(bot: Bot) -> int:
+    rows = await _claim()
+    if not rows:
+        return 0
+    by_chat: dict[int, list[Outbox]] = {}
+    for row in rows:
+        by_chat.setdefault(row.chat_id, []).append(row)
+    try:
+        await asyncio.gather(*(_deliver_chat(bot, chat_rows) for chat_rows in by_chat.values()))
+    finally:
+        await _finish(rows)
+    return len(rows)
+
+
+async def worker(bot: Bot):
+    while True:
+        try:
+            n = await drain_once(bot)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception("outbox drain failed")
+            n = 0
+        if n:
+            continue
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=settings.OUTBOX_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+
+def start_workers(bot: Bot) -> list[asyncio.Task]:
+    return [asyncio.create_task(worker(bot)) for _ in range(settings.OUTBOX_WORKERS)]
@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import re
+from datetime import date, datetime, time
+from typing import Any
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from app.config import settings
+from app.models import Homework, Lead
+
+log = logging.getLogger(__name__)
+
+# помесячные RANGE-партиции по created_at (PARTITION BY в __table_args__ моделей)
+PARTITIONED: list[Any] = [Lead, Homework]
+
+# ключ pg_advisory_xact_lock: партиции создаёт / отключает один процесс
+PARTITION_LOCK = 452295
+
+# SQLSTATE lock_not_available — не дождались блокировки за lock_timeout
+LOCK_NOT_AVAILABLE = "55P03"
+
+_NAME_RE = re.compile(r"_y(\d{4})m(\d{2})$")
+
+
+def add_months(month: date, n: int) -> date:
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_y{month:%Y}m{month:%m}"
+
+
+def month_key(created_at: datetime) -> int:
+    # месяц партиции строки (202409): короткий, влезает в callback_data рядом с id
+    return created_at.year * 100 + created_at.month
+
+
+def in_month(model: Any, month: int | None) -> list:
+    # условие на ключ партиций к поиску по id: планировщик отсекает остальные партиции и смотрит
+    # PK-индекс одной. None (кнопки сообщений, отправленных до партиций) — поиск по всем партициям
+    if month is None:
+        return []
+    start = date(month // 100, month % 100, 1)
+    return [
+        model.created_at >= datetime.combine(start, time()),
+        model.created_at < datetime.combine(add_months(start, 1), time()),
+    ]
+
+
+async def attached_months(conn: AsyncConnection, table: str) -> list[date]:
+    # подключённые партиции таблицы (по именам вида leads_y2024m09), по возрастанию
+    rows = await conn.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(:table)"
+        ),
+        {"table": table},
+    )
+    months = []
+    for (name,) in rows:
+        match = _NAME_RE.search(name)
+        if match:
+            months.append(date(int(match[1]), int(match[2]), 1))
+    return sorted(months)
+
+
+async def _create(conn: AsyncConnection, table: str, month: date):
+    await conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {partition_name(table, month)} PARTITION OF {table} "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    ))
+    log.info("partition %s created", partition_name(table, month))
+
+
+async def ensure(conn: AsyncConnection, table: str, first: date, last: date) -> int:
+    # партиции на месяцы first..last; уже существующие не трогаем. -> сколько создано
+    existing = set(await attached_months(conn, table))
+    created = 0
+    month = first
+    while month <= last:
+        if month not in existing:
+            await _create(conn, table, month)
+            created += 1
+        month = add_months(month, 1)
+    return created
+
+
+async def _lock(conn: AsyncConnection):
+    await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": PARTITION_LOCK})
+    # CREATE ... PARTITION OF / DETACH ждут ACCESS EXCLUSIVE на родителе, а пока ждут — за ними
+    # встают все вставки и обновления таблицы. Долгий читатель (выгрузка /export) — не ждём, повторим позже
+    await conn.execute(text(f"SET LOCAL lock_timeout = '{int(settings.PARTITION_LOCK_TIMEOUT * 1000)}ms'"))
+
+
+async def _detach(engine: AsyncEngine, table: str, name: str):
+    # старая закрытая партиция отключается в самостоятельную таблицу archive_<имя>:
+    # горячие индексы родителя её больше не включают, данные остаются для выгрузки / pg_dump.
+    # Партиция с необработанными (status = 'new') строками остаётся, пока их не разберут.
+    try:
+        async with engine.begin() as conn:
+            await _lock(conn)
+            if await conn.scalar(text(f"SELECT EXISTS (SELECT 1 FROM {name} WHERE status = 'new')")):
+                log.warning("partition %s kept: has unprocessed rows", name)
+                return
+            await conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+            await conn.execute(text(f"ALTER TABLE {name} RENAME TO archive_{name}"))
+    except DBAPIError as e:
+        if getattr(e.orig, "pgcode", None) != LOCK_NOT_AVAILABLE:
+            raise
+        log.warning("partition %s: %s is busy, detach postponed to the next check", name, table)
+        return
+    log.info("partition %s detached as archive_%s", name, name)
+
+
+async def maintain(engine: AsyncEngine):
+    # будущие партиции заранее (вставка в месяц без партиции упадёт); вызывается и при старте
+    this_month = datetime.utcnow().date().replace(day=1)
+    needed = {add_months(this_month, i) for i in range(settings.PARTITION_MONTHS_AHEAD + 1)}
+    async with engine.connect() as conn:
+        missing = [
+            model.__tablename__ for model in PARTITIONED
+            if not needed <= set(await attached_months(conn, model.__tablename__))
+        ]
+    if missing:
+        async with engine.begin() as conn:
+            await _lock(conn)
+            for table in missing:
+                await ensure(conn, table, this_month, max(needed))
+
+
+async def detach_old(engine: AsyncEngine):
+    # только из фонового цикла, не при старте: DETACH может ждать блокировку.
+    # Каждая партиция — отдельная короткая транзакция
+    if not settings.PARTITION_RETENTION_MONTHS:
+        return
+    before = add_months(datetime.utcnow().date().replace(day=1), -settings.PARTITION_RETENTION_MONTHS)
+    for model in PARTITIONED:
+        table = model.__tablename__
+        async with engine.connect() as conn:
+            months = [m for m in await attached_months(conn, table) if m < before]
+        for month in months:
+            await _detach(engine, table, partition_name(table, month))
+
+
+async def partition_loop(engine: AsyncEngine, interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await maintain(engine)
+            await detach_old(engine)
+        except Exception:
+            log.exception("partition maintenance failed")
+
+
+async def convert(conn: AsyncConnection, model: Any):
+    # миграция: обычная таблица -> партиционированная (на свежей базе create_all уже создал её такой)
+    table = model.__tablename__
+    if await conn.scalar(
+        text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table))"),
+        {"table": table},
+    ):
+        return
+    old = f"{table}_unpartitioned"
+    # имена PK, индексов и sequence освобождаются для новой таблицы
+    await conn.execute(text(f"ALTER TABLE {table} RENAME TO {old}"))
+    await conn.execute(text(f"ALTER TABLE {old} DROP CONSTRAINT IF EXISTS {table}_pkey"))
+    for index in model.__table__.indexes:
+        await conn.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+    await conn.execute(text(f"ALTER SEQUENCE IF EXISTS {table}_id_seq OWNED BY NONE"))
+    await conn.execute(text(f"ALTER SEQUENCE IF EXISTS {table}_id_seq RENAME TO {old}_id_seq"))
+
+    await conn.run_sync(model.__table__.create)
+    await conn.execute(text(
+        f"SELECT setval('{table}_id_seq', (SELECT coalesce(max(id), 0) + 1 FROM {old}), false)"
+    ))
+    first = await conn.scalar(text(f"SELECT min(created_at) FROM {old}"))
+    this_month = datetime.utcnow().date().replace(day=1)
+    first = first.date().replace(day=1) if first else this_month
+    await ensure(conn, table, first, add_months(this_month, settings.PARTITION_MONTHS_AHEAD))
+
+    # переносим только колонки, которые у старой таблицы есть: модель уже знает колонки
+    # следующих миграций (их ADD COLUMN IF NOT EXISTS на новой таблице ничего не сделает)
+    existing = set(await conn.scalars(
+        text(
+            "SELECT column_name FROM information_schema.columns "
+            "WHERE table_schema = current_schema() AND table_name = :old"
+        ),
+        {"old": old},
+    ))
+    columns = ", ".join(c.name for c in model.__table__.columns if c.name in existing)
+    await conn.execute(text(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {old}"))
+    await conn.execute(text(f"DROP TABLE {old}"))
+    await conn.execute(text(f"DROP SEQUENCE IF EXISTS {old}_id_seq"))
+    log.info("table %s converted to monthly partitions", table)
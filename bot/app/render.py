@@ -0,0 +1,67 @@
+from collections import OrderedDict
+from typing import Any
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message
+
+from app.config import settings
+from app.keyboards import markup_json
+
+
+class RenderCache:
+    # (chat_id, message_id) -> хэш того, что сейчас показано в сообщении; LRU с ограничением размера
+    def __init__(self, size: int):
+        self.size = size
+        self._items: OrderedDict[tuple[int, int], int] = OrderedDict()
+
+    def get(self, key: tuple[int, int]) -> int | None:
+        fp = self._items.get(key)
+        if fp is not None:
+            self._items.move_to_end(key)
+        return fp
+
+    def put(self, key: tuple[int, int], fp: int):
+        self._items[key] = fp
+        self._items.move_to_end(key)
+        if len(self._items) > self.size:
+            self._items.popitem(last=False)
+
+
+render_cache = RenderCache(settings.RENDER_CACHE_SIZE)
+
+
+def _trusted() -> bool:
+    # кэш знает только то, что рисовал этот процесс: верим ему, лишь если чат всегда попадает сюда же
+    # (то же условие, что у кэша FSM). Иначе сообщение могла поменять другая реплика — редактируем всегда
+    return settings.fsm_cache_ttl > 0
+
+
+def fingerprint(text: str, reply_markup: Any = None, **kwargs: Any) -> int:
+    markup = None
+    if reply_markup is not None:
+        markup = markup_json(reply_markup) or reply_markup.model_dump_json(exclude_none=True)
+    return hash((text, markup, kwargs.get("parse_mode")))
+
+
+def remember(message: Message, text: str, reply_markup: Any = None, **kwargs: Any):
+    # экран отправлен новым сообщением (message.answer) — запоминаем, чтобы не редактировать его впустую
+    if not _trusted():
+        return
+    render_cache.put((message.chat.id, message.message_id), fingerprint(text, reply_markup, **kwargs))
+
+
+async def edit_screen(message: Message, text: str, reply_markup: Any = None, **kwargs: Any) -> bool:
+    # False — сообщение уже показывает этот экран, запрос в Telegram не делали
+    trusted = _trusted()
+    key = (message.chat.id, message.message_id)
+    fp = fingerprint(text, reply_markup, **kwargs)
+    if trusted and render_cache.get(key) == fp:
+        return False
+    try:
+        await message.edit_text(text, reply_markup=reply_markup, **kwargs)
+    except TelegramBadRequest as e:
+        if "message is not modified" not in e.message:
+            raise
+    if trusted:
+        render_cache.put(key, fp)
+    return True
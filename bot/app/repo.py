@@ -0,0 +1,274 @@
+from datetime import datetime
+from typing import Any
+
+from sqlalchemy import Integer, any_, func, insert, literal, select, tuple_, update
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Broadcast, Lead, Homework, HomeworkAttachment, User
+from app.partitions import in_month
+from app.stats import Rollup
+
+# Каждая запись — один SQL-запрос: INSERT ... RETURNING / UPDATE ... RETURNING
+# вместо get -> изменение -> commit -> refresh. Плюс upsert роллапа /stats (app.stats)
+# в той же транзакции — счётчики не расходятся с данными.
+# Поиск заявки / ДЗ по id принимает month (partitions.month_key от created_at): с ним запрос
+# идёт в одну помесячную партицию, без него — в PK-индекс каждой подключённой.
+
+
+async def create_lead(session: AsyncSession, **values: Any) -> int:
+    values.setdefault("created_at", datetime.utcnow())
+    values.setdefault("status", "new")
+    result = await session.execute(insert(Lead).values(**values).returning(Lead.id))
+    rollup = Rollup()
+    rollup.add("lead", values["created_at"], values["student_class"], values["goal"], values["status"])
+    await rollup.apply(session)
+    return result.scalar_one()
+
+
+# что ещё вернуть из прежней версии строки, кроме статуса
+_OLD_EXTRA = {Homework: (Homework.reviewed_at.label("old_reviewed_at"),)}
+
+
+def _locked(model, *where):
+    # прежние значения строк (для дельт роллапа): CTE с FOR UPDATE видит последнюю версию строки,
+    # даже если её только что поменял параллельный запрос; блокировки — по порядку id
+    return (
+        select(model.id, model.created_at, model.status.label("old_status"), *_OLD_EXTRA.get(model, ()))
+        .where(*where)
+        .order_by(model.id)
+        .with_for_update()
+        .cte("old")
+    )
+
+
+async def set_lead_status(session: AsyncSession, lead_id: int, status: str, month: int | None = None):
+    # -> (tg_id, status) или None, если заявки нет
+    prune = in_month(Lead, month)
+    old = _locked(Lead, Lead.id == lead_id, *prune)
+    result = await session.execute(
+        update(Lead)
+        .where(Lead.id == old.c.id, Lead.created_at == old.c.created_at, *prune)
+        .values(status=status)
+        .returning(Lead.tg_id, Lead.status, Lead.created_at, Lead.student_class, Lead.goal, old.c.old_status)
+    )
+    row = result.one_or_none()
+    if row is not None:
+        rollup = Rollup()
+        rollup.move("lead", row, row.goal, row.old_status, status)
+        await rollup.apply(session)
+    return row
+
+
+async def create_homework(session: AsyncSession, **values: Any) -> int:
+    values.setdefault("created_at", datetime.utcnow())
+    values.setdefault("updated_at", values["created_at"])
+    values.setdefault("status", "new")
+    result = await session.execute(insert(Homework).values(**values).returning(Homework.id))
+    rollup = Rollup()
+    rollup.add("hw", values["created_at"], values["student_class"], values["topic"], values["status"])
+    await rollup.apply(session)
+    return result.scalar_one()
+
+
+async def create_homework_album(
+    session: AsyncSession, attachments: list[tuple[str, str]], **values: Any
+) -> tuple[int, list[int]]:
+    # attachments: (payload_type, file_id) по порядку альбома; -> (id ДЗ, id вложений)
+    hw_id = await create_homework(session, payload_type="album", **values)
+    result = await session.scalars(
+        insert(HomeworkAttachment).returning(HomeworkAttachment.id, sort_by_parameter_order=True),
+        [
+            {"homework_id": hw_id, "position": i, "payload_type": payload_type, "file_id": file_id}
+            for i, (payload_type, file_id) in enumerate(attachments)
+        ],
+    )
+    return hw_id, list(result)
+
+
+async def _update_homework_status(session: AsyncSession, where, status: str, prune=()):
+    # смена статуса ДЗ + роллап: перенос между статусами и «время до проверки» при первой проверке
+    now = datetime.utcnow()
+    old = _locked(Homework, *where, *prune)
+    result = await session.execute(
+        update(Homework)
+        .where(Homework.id == old.c.id, Homework.created_at == old.c.created_at, *prune)
+        .values(status=status, updated_at=now, reviewed_at=func.coalesce(Homework.reviewed_at, now))
+        .returning(
+            Homework.id, Homework.tg_id, Homework.status, Homework.created_at, Homework.student_class,
+            Homework.topic, old.c.old_status, old.c.old_reviewed_at,
+        )
+    )
+    rows = result.all()
+    rollup = Rollup()
+    for row in rows:
+        rollup.move("hw", row, row.topic, row.old_status, status)
+        if row.old_reviewed_at is None:
+            rollup.reviewed(row, now)
+    await rollup.apply(session)
+    return rows
+
+
+async def set_homework_status(session: AsyncSession, hw_id: int, status: str, month: int | None = None):
+    rows = await _update_homework_status(session, [Homework.id == hw_id], status, in_month(Homework, month))
+    return rows[0] if rows else None
+
+
+async def set_homework_comment(session: AsyncSession, hw_id: int, comment: str, month: int | None = None) -> int | None:
+    # -> tg_id ученика или None
+    result = await session.execute(
+        update(Homework)
+        .where(Homework.id == hw_id, *in_month(Homework, month))
+        .values(admin_comment=comment, updated_at=datetime.utcnow())
+        .returning(Homework.tg_id)
+    )
+    return result.scalar_one_or_none()
+
+
+# ---------------- bulk moderation ----------------
+# пачка — один UPDATE ... WHERE id = ANY(:ids) RETURNING
+
+def any_id(ids: list[int]):
+    return any_(literal(ids, ARRAY(Integer)))
+
+
+def _lead_filters(filters: dict[str, str]):
+    return [Lead.status == "new", *(getattr(Lead, column) == value for column, value in filters.items())]
+
+
+async def count_new_leads(session: AsyncSession, **filters: str) -> tuple[int, int]:
+    # -> (сколько, max id): подтверждение потом обрабатывает только заявки, видные в превью
+    row = (await session.execute(
+        select(func.count(), func.coalesce(func.max(Lead.id), 0)).where(*_lead_filters(filters))
+    )).one()
+    return row[0], row[1]
+
+
+async def new_lead_ids(session: AsyncSession, after_id: int, max_id: int, limit: int, **filters: str) -> list[int]:
+    result = await session.scalars(
+        select(Lead.id)
+        .where(*_lead_filters(filters), Lead.id > after_id, Lead.id <= max_id)
+        .order_by(Lead.id)
+        .limit(limit)
+    )
+    return list(result)
+
+
+async def bulk_set_lead_status(session: AsyncSession, ids: list[int], status: str):
+    # -> [(id, tg_id, ...)]; заявки, которые уже разобрали поштучно, не трогаем
+    result = await session.execute(
+        update(Lead)
+        .where(Lead.id == any_id(ids), Lead.status == "new")
+        .values(status=status)
+        .returning(Lead.id, Lead.tg_id, Lead.created_at, Lead.student_class, Lead.goal)
+    )
+    rows = result.all()
+    # прежний статус известен из условия — CTE с блокировкой не нужен
+    rollup = Rollup()
+    for row in rows:
+        rollup.move("lead", row, row.goal, "new", status)
+    await rollup.apply(session)
+    return rows
+
+
+async def bulk_set_homework_status(session: AsyncSession, ids: list[int], status: str):
+    # -> [(id, tg_id, ...)]; как и у заявок — только непроверенные: уже разобранные ДЗ
+    # повторно не переключаются и ученик не получает второе уведомление
+    return await _update_homework_status(session, [Homework.id == any_id(ids), Homework.status == "new"], status)
+
+
+# ---------------- broadcasts ----------------
+
+def broadcast_recipients(after_tg_id: int = 0):
+    # получатели рассылки по возрастанию tg_id (keyset по PK), без заблокировавших бота
+    return select(User.tg_id).where(User.blocked_at.is_(None), User.tg_id > after_tg_id).order_by(User.tg_id)
+
+
+async def count_broadcast_recipients(session: AsyncSession) -> int:
+    return await session.scalar(select(func.count()).select_from(User).where(User.blocked_at.is_(None)))
+
+
+async def create_broadcast(session: AsyncSession, **values: Any) -> int:
+    result = await session.execute(insert(Broadcast).values(**values).returning(Broadcast.id))
+    return result.scalar_one()
+
+
+async def set_broadcast_status(
+    session: AsyncSession, broadcast_id: int, status: str, from_statuses: tuple[str, ...], **values: Any
+) -> bool:
+    # переход статуса только из допустимых (двойное нажатие «Запустить» не стартует рассылку дважды)
+    result = await session.execute(
+        update(Broadcast)
+        .where(Broadcast.id == broadcast_id, Broadcast.status.in_(from_statuses))
+        .values(status=status, **values)
+        .returning(Broadcast.id)
+    )
+    return result.scalar_one_or_none() is not None
+
+
+# ---------------- keyset pagination ----------------
+
+Cursor = tuple[datetime, int]  # (created_at, id)
+
+
+async def _page(session: AsyncSession, model, where, cursor: Cursor | None, forward: bool, limit: int,
+                descending: bool = False):
+    # keyset по (created_at, id): страница = O(limit) по индексу, без OFFSET.
+    # forward — к следующей странице в порядке показа. -> (rows, has_prev, has_next)
+    key = tuple_(model.created_at, model.id)
+    q = select(model).where(*where)
+    if forward != descending:
+        if cursor is not None:
+            q = q.where(key > tuple_(*cursor))
+        q = q.order_by(model.created_at, model.id)
+    else:
+        if cursor is not None:
+            q = q.where(key < tuple_(*cursor))
+        q = q.order_by(model.created_at.desc(), model.id.desc())
+    rows = list((await session.scalars(q.limit(limit + 1))).all())
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if forward:
+        return rows, cursor is not None, more
+    rows.reverse()
+    return rows, more, True
+
+
+async def homework_queue_page(session: AsyncSession, cursor: Cursor | None, forward: bool, limit: int):
+    return await _page(session, Homework, [Homework.status == "new"], cursor, forward, limit)
+
+
+async def lead_queue_page(session: AsyncSession, cursor: Cursor | None, forward: bool, limit: int):
+    return await _page(session, Lead, [Lead.status == "new"], cursor, forward, limit)
+
+
+async def student_homework_page(session: AsyncSession, tg_id: int, cursor: Cursor | None, forward: bool, limit: int):
+    # история — от новых к старым
+    return await _page(session, Homework, [Homework.tg_id == tg_id], cursor, forward, limit, descending=True)
+
+
+async def last_lead(session: AsyncSession, tg_id: int) -> Lead | None:
+    result = await session.scalars(
+        select(Lead).where(Lead.tg_id == tg_id).order_by(Lead.created_at.desc(), Lead.id.desc()).limit(1)
+    )
+    return result.first()
+
+
+async def get_homework(session: AsyncSession, hw_id: int, month: int | None = None) -> Homework | None:
+    result = await session.scalars(select(Homework).where(Homework.id == hw_id, *in_month(Homework, month)))
+    return result.first()
+
+
+async def homework_attachments(session: AsyncSession, hw_id: int) -> list[tuple[str, str]]:
+    # -> [(payload_type, file_id)] в порядке альбома
+    result = await session.execute(
+        select(HomeworkAttachment.payload_type, HomeworkAttachment.file_id)
+        .where(HomeworkAttachment.homework_id == hw_id)
+        .order_by(HomeworkAttachment.position)
+    )
+    return [tuple(row) for row in result]
+
+
+async def get_lead(session: AsyncSession, lead_id: int, month: int | None = None) -> Lead | None:
+    result = await session.scalars(select(Lead).where(Lead.id == lead_id, *in_month(Lead, month)))
+    return result.first()
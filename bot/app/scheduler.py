@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable
+
+from aiogram import Bot, Dispatcher
+
+from app import metrics
+from app.config import settings
+from app.ingest import poll_raw, update_chat_id
+
+log = logging.getLogger(__name__)
+
+Handle = Callable[[dict[str, Any]], Awaitable[Any]]
+
+scheduler_updates = metrics.Counter("bot_scheduler_updates_total", "Scheduled updates by result")
+scheduler_wait = metrics.Histogram("bot_scheduler_wait_seconds", "Time an update waited in the chat queue")
+
+
+class ChatScheduler:
+    """
+    Обработка апдейтов: апдейты одного чата — строго по одному и по порядку
+    (двойное нажатие не создаёт две заявки, FSM не гоняется сам с собой), разные чаты — параллельно.
+    Одновременно обрабатывается не больше max_in_flight апдейтов; слот отдаётся после каждого апдейта,
+    так что медленный чат не занимает его надолго.
+    Очередь чата ограничена chat_queue — лишнее отбрасывается (флуд одного чата);
+    всего ждущих не больше max_pending — put ждёт (polling), submit отказывает (webhook -> 503).
+    """
+
+    def __init__(self, handle: Handle, max_in_flight: int, chat_queue: int, max_pending: int):
+        self.handle = handle
+        self.slots = asyncio.Semaphore(max_in_flight)
+        self.chat_queue = chat_queue
+        self.max_pending = max_pending
+        self.pending = 0
+        self.in_flight = 0
+        self.stats = {"processed": 0, "failed": 0, "shed_chat": 0, "shed_backlog": 0}
+        self._queues: dict[int, deque[tuple[dict[str, Any], float]]] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._room = asyncio.Event()
+        self._room.set()
+
+        metrics.Gauge(
+            "bot_scheduler_load", "Scheduler load",
+            lambda: {
+                (("kind", "in_flight"),): self.in_flight,
+                (("kind", "pending"),): self.pending,
+                (("kind", "chats"),): len(self._queues),
+            },
+        )
+
+    def _count(self, result: str):
+        self.stats[result] += 1
+        scheduler_updates.inc(result=result)
+
+    def submit(self, raw: dict[str, Any]) -> bool:
+        # False — нет места, апдейт не принят (повторить позже); переполненная очередь чата — отброшен, True
+        if self.pending >= self.max_pending:
+            self._count("shed_backlog")
+            return False
+        chat_id = update_chat_id(raw)
+        queue = self._queues.get(chat_id)
+        if queue is not None and len(queue) >= self.chat_queue:
+            self._count("shed_chat")
+            log.info("chat %s: queue full, update %s dropped", chat_id, raw.get("update_id"))
+            return True
+        if queue is None:
+            queue = self._queues[chat_id] = deque()
+            task = asyncio.create_task(self._run_chat(chat_id, queue))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        queue.append((raw, time.monotonic()))
+        self.pending += 1
+        if self.pending >= self.max_pending:
+            self._room.clear()
+        return True
+
+    async def put(self, raw: dict[str, Any]):
+        # с ожиданием места: источник апдейтов притормаживает вместо отказа
+        while self.pending >= self.max_pending:
+            await self._room.wait()
+        self.submit(raw)
+
+    async def _run_chat(self, chat_id: int, queue: deque):
+        try:
+            while queue:
+                async with self.slots:
+                    raw, queued_at = queue.popleft()
+                    self.pending -= 1
+                    self._room.set()
+                    scheduler_wait.observe(time.monotonic() - queued_at)
+                    self.in_flight += 1
+                    try:
+                        await self.handle(raw)
+                        self._count("processed")
+                    except Exception:
+                        self._count("failed")
+                        log.exception("update %s failed", raw.get("update_id"))
+                    finally:
+                        self.in_flight -= 1
+        finally:
+            # между проверкой `while queue` и удалением нет await — новый апдейт не потеряется
+            del self._queues[chat_id]
+
+    async def drain(self, timeout: float):
+        # остановка: дать начатым чатам доработать
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+
+
+def make_scheduler(bot: Bot, dp: Dispatcher) -> ChatScheduler:
+    return ChatScheduler(
+        lambda raw: dp.feed_raw_update(bot, raw),
+        max_in_flight=settings.SCHEDULER_MAX_IN_FLIGHT,
+        chat_queue=settings.SCHEDULER_CHAT_QUEUE,
+        max_pending=settings.SCHEDULER_MAX_PENDING,
+    )
+
+
+async def run_polling(bot: Bot, dp: Dispatcher, scheduler: ChatScheduler):
+    # вместо dp.start_polling: апдейты идут через планировщик, разбор — уже в задаче чата
+    log.info("polling as @%s", (await bot.me()).username)
+    async for updates in poll_raw(bot, dp.resolve_used_update_types()):
+        for raw in updates:
+            await scheduler.put(raw)
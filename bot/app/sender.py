@@ -0,0 +1,115 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, TypeVar
+
+from aiogram.exceptions import (
+    TelegramEntityTooLarge,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+from app.config import settings
+
+T = TypeVar("T")
+
+
+class TokenBucket:
+    # Бакет с резервированием: токены могут уйти в минус,
+    # тогда вызывающий просто ждёт свою очередь (без циклов опроса).
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    async def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class Sender:
+    """
+    Общий исходящий канал в Telegram:
+    глобальный лимит (~30 msg/s), лимит на чат, retry-after и backoff на сетевых ошибках.
+    """
+
+    def __init__(
+        self,
+        global_rate: float,
+        chat_rate: float,
+        chat_burst: int,
+        max_retries: int,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30.0,
+        max_chats: int = 10_000,
+    ):
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._chats: OrderedDict[int, TokenBucket] = OrderedDict()
+        self._max_chats = max_chats
+        self._paused_until = 0.0
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self._chat_rate, self._chat_burst)
+            self._chats[chat_id] = bucket
+            if len(self._chats) > self._max_chats:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def _wait_pause(self):
+        # retry-after от Telegram касается всего бота, а не одного чата
+        delay = self._paused_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def call(self, chat_id: int, request: Callable[[], Awaitable[T]]) -> T:
+        # request — фабрика корутины: на каждый повтор нужен новый вызов
+        attempt = 0
+        while True:
+            await self._chat_bucket(chat_id).acquire()
+            await self._wait_pause()
+            await self._global.acquire()
+            try:
+                return await request()
+            except TelegramRetryAfter as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = float(e.retry_after)
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            except (TelegramNetworkError, TelegramServerError) as e:
+                # TelegramEntityTooLarge — подкласс TelegramNetworkError, но повтор его не исправит
+                if attempt >= self.max_retries or isinstance(e, TelegramEntityTooLarge):
+                    raise
+                delay = min(self.backoff_base * 2 ** attempt, self.backoff_max)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+
+sender = Sender(
+    global_rate=settings.SEND_GLOBAL_RATE,
+    chat_rate=settings.SEND_CHAT_RATE,
+    chat_burst=settings.SEND_CHAT_BURST,
+    max_retries=settings.SEND_MAX_RETRIES,
+)
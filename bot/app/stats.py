@@ -0,0 +1,201 @@
+import html
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Any
+
+from sqlalchemy import BigInteger, Date, cast, delete, func, insert, literal_column, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.db import SessionLocal
+from app.models import Homework, Lead, StatsDaily
+from app.partitions import attached_months
+
+Key = tuple[date, str, str, str, str]  # (day, kind, student_class, dim, status)
+
+LEAD_STATUSES = {"new": "новых", "approved": "одобрено", "rejected": "отклонено"}
+HW_STATUSES = {"new": "ждут", "accepted": "принято", "rework": "на доработку"}
+
+
+def review_month(created_at: date) -> str:
+    return f"{created_at:%Y-%m}"
+
+
+class Rollup:
+    # дельты роллапа одной транзакции; apply — один upsert на все затронутые ключи
+    def __init__(self):
+        self.deltas: dict[Key, list[int]] = defaultdict(lambda: [0, 0])
+
+    def add(self, kind: str, at: datetime, student_class: str, dim: str, status: str, n: int = 1, seconds: int = 0):
+        delta = self.deltas[(at.date(), kind, student_class, dim, status)]
+        delta[0] += n
+        delta[1] += seconds
+
+    def move(self, kind: str, row: Any, dim: str, old_status: str, new_status: str):
+        # смена статуса: строка переезжает между счётчиками своего дня создания
+        if old_status != new_status:
+            self.add(kind, row.created_at, row.student_class, dim, old_status, -1)
+            self.add(kind, row.created_at, row.student_class, dim, new_status)
+
+    def reviewed(self, row: Any, now: datetime):
+        # день — проверки, status — месяц создания ДЗ (см. StatsDaily)
+        self.add(
+            "review", now, row.student_class, row.topic, review_month(row.created_at),
+            seconds=int((now - row.created_at).total_seconds()),
+        )
+
+    async def apply(self, session: AsyncSession):
+        rows = [
+            {"day": k[0], "kind": k[1], "student_class": k[2], "dim": k[3], "status": k[4], "n": n, "seconds": sec}
+            for k, (n, sec) in sorted(self.deltas.items())
+            if n or sec
+        ]
+        if not rows:
+            return
+        # ключи по порядку — параллельные транзакции блокируют строки роллапа в одном порядке
+        stmt = pg_insert(StatsDaily).values(rows)
+        await session.execute(stmt.on_conflict_do_update(
+            index_elements=[StatsDaily.day, StatsDaily.kind, StatsDaily.student_class, StatsDaily.dim, StatsDaily.status],
+            set_={"n": StatsDaily.n + stmt.excluded.n, "seconds": StatsDaily.seconds + stmt.excluded.seconds},
+        ))
+
+
+# ---------------- rebuild ----------------
+
+def _rebuild_selects():
+    lead_day = cast(Lead.created_at, Date)
+    hw_day = cast(Homework.created_at, Date)
+    review_day = cast(Homework.reviewed_at, Date)
+    # формат — литералом: с bind-параметром выражения в SELECT и GROUP BY не совпали бы
+    created_month = func.to_char(Homework.created_at, literal_column("'YYYY-MM'"))
+    zero = literal_column("0", BigInteger)
+    yield select(
+        lead_day, literal_column("'lead'"), Lead.student_class, Lead.goal, Lead.status, func.count(), zero,
+    ).group_by(lead_day, Lead.student_class, Lead.goal, Lead.status)
+    yield select(
+        hw_day, literal_column("'hw'"), Homework.student_class, Homework.topic, Homework.status, func.count(), zero,
+    ).group_by(hw_day, Homework.student_class, Homework.topic, Homework.status)
+    yield select(
+        review_day, literal_column("'review'"), Homework.student_class, Homework.topic, created_month,
+        func.count(),
+        cast(func.sum(func.extract("epoch", Homework.reviewed_at - Homework.created_at)), BigInteger),
+    ).where(Homework.reviewed_at.is_not(None)).group_by(
+        review_day, Homework.student_class, Homework.topic, created_month,
+    )
+
+
+async def rebuild(session: AsyncSession) -> int:
+    # пересчёт с нуля; EXCLUSIVE блокирует инкрементальные upsert'ы до коммита, чтение не мешает.
+    # Транзакции, записавшие заявку до блокировки, но не дошедшие до роллапа, применят свои дельты после.
+    # Удаляется ровно то, что пересчитывается из подключённых партиций: lead/hw — по дню создания,
+    # review — по месяцу создания ДЗ (день проверки у ДЗ из архива может быть и позже).
+    # Счётчики отключённых в архив партиций остаются как были.
+    await session.execute(text("LOCK TABLE stats_daily IN EXCLUSIVE MODE"))
+    conn = await session.connection()
+    lead_months = await attached_months(conn, Lead.__tablename__)
+    if lead_months:
+        await session.execute(delete(StatsDaily).where(StatsDaily.kind == "lead", StatsDaily.day >= lead_months[0]))
+    hw_months = await attached_months(conn, Homework.__tablename__)
+    if hw_months:
+        await session.execute(delete(StatsDaily).where(StatsDaily.kind == "hw", StatsDaily.day >= hw_months[0]))
+        await session.execute(delete(StatsDaily).where(
+            StatsDaily.kind == "review", StatsDaily.status >= review_month(hw_months[0]),
+        ))
+    columns = ["day", "kind", "student_class", "dim", "status", "n", "seconds"]
+    for query in _rebuild_selects():
+        await session.execute(insert(StatsDaily).from_select(columns, query))
+    return await session.scalar(select(func.count()).select_from(StatsDaily))
+
+
+# ---------------- /stats ----------------
+
+def _fmt_duration(seconds: float) -> str:
+    minutes = int(seconds // 60)
+    if minutes < 60:
+        return f"{minutes} мин"
+    hours, minutes = divmod(minutes, 60)
+    if hours < 48:
+        return f"{hours} ч {minutes} мин"
+    return f"{hours // 24} дн {hours % 24} ч"
+
+
+def _top(counter: dict[str, int]) -> str:
+    items = sorted(counter.items(), key=lambda kv: (-kv[1], kv[0]))
+    return ", ".join(f"{html.escape(k)} {v}" for k, v in items if v) or "—"
+
+
+def render(rows: list[StatsDaily], days: int, today: date) -> str:
+    lead_status: dict[str, int] = defaultdict(int)
+    lead_goal: dict[str, int] = defaultdict(int)
+    lead_class: dict[str, int] = defaultdict(int)
+    lead_day: dict[date, dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    hw_status: dict[str, int] = defaultdict(int)
+    hw_topic: dict[str, int] = defaultdict(int)
+    reviewed = review_seconds = 0
+    for r in rows:
+        if r.kind == "lead":
+            lead_status[r.status] += r.n
+            lead_goal[r.dim] += r.n
+            lead_class[f"{r.student_class} кл."] += r.n
+            lead_day[r.day][r.dim] += r.n
+        elif r.kind == "hw":
+            hw_status[r.status] += r.n
+            hw_topic[r.dim] += r.n
+        elif r.kind == "review":
+            reviewed += r.n
+            review_seconds += r.seconds
+
+    decided = lead_status["approved"] + lead_status["rejected"]
+    lines = [
+        f"📊 <b>Статистика за {days} дн.</b> (дни по UTC)",
+        "",
+        f"<b>Заявки:</b> {sum(lead_status.values())} ("
+        + ", ".join(f"{title} {lead_status[s]}" for s, title in LEAD_STATUSES.items()) + ")",
+        f"Одобряемость: {lead_status['approved'] * 100 // decided}%" if decided else "Одобряемость: —",
+        f"По цели: {_top(lead_goal)}",
+        f"По классу: {_top(lead_class)}",
+        "По дням:",
+    ]
+    for i in range(min(days, 7)):
+        day = today - timedelta(days=i)
+        goals = lead_day.get(day, {})
+        lines.append(f"  {day:%d.%m}: {sum(goals.values())}" + (f" ({_top(goals)})" if goals else ""))
+    lines += [
+        "",
+        f"<b>ДЗ:</b> {sum(hw_status.values())} ("
+        + ", ".join(f"{title} {hw_status[s]}" for s, title in HW_STATUSES.items()) + ")",
+        f"По темам: {_top(hw_topic)}",
+        f"Время до проверки: в среднем {_fmt_duration(review_seconds / reviewed)} (проверено {reviewed})"
+        if reviewed else "Время до проверки: —",
+    ]
+    return "\n".join(lines)
+
+
+class StatsCache:
+    """
+    Отчёт /stats с коротким TTL. Читается только роллап за окно в days дней —
+    объём чтения зависит от окна и числа классов/целей/тем, а не от истории заявок и ДЗ.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._items: dict[int, tuple[float, str]] = {}
+
+    async def get(self, days: int) -> str:
+        cached = self._items.get(days)
+        if cached is not None and time.monotonic() - cached[0] < self.ttl:
+            return cached[1]
+        today = datetime.utcnow().date()
+        async with SessionLocal() as s:
+            rows = list(await s.scalars(select(StatsDaily).where(StatsDaily.day > today - timedelta(days=days))))
+        report = render(rows, days, today)
+        self._items[days] = (time.monotonic(), report)
+        return report
+
+    def clear(self):
+        self._items.clear()
+
+
+stats_cache = StatsCache(settings.STATS_CACHE_TTL)
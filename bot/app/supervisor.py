@@ -0,0 +1,267 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import resource
+import sys
+import time
+from bisect import bisect
+from typing import Any
+
+from aiogram import Bot, Dispatcher
+
+from app import metrics
+from app.config import settings
+from app.ingest import poll_raw, update_chat_id
+from app.scheduler import ChatScheduler
+from app.webhook import run_webhook
+
+log = logging.getLogger(__name__)
+
+REPORT_INTERVAL = 2.0
+# счётчики из отчёта воркера (ChatScheduler.stats)
+REPORTED = ("processed", "failed", "shed_chat", "shed_backlog")
+# ждём последний отчёт упавшего воркера перед подсчётом потерь
+FINAL_REPORT_WAIT = 1.0
+
+
+def _hash(key: str) -> int:
+    # стабильный между процессами и перезапусками (в отличие от hash())
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    # consistent hashing: при смене числа воркеров переезжает ~1/N чатов, остальные остаются на своих процессах
+    def __init__(self, nodes: int, replicas: int = 256):
+        points = sorted((_hash(f"worker-{node}:{i}"), node) for node in range(nodes) for i in range(replicas))
+        self._points = [p for p, _ in points]
+        self._nodes = [n for _, n in points]
+
+    def node(self, chat_id: int) -> int:
+        return self._nodes[bisect(self._points, _hash(str(chat_id))) % len(self._points)]
+
+
+# ---------------- supervisor ----------------
+
+class WorkerProcess:
+    """
+    Дочерний процесс `python -m app.main worker <index>`. Апдейты уходят ему в stdin
+    кадрами <4 байта длины><json>, отчёты о нагрузке приходят JSON-строками из stdout.
+    Пока процесс перезапускается, апдейты копятся в очереди (до SUPERVISOR_QUEUE_SIZE).
+    Апдейты, уже переданные процессу, но не обработанные к его падению, теряются —
+    их число (оценка сверху: отчёт бывает старше на REPORT_INTERVAL) идёт в счётчик lost.
+    """
+
+    def __init__(self, index: int, queue_size: int, env: dict[str, str]):
+        self.index = index
+        self.env = env
+        self.queue: asyncio.Queue[bytes] = asyncio.Queue(maxsize=queue_size)
+        self.proc: asyncio.subprocess.Process | None = None
+        self.stats = {"routed": 0, "lost": 0, "restarts": 0}
+        self.report: dict[str, Any] = {}
+        self.written = 0  # кадров передано текущему процессу
+
+    async def _spawn(self):
+        self.proc = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "app.main", "worker", str(self.index),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            env=self.env,
+        )
+        self.report = {}
+        self.written = 0
+        log.info("worker %s started, pid %s", self.index, self.proc.pid)
+
+    async def _pump(self):
+        stdin = self.proc.stdin
+        while True:
+            frame = await self.queue.get()
+            try:
+                stdin.write(frame)
+                await stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                # процесс упал: кадр потерян, остальное дождётся перезапуска в очереди
+                self.stats["lost"] += 1
+                return
+            self.written += 1
+
+    async def _read_reports(self):
+        async for line in self.proc.stdout:
+            try:
+                self.report = json.loads(line)
+            except ValueError:
+                log.warning("worker %s: unexpected stdout: %r", self.index, line[:200])
+
+    async def run(self):
+        backoff = 1.0
+        while True:
+            await self._spawn()
+            started = time.monotonic()
+            pump = asyncio.create_task(self._pump())
+            reader = asyncio.create_task(self._read_reports())
+            try:
+                code = await self.proc.wait()
+                await asyncio.wait({reader}, timeout=FINAL_REPORT_WAIT)
+            finally:
+                pump.cancel()
+                reader.cancel()
+            # переданные, но не обработанные апдейты (очередь планировщика воркера) потеряны
+            lost = max(self.written - sum(self.report.get(k, 0) for k in REPORTED), 0)
+            self.stats["lost"] += lost
+            self.stats["restarts"] += 1
+            # падает сразу после старта — не крутим перезапуски в цикле
+            backoff = 1.0 if time.monotonic() - started > 60 else min(backoff * 2, 30.0)
+            log.error(
+                "worker %s exited with %s, up to %s updates lost, restarting in %.0fs",
+                self.index, code, lost, backoff,
+            )
+            await asyncio.sleep(backoff)
+
+    async def stop(self, timeout: float):
+        # EOF в stdin: воркер дорабатывает начатые апдейты и выходит
+        if self.proc is None or self.proc.returncode is not None:
+            return
+        self.proc.stdin.close()
+        try:
+            await asyncio.wait_for(self.proc.wait(), timeout)
+        except asyncio.TimeoutError:
+            self.proc.kill()
+
+
+class Supervisor:
+    """
+    Многопроцессный режим: один процесс принимает апдейты (polling или webhook) и без разбора
+    раздаёт сырые JSON по воркерам — consistent hash от chat id. Все апдейты чата
+    обрабатывает один и тот же процесс, его локальные кэши (FSM, альбомы, антифлуд) остаются согласованными.
+    Разбор апдейтов, хендлеры и сериализация ответов масштабируются по ядрам.
+    """
+
+    def __init__(self, workers: int, queue_size: int):
+        self.ring = HashRing(workers)
+        env = dict(os.environ)
+        # Общий лимит отправки Telegram делится между процессами. Рассылки («на всю базу») идут
+        # только в воркере 0 — ему сверху их квота BROADCAST_RATE, остаток — поровну всем воркерам
+        broadcast_rate = settings.BROADCAST_RATE
+        if broadcast_rate >= settings.SEND_GLOBAL_RATE:
+            broadcast_rate = settings.SEND_GLOBAL_RATE / 2
+        share = (settings.SEND_GLOBAL_RATE - broadcast_rate) / workers
+        self.workers = []
+        for index in range(workers):
+            worker_env = dict(env)
+            worker_env["SEND_GLOBAL_RATE"] = str(share + broadcast_rate if index == 0 else share)
+            if index == 0:
+                worker_env["BROADCAST_RATE"] = str(broadcast_rate)
+            if settings.METRICS_PORT:
+                worker_env["METRICS_PORT"] = str(settings.METRICS_PORT + 1 + index)
+            self.workers.append(WorkerProcess(index, queue_size, worker_env))
+
+        metrics.Gauge(
+            "bot_worker_updates", "Per-worker update counters",
+            lambda: {
+                (("event", k), ("worker", str(w.index))): v
+                for w in self.workers
+                for k, v in {**w.stats, **{k: w.report.get(k, 0) for k in REPORTED}}.items()
+            },
+        )
+        metrics.Gauge(
+            "bot_worker_queue_depth", "Updates buffered for a worker",
+            lambda: {(("worker", str(w.index)),): w.queue.qsize() for w in self.workers},
+        )
+        metrics.Gauge(
+            "bot_worker_in_flight", "Updates being processed by a worker",
+            lambda: {(("worker", str(w.index)),): w.report.get("in_flight", 0) for w in self.workers},
+        )
+        metrics.Gauge(
+            "bot_worker_cpu_seconds", "CPU time used by a worker process",
+            lambda: {(("worker", str(w.index)),): w.report.get("cpu", 0.0) for w in self.workers},
+        )
+
+    def _frame(self, raw: dict[str, Any]) -> tuple[WorkerProcess, bytes]:
+        worker = self.workers[self.ring.node(update_chat_id(raw))]
+        body = json.dumps(raw, ensure_ascii=False, separators=(",", ":")).encode()
+        return worker, len(body).to_bytes(4, "big") + body
+
+    async def route(self, raw: dict[str, Any]):
+        # polling: очередь воркера полна — ждём
+        worker, frame = self._frame(raw)
+        await worker.queue.put(frame)
+        worker.stats["routed"] += 1
+
+    def submit(self, raw: dict[str, Any]) -> bool:
+        # webhook: очередь воркера полна — отказ (503)
+        worker, frame = self._frame(raw)
+        try:
+            worker.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            return False
+        worker.stats["routed"] += 1
+        return True
+
+    def start(self) -> list[asyncio.Task]:
+        return [asyncio.create_task(w.run()) for w in self.workers]
+
+    async def stop(self, tasks: list[asyncio.Task], timeout: float = 10.0):
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*(w.stop(timeout) for w in self.workers))
+
+
+async def run_supervisor(bot: Bot, dp: Dispatcher):
+    supervisor = Supervisor(settings.SUPERVISOR_WORKERS, settings.SUPERVISOR_QUEUE_SIZE)
+    tasks = supervisor.start()
+    log.info("supervisor: %s workers, mode %s", len(supervisor.workers), settings.BOT_MODE)
+    metrics_runner = None
+    try:
+        if settings.METRICS_PORT:
+            metrics_runner = await metrics.start_server(settings.METRICS_HOST, settings.METRICS_PORT)
+        if settings.BOT_MODE == "webhook":
+            await run_webhook(bot, dp, submit=supervisor.submit)
+        else:
+            async for updates in poll_raw(bot, dp.resolve_used_update_types()):
+                for raw in updates:
+                    await supervisor.route(raw)
+    finally:
+        await supervisor.stop(tasks)
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+
+
+# ---------------- worker ----------------
+
+def _report(scheduler: ChatScheduler):
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    line = json.dumps({
+        **scheduler.stats,
+        "in_flight": scheduler.in_flight,
+        "pending": scheduler.pending,
+        "cpu": round(usage.ru_utime + usage.ru_stime, 3),
+    })
+    sys.stdout.write(line + "\n")
+    sys.stdout.flush()
+
+
+async def run_worker(scheduler: ChatScheduler, drain_timeout: float = 10.0):
+    # читает кадры из stdin до EOF (остановка супервизора) и отдаёт их планировщику чатов
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+
+    async def report_loop():
+        while True:
+            _report(scheduler)
+            await asyncio.sleep(REPORT_INTERVAL)
+
+    reporter = asyncio.create_task(report_loop())
+    try:
+        while True:
+            try:
+                size = int.from_bytes(await reader.readexactly(4), "big")
+                raw = json.loads(await reader.readexactly(size))
+            except asyncio.IncompleteReadError:
+                break
+            await scheduler.put(raw)
+        await scheduler.drain(drain_timeout)
+    finally:
+        reporter.cancel()
+        _report(scheduler)
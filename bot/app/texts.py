@@ -52,8 +52,24 @@ HW_DONE = (
     "Как только проверю — отправлю комментарий сюда."
 )
 
+HW_ALBUM_UNSUPPORTED = (
+    "Такой альбом не получится отправить на проверку 🙁\n"
+    "Пришлите ДЗ фото, видео, файлом или текстом."
+)
+
 UNKNOWN_TEXT = (
     "Понял 🙂\n"
     "Если хотите *записаться* — нажмите кнопку ниже.\n"
     "Если это вопрос — нажмите *Задать вопрос*."
 )
+
+LEAD_APPROVED = "✅ Заявка подтверждена!\n\nЯ напишу вам детали по группе и времени занятий."
+
+LEAD_REJECTED = (
+    "Спасибо за заявку! Сейчас подходящих мест нет 😔\n"
+    "Я могу предложить другое время/формат — напишите, пожалуйста, в ответ."
+)
+
+HW_ACCEPTED = "✅ ДЗ проверено: *Принято*.\n\nЕсли хотите — отправьте следующее 🙂"
+
+HW_REWORK = "🔁 ДЗ проверено: *Нужно доработать*.\n\nЕсли хотите — отправьте исправленную версию."
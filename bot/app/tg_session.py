@@ -0,0 +1,45 @@
+import time
+from typing import Any, Dict, Optional
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import InputFile
+from aiohttp import FormData
+
+from app.keyboards import markup_json
+from app.metrics import tg_api_errors, tg_api_seconds
+
+
+class BotSession(AiohttpSession):
+    # для замороженных клавиатур reply_markup не дампится заново — берём готовый JSON
+    def build_form_data(self, bot: Bot, method: TelegramMethod[Any]) -> FormData:
+        cached = markup_json(getattr(method, "reply_markup", None))
+        if cached is None:
+            return super().build_form_data(bot, method)
+
+        form = FormData(quote_fields=False)
+        files: Dict[str, InputFile] = {}
+        for key, value in method.model_dump(warnings=False, exclude={"reply_markup"}).items():
+            value = self.prepare_value(value, bot=bot, files=files)
+            if not value:
+                continue
+            form.add_field(key, value)
+        form.add_field("reply_markup", cached)
+        for key, value in files.items():
+            form.add_field(key, value.read(bot), filename=value.filename or key)
+        return form
+
+    async def make_request(
+        self, bot: Bot, method: TelegramMethod[TelegramType], timeout: Optional[int] = None
+    ) -> TelegramType:
+        name = method.__api_method__
+        started = time.perf_counter()
+        try:
+            return await super().make_request(bot, method, timeout=timeout)
+        except Exception as e:
+            tg_api_errors.inc(method=name, error=type(e).__name__)
+            raise
+        finally:
+            tg_api_seconds.observe(time.perf_counter() - started, method=name)
@@ -0,0 +1,111 @@
+import time
+from array import array
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+from app.config import settings
+from app.metrics import throttled
+
+SLOW_DOWN_TEXT = "⏳ Слишком часто. Подождите немного и попробуйте снова 🙂"
+
+
+class _Window:
+    # скользящее окно как кольцо из последних limit отметок времени (array('d') — 8 байт на отметку)
+    __slots__ = ("stamps", "pos")
+
+    def __init__(self, limit: int):
+        self.stamps = array("d", bytes(8 * limit))
+        self.pos = 0
+
+    def hit(self, now: float, window: float) -> bool:
+        # True — событие укладывается в лимит и учтено
+        if self.stamps[self.pos] > now - window:
+            return False
+        self.stamps[self.pos] = now
+        self.pos = (self.pos + 1) % len(self.stamps)
+        return True
+
+
+class _UserState:
+    __slots__ = ("message", "callback", "warned_until", "last_seen")
+
+    def __init__(self):
+        self.message: _Window | None = None
+        self.callback: _Window | None = None
+        self.warned_until = 0.0
+        self.last_seen = 0.0
+
+
+class Throttler:
+    def __init__(self, window: float, message_limit: int, callback_limit: int, idle: float):
+        self.window = window
+        self.limits = {"message": message_limit, "callback": callback_limit}
+        self.idle = idle
+        self._users: OrderedDict[int, _UserState] = OrderedDict()
+
+    def _state(self, user_id: int, now: float) -> _UserState:
+        state = self._users.get(user_id)
+        if state is None:
+            state = _UserState()
+            self._users[user_id] = state
+        else:
+            self._users.move_to_end(user_id)
+        state.last_seen = now
+        # порядок — по последней активности: простаивающих выкидываем с головы за O(1)
+        while self._users:
+            uid, oldest = next(iter(self._users.items()))
+            if oldest.last_seen > now - self.idle:
+                break
+            del self._users[uid]
+        return state
+
+    def check(self, user_id: int, kind: str) -> tuple[bool, bool]:
+        # -> (allowed, warn): warn — ответить «помедленнее» (не чаще раза за окно)
+        now = time.monotonic()
+        state = self._state(user_id, now)
+        win = getattr(state, kind)
+        if win is None:
+            win = _Window(self.limits[kind])
+            setattr(state, kind, win)
+        if win.hit(now, self.window):
+            return True, False
+        throttled.inc(kind=kind)
+        if now >= state.warned_until:
+            state.warned_until = now + self.window
+            return False, True
+        return False, False
+
+
+class ThrottleMiddleware(BaseMiddleware):
+    def __init__(self, throttler: Throttler):
+        self.throttler = throttler
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None or user.id in settings.admin_ids:
+            return await handler(event, data)
+
+        kind = "callback" if isinstance(event, CallbackQuery) else "message"
+        allowed, warn = self.throttler.check(user.id, kind)
+        if allowed:
+            return await handler(event, data)
+        if warn and isinstance(event, (Message, CallbackQuery)):
+            # для callback это ещё и снимает «часики» с кнопки
+            await event.answer(SLOW_DOWN_TEXT)
+        return None
+
+
+throttler = Throttler(
+    window=settings.THROTTLE_WINDOW,
+    message_limit=settings.THROTTLE_MESSAGE_LIMIT,
+    callback_limit=settings.THROTTLE_CALLBACK_LIMIT,
+    idle=settings.THROTTLE_IDLE,
+)
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+from collections import OrderedDict
+
+from aiogram.types import User as TgUser
+from sqlalchemy.dialects.postgresql import insert
+
+from app.config import settings
+from app.db import SessionLocal
+from app.models import User
+
+log = logging.getLogger(__name__)
+
+Profile = tuple[str | None, str | None]  # (username, full_name)
+
+# full_name из Telegram бывает до 129 символов (имя 64 + пробел + фамилия 64) — режем под колонки
+USERNAME_LEN = User.__table__.c.username.type.length
+FULL_NAME_LEN = User.__table__.c.full_name.type.length
+
+
+def _clip(value: str | None, length: int) -> str | None:
+    return value[:length] if value else value
+
+
+class UserRegistry:
+    """
+    Кэш известных пользователей + отложенная пачечная запись.
+    /start для уже виденного пользователя не ходит в БД вообще;
+    новые и изменившиеся профили сбрасываются раз в flush_interval одним INSERT ... ON CONFLICT.
+    """
+
+    def __init__(self, cache_size: int, flush_interval: float):
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self._known: OrderedDict[int, Profile] = OrderedDict()
+        self._pending: dict[int, dict] = {}
+
+    def touch(self, user: TgUser):
+        profile = (_clip(user.username, USERNAME_LEN), _clip(user.full_name, FULL_NAME_LEN))
+        if self._known.get(user.id) == profile:
+            self._known.move_to_end(user.id)
+            return
+        self._pending[user.id] = {"tg_id": user.id, "username": profile[0], "full_name": profile[1]}
+
+    def forget(self, tg_ids: list[int]):
+        # следующий touch снова дойдёт до БД (например, чтобы снять blocked_at)
+        for tg_id in tg_ids:
+            self._known.pop(tg_id, None)
+
+    def _remember(self, tg_id: int, profile: Profile):
+        self._known[tg_id] = profile
+        self._known.move_to_end(tg_id)
+        if len(self._known) > self.cache_size:
+            self._known.popitem(last=False)
+
+    @staticmethod
+    async def _upsert(rows: list[dict]):
+        stmt = insert(User).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[User.tg_id],
+            # пользователь снова пишет боту — значит, больше не заблокировал
+            set_={"username": stmt.excluded.username, "full_name": stmt.excluded.full_name, "blocked_at": None},
+            # не плодим пустые UPDATE, если профиль не поменялся
+            where=(User.username.is_distinct_from(stmt.excluded.username))
+            | (User.full_name.is_distinct_from(stmt.excluded.full_name))
+            | User.blocked_at.is_not(None),
+        )
+        async with SessionLocal() as s:
+            await s.execute(stmt)
+            await s.commit()
+
+    async def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        rows = list(pending.values())
+        try:
+            await self._upsert(rows)
+            saved = rows
+        except Exception:
+            # одна плохая строка не должна держать всю пачку: повторяем по одной,
+            # не прошедшие — в лог и выбрасываем (в очередь не возвращаем, иначе она растёт без конца).
+            # В кэш они не попали — следующий touch пользователя снова поставит его в запись
+            log.exception("users batch upsert failed, retrying %s rows one by one", len(rows))
+            saved = []
+            for row in rows:
+                try:
+                    await self._upsert([row])
+                    saved.append(row)
+                except Exception as e:
+                    log.warning("user %s upsert failed, dropped: %r", row["tg_id"], e)
+        for row in saved:
+            self._remember(row["tg_id"], (row["username"], row["full_name"]))
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                log.exception("users flush failed")
+
+
+users = UserRegistry(cache_size=settings.USER_CACHE_SIZE, flush_interval=settings.USER_FLUSH_INTERVAL)
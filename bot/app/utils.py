@@ -1,19 +1,167 @@
 import re
+from functools import lru_cache
 
+# Интенты по приоритету (при нескольких совпадениях побеждает верхний).
+# "стем*" — любое слово с этим началом, без "*" — слово целиком; фразы — через пробел.
 FAQ_PATTERNS = [
-    (re.compile(r"\b(цена|сколько\s+стоит|стоимость|оплата)\b", re.I), "menu:faq"),
-    (re.compile(r"\b(расписани|когда\s+занятия|время|дни)\b", re.I), "menu:about"),
-    (re.compile(r"\b(отзыв|результат|кейсы)\b", re.I), "menu:reviews"),
-    (re.compile(r"\b(запис|хочу\s+заниматься|как\s+попасть)\b", re.I), "lead:start"),
-    (re.compile(r"\b(дз|домашк|провер(ить|ка))\b", re.I), "hw:start"),
+    # не "цен*": ценный, ценность
+    ("menu:faq", [
+        "цена", "цены", "цену", "цене", "ценам", "ценах", "ценник*",
+        "сколько сто*", "стоимост*", "оплат*", "оплач*",
+    ]),
+    ("menu:about", ["расписани*", "когда заняти*", "время", "времени", "дни"]),
+    ("menu:reviews", ["отзыв*", "результат*", "кейс*"]),
+    # не "запис*": записка, записки, записной
+    ("lead:start", ["записат*", "записыв*", "запиши*", "запишу*", "запись", "записи", "хочу занима*", "как попаст*"]),
+    ("hw:start", ["дз", "домашк*", "домашн* задани*", "провер*"]),
 ]
 
+# Опечатки: слово сравнивается целиком с этими формами (не со стемами — стем "запис"
+# с одной ошибкой совпал бы с началом "зависит", "запас", "записка").
+TYPO_WORDS = {
+    "menu:faq": ["стоимость", "стоимости", "оплата", "оплаты", "оплату", "оплатить"],
+    "menu:about": ["расписание", "расписания"],
+    "menu:reviews": ["отзыв", "отзывы", "отзывов", "результат", "результаты", "результатов"],
+    "lead:start": ["запись", "записаться", "записать", "запишите", "заниматься"],
+    "hw:start": ["домашка", "домашку", "домашки", "проверить", "проверьте", "проверка", "проверку"],
+}
+
+# короче FUZZY_MIN_LEN опечатки не ищем: на коротких словах слишком много ложных срабатываний
+FUZZY_MIN_LEN = 5
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def normalize(text: str) -> str:
+    return (text or "").strip().lower().replace("ё", "е")
+
+
+def max_typos(length: int) -> int:
+    # допустимое число ошибок растёт с длиной слова
+    if length < FUZZY_MIN_LEN:
+        return 0
+    return 1 if length < 10 else 2
+
+
+def _deletes(word: str, depth: int) -> set[str]:
+    result = {word}
+    for _ in range(depth):
+        result |= {w[:i] + w[i + 1:] for w in result for i in range(len(w))}
+    return result
+
+
+def edit_distance(a: str, b: str) -> int:
+    # Дамерау–Левенштейн (перестановка соседних букв — одна ошибка)
+    prev2: list[int] = []
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        prev2, prev = prev, cur
+    return prev[-1]
+
+
+def _term_regex(term: str) -> str:
+    words = term.split()
+    parts = []
+    for word in words:
+        if word.endswith("*"):
+            parts.append(re.escape(word[:-1]) + r"\w*")
+        else:
+            parts.append(re.escape(word) + r"(?!\w)")
+    return r"\s+".join(parts)
+
+
+class IntentMatcher:
+    """
+    Классификатор за один проход: все стемы/фразы собраны в одну альтернацию
+    с именованными группами (группа = приоритет интента). Если точных совпадений нет,
+    каждое слово сравнивается целиком с формами из typo_words: кандидаты берутся из индекса
+    удалений, затем проверяется расстояние правки (не больше max_typos от длины формы).
+    """
+
+    def __init__(self, patterns: list[tuple[str, list[str]]], typo_words: dict[str, list[str]] | None = None):
+        self.actions = [action for action, _ in patterns]
+        groups = [
+            f"(?P<p{prio}>{'|'.join(_term_regex(t) for t in terms)})"
+            for prio, (_, terms) in enumerate(patterns)
+        ]
+        self.regex = re.compile(r"(?<!\w)(?:" + "|".join(groups) + ")")
+
+        # индекс опечаток: форма и её варианты без 1–2 букв -> формы
+        self.fuzzy = bool(typo_words)
+        self.fuzzy_index: dict[str, set[str]] = {}
+        self.word_prio: dict[str, int] = {}
+        for prio, action in enumerate(self.actions):
+            for word in (typo_words or {}).get(action, []):
+                self.word_prio[word] = min(prio, self.word_prio.get(word, prio))
+                for variant in _deletes(word, max_typos(len(word))):
+                    self.fuzzy_index.setdefault(variant, set()).add(word)
+
+        # кэш у каждого экземпляра свой: повторяющиеся сообщения отдаются из него
+        self.classify = lru_cache(maxsize=4096)(self._classify)
+
+    def _exact(self, text: str) -> int | None:
+        best = None
+        for m in self.regex.finditer(text):
+            prio = int(m.lastgroup[1:])
+            if best is None or prio < best:
+                best = prio
+                if best == 0:
+                    break
+        return best
+
+    def _fuzzy_word(self, token: str) -> int | None:
+        best = None
+        index = self.fuzzy_index
+        candidates: set[str] = set()
+        for variant in _deletes(token, max_typos(len(token))):
+            candidates |= index.get(variant, set())
+        for word in candidates:
+            prio = self.word_prio[word]
+            if best is not None and prio >= best:
+                continue
+            limit = min(max_typos(len(word)), max_typos(len(token)))
+            if abs(len(word) - len(token)) <= limit and edit_distance(token, word) <= limit:
+                best = prio
+        return best
+
+    def _fuzzy(self, text: str) -> int | None:
+        best = None
+        for token in _WORD_RE.findall(text):
+            if len(token) < FUZZY_MIN_LEN:
+                continue
+            prio = self._fuzzy_word(token)
+            if prio is not None and (best is None or prio < best):
+                best = prio
+                if best == 0:
+                    return best
+        return best
+
+    def _classify(self, text: str) -> str | None:
+        # text уже нормализован; без кэша (classify — то же с кэшем)
+        prio = self._exact(text)
+        if prio is None and self.fuzzy:
+            prio = self._fuzzy(text)
+        return None if prio is None else self.actions[prio]
+
+
+matcher = IntentMatcher(FAQ_PATTERNS, TYPO_WORDS)
+
 
 def classify_message(text: str) -> str | None:
-    t = (text or "").strip()
+    t = normalize(text)
     if not t:
         return None
-    for pattern, action in FAQ_PATTERNS:
-        if pattern.search(t):
-            return action
-    return None
+    return matcher.classify(t)
+
+
+def md_escape(text: str) -> str:
+    # экранирование для legacy Markdown (ParseMode.MARKDOWN)
+    for ch in ("\\", "_", "*", "`", "["):
+        text = text.replace(ch, "\\" + ch)
+    return text
@@ -0,0 +1,91 @@
+import asyncio
+import hmac
+import logging
+from typing import Any, Callable
+
+from aiogram import Bot, Dispatcher
+from aiohttp import web
+
+from app import metrics
+from app.config import settings
+
+log = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def check_webhook_settings():
+    # публичный webhook без секрета принял бы поддельные апдейты (в том числе «от админа»)
+    if settings.WEBHOOK_BASE_URL and not settings.WEBHOOK_SECRET:
+        raise RuntimeError("WEBHOOK_SECRET is required when WEBHOOK_BASE_URL is set")
+
+
+class WebhookServer:
+    """
+    Приём апдейтов по webhook: быстрый 200 сразу после постановки в очередь.
+    submit — неблокирующая постановка (планировщик чатов или, в режиме супервизора, очередь воркера);
+    False — места нет: отвечаем 503, Telegram повторит доставку позже.
+    """
+
+    def __init__(self, bot: Bot, dp: Dispatcher, secret: str, submit: Callable[[dict[str, Any]], bool]):
+        self.bot = bot
+        self.dp = dp
+        self.secret = secret
+        self.submit = submit
+        self.stats = {
+            "received": 0,
+            "accepted": 0,
+            "rejected_full": 0,
+            "unauthorized": 0,
+            "bad_request": 0,
+        }
+        metrics.Gauge(
+            "bot_webhook_updates", "Webhook counters",
+            lambda: {(("event", k),): v for k, v in self.stats.items()},
+        )
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        self.stats["received"] += 1
+        if self.secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            self.stats["unauthorized"] += 1
+            return web.Response(status=401)
+        try:
+            raw = await request.json()
+        except ValueError:
+            self.stats["bad_request"] += 1
+            return web.Response(status=400)
+        if not self.submit(raw):
+            self.stats["rejected_full"] += 1
+            return web.Response(status=503)
+        self.stats["accepted"] += 1
+        return web.Response()
+
+    def make_app(self) -> web.Application:
+        # публичный порт — только приём апдейтов; счётчики (bot_webhook_updates) — на METRICS_HOST:METRICS_PORT
+        app = web.Application()
+        app.router.add_post(settings.WEBHOOK_PATH, self.handle_update)
+        return app
+
+    async def run(self):
+        runner = web.AppRunner(self.make_app())
+        await runner.setup()
+        site = web.TCPSite(runner, settings.WEBHOOK_HOST, settings.WEBHOOK_PORT)
+        await site.start()
+        log.info("webhook listening on %s:%s%s", settings.WEBHOOK_HOST, settings.WEBHOOK_PORT, settings.WEBHOOK_PATH)
+
+        # без публичного URL webhook не регистрируем — удобно для локальной отладки через curl
+        if settings.WEBHOOK_BASE_URL:
+            await self.bot.set_webhook(
+                settings.WEBHOOK_BASE_URL.rstrip("/") + settings.WEBHOOK_PATH,
+                secret_token=self.secret or None,
+                allowed_updates=self.dp.resolve_used_update_types(),
+            )
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher, submit: Callable[[dict[str, Any]], bool]):
+    server = WebhookServer(bot, dp, secret=settings.WEBHOOK_SECRET, submit=submit)
+    await server.run()
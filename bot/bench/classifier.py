@@ -0,0 +1,69 @@
+"""
+Классификатор свободного текста: старый цикл по пяти регуляркам против IntentMatcher.
+Точность на размеченном корпусе (bench/intents_corpus.tsv) и пропускная способность.
+
+    cd bot && BOT_TOKEN=0:bench python -m bench.classifier
+"""
+import re
+import time
+from pathlib import Path
+
+from app.utils import IntentMatcher, FAQ_PATTERNS, TYPO_WORDS, normalize
+
+CORPUS = Path(__file__).with_name("intents_corpus.tsv")
+ROUNDS = 200
+
+LEGACY_PATTERNS = [
+    (re.compile(r"\b(цена|сколько\s+стоит|стоимость|оплата)\b", re.I), "menu:faq"),
+    (re.compile(r"\b(расписани|когда\s+занятия|время|дни)\b", re.I), "menu:about"),
+    (re.compile(r"\b(отзыв|результат|кейсы)\b", re.I), "menu:reviews"),
+    (re.compile(r"\b(запис|хочу\s+заниматься|как\s+попасть)\b", re.I), "lead:start"),
+    (re.compile(r"\b(дз|домашк|провер(ить|ка))\b", re.I), "hw:start"),
+]
+
+
+def legacy_classify(text: str) -> str | None:
+    t = (text or "").strip()
+    if not t:
+        return None
+    for pattern, action in LEGACY_PATTERNS:
+        if pattern.search(t):
+            return action
+    return None
+
+
+def load_corpus() -> list[tuple[str, str | None]]:
+    rows = []
+    for line in CORPUS.read_text(encoding="utf-8").splitlines():
+        if not line.strip() or line.startswith("#"):
+            continue
+        text, label = line.split("\t")
+        rows.append((text, None if label == "-" else label))
+    return rows
+
+
+def report(name: str, classify, corpus):
+    correct = sum(classify(text) == label for text, label in corpus)
+    started = time.perf_counter()
+    for _ in range(ROUNDS):
+        for text, _ in corpus:
+            classify(text)
+    elapsed = time.perf_counter() - started
+    rate = ROUNDS * len(corpus) / elapsed
+    print(f"{name:<26} accuracy {correct}/{len(corpus)} ({correct / len(corpus):.0%})  {rate:>10,.0f} msg/s")
+
+
+def main():
+    corpus = load_corpus()
+    exact = IntentMatcher(FAQ_PATTERNS)
+    fuzzy = IntentMatcher(FAQ_PATTERNS, TYPO_WORDS)
+
+    report("legacy regex loop", legacy_classify, corpus)
+    # без мемоизации — чистая стоимость одного прохода
+    report("matcher (exact)", lambda t: exact._classify(normalize(t)), corpus)
+    report("matcher (exact+typos)", lambda t: fuzzy._classify(normalize(t)), corpus)
+    report("matcher (typos, memoized)", lambda t: fuzzy.classify(normalize(t)), corpus)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Микробенчмарк клавиатур: сборка на каждый вызов (как было) против замороженных синглтонов,
+плюс сериализация reply_markup в форму запроса.
+
+    cd bot && BOT_TOKEN=0:bench python -m bench.keyboards
+"""
+import timeit
+import tracemalloc
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import SendMessage
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from app.keyboards import main_menu, admin_hw_actions
+from app.tg_session import BotSession
+
+N = 20_000
+
+
+def legacy_main_menu() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="📘 О занятиях", callback_data="menu:about")],
+        [InlineKeyboardButton(text="🧪 Мини-диагностика", callback_data="menu:diag")],
+        [InlineKeyboardButton(text="🗓 Записаться в группу", callback_data="lead:start")],
+        [InlineKeyboardButton(text="📝 Проверка ДЗ", callback_data="hw:start")],
+        [InlineKeyboardButton(text="⭐ Отзывы", callback_data="menu:reviews")],
+        [InlineKeyboardButton(text="❓ FAQ", callback_data="menu:faq")],
+        [InlineKeyboardButton(text="💬 Задать вопрос", callback_data="support:ask")],
+    ])
+
+
+def legacy_admin_hw_actions(hw_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text="✅ Принято", callback_data=f"admin:hw:accept:{hw_id}"),
+            InlineKeyboardButton(text="🔁 На доработку", callback_data=f"admin:hw:rework:{hw_id}"),
+        ],
+        [InlineKeyboardButton(text="💬 Комментарий", callback_data=f"admin:hw:comment:{hw_id}")],
+    ])
+
+
+def allocated(fn, n: int = 1000) -> float:
+    # байт, удерживаемых результатом одного вызова
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    keep = [fn() for _ in range(n)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    del keep
+    stats = after.compare_to(before, "filename")
+    return sum(s.size_diff for s in stats) / n
+
+
+def row(name: str, fn):
+    sec = timeit.timeit(fn, number=N)
+    print(f"{name:<34} {sec / N * 1e6:8.2f} µs/call  {allocated(fn):9.0f} B/call")
+
+
+def main():
+    bot = Bot("0:bench")
+    legacy_session, session = AiohttpSession(), BotSession()
+
+    print("build")
+    row("legacy main_menu()", legacy_main_menu)
+    row("frozen main_menu()", main_menu)
+    row("legacy admin_hw_actions(42)", lambda: legacy_admin_hw_actions(42))
+    row("cached admin_hw_actions(42)", lambda: admin_hw_actions(42, 202409))
+
+    print("\nbuild + serialize sendMessage")
+    row("legacy", lambda: legacy_session.build_form_data(
+        bot, SendMessage(chat_id=1, text="hi", reply_markup=legacy_main_menu())))
+    row("frozen + cached JSON", lambda: session.build_form_data(
+        bot, SendMessage(chat_id=1, text="hi", reply_markup=main_menu())))
+
+
+if __name__ == "__main__":
+    main()
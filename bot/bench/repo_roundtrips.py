@@ -0,0 +1,133 @@
+"""
+Сравнение путей записи: старый ORM (get -> изменение -> commit -> refresh) против app.repo.
+Считает SQL-запросы на операцию (включая BEGIN/COMMIT) и среднее время.
+
+Нужен Postgres из docker-compose:
+    cd bot && BOT_TOKEN=0:bench POSTGRES_HOST=localhost python -m bench.repo_roundtrips
+"""
+import asyncio
+import time
+from datetime import datetime
+
+from sqlalchemy import event, select
+
+from app.db import SessionLocal, engine, init_db
+from app.models import Lead, Homework
+from app import repo
+
+N = 200
+statements = 0
+
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def _count(conn, cursor, statement, parameters, context, executemany):
+    global statements
+    statements += 1
+
+
+@event.listens_for(engine.sync_engine, "begin")
+def _count_begin(conn):
+    global statements
+    statements += 1
+
+
+@event.listens_for(engine.sync_engine, "commit")
+def _count_commit(conn):
+    global statements
+    statements += 1
+
+
+LEAD = dict(tg_id=1, student_class="9", goal="ОГЭ", time_pref="вечер", contact="@bench", status="new")
+HW = dict(tg_id=1, student_class="9", topic="алгебра", payload_type="text", payload_text="2+2", status="new")
+
+
+# ---- legacy ----
+
+async def legacy_create_lead():
+    async with SessionLocal() as s:
+        lead = Lead(**LEAD)
+        s.add(lead)
+        await s.commit()
+        await s.refresh(lead)
+        return lead.id
+
+
+async def legacy_set_lead_status(lead_id: int):
+    async with SessionLocal() as s:
+        lead = (await s.scalars(select(Lead).where(Lead.id == lead_id))).one()
+        lead.status = "approved"
+        await s.commit()
+
+
+async def legacy_create_homework():
+    async with SessionLocal() as s:
+        hw = Homework(**HW, updated_at=datetime.utcnow())
+        s.add(hw)
+        await s.commit()
+        await s.refresh(hw)
+        return hw.id
+
+
+async def legacy_set_homework_status(hw_id: int):
+    async with SessionLocal() as s:
+        hw = (await s.scalars(select(Homework).where(Homework.id == hw_id))).one()
+        hw.status = "accepted"
+        hw.updated_at = datetime.utcnow()
+        await s.commit()
+
+
+# ---- repo ----
+
+async def repo_create_lead():
+    async with SessionLocal() as s:
+        lead_id = await repo.create_lead(s, **LEAD)
+        await s.commit()
+        return lead_id
+
+
+async def repo_set_lead_status(lead_id: int):
+    async with SessionLocal() as s:
+        await repo.set_lead_status(s, lead_id, "approved")
+        await s.commit()
+
+
+async def repo_create_homework():
+    async with SessionLocal() as s:
+        hw_id = await repo.create_homework(s, **HW)
+        await s.commit()
+        return hw_id
+
+
+async def repo_set_homework_status(hw_id: int):
+    async with SessionLocal() as s:
+        await repo.set_homework_status(s, hw_id, "accepted")
+        await s.commit()
+
+
+async def measure(name: str, fn, arg=None):
+    global statements
+    statements = 0
+    started = time.perf_counter()
+    for _ in range(N):
+        await (fn(arg) if arg is not None else fn())
+    elapsed = time.perf_counter() - started
+    print(f"{name:<28} {statements / N:5.1f} stmt/op  {elapsed / N * 1000:7.2f} ms/op")
+
+
+async def main():
+    await init_db()
+    lead_id = await repo_create_lead()
+    hw_id = await repo_create_homework()
+    await measure("legacy.create_lead", legacy_create_lead)
+    await measure("repo.create_lead", repo_create_lead)
+    await measure("legacy.set_lead_status", legacy_set_lead_status, lead_id)
+    await measure("repo.set_lead_status", repo_set_lead_status, lead_id)
+    await measure("legacy.create_homework", legacy_create_homework)
+    await measure("repo.create_homework", repo_create_homework)
+    await measure("legacy.set_homework_status", legacy_set_homework_status, hw_id)
+    await measure("repo.set_homework_status", repo_set_homework_status, hw_id)
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())